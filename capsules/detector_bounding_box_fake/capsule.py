@@ -1,9 +1,26 @@
 # Import dependencies
-from vcap import BaseCapsule, NodeDescription, BaseBackend, DetectionNode
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from vcap import (
+    BaseCapsule,
+    NodeDescription,
+    BaseBackend,
+    DetectionNode,
+    FloatOption,
+    OPTION_TYPE,
+    rect_to_coords,
+)
 
 
 # Define the Backend Class
 class Backend(BaseBackend):
+    # If set, the time spent waiting on each batch is observed in it. Tools
+    # like scripts/benchmark_capsule.py set it to a metrics registry, and
+    # BrainFrame leaves it unset, so nothing is measured.
+    metrics = None
+
     # Since this is a fake Backend, we are not going to do any fancy stuff in
     # the constructor.
     def __init__(self, capsule_files, device):
@@ -12,24 +29,50 @@ class Backend(BaseBackend):
 
     # In a real capsule, this function will be performing inference or running
     # algorithms. For this tutorial, we are just going to return a single, fake
-    # bounding box.
+    # bounding box. The frame still goes through batching, so this capsule can
+    # stand in for a real model when measuring performance.
     def process_frame(self, frame, detection_node: None, options, state):
+        # Send the frame to the BrainFrame backend, along with the options that
+        # decide how long the fake inference takes. BrainFrame will group
+        # frames from many streams and call batch_predict() with them.
+        start = time.perf_counter()
+        prediction_future = self.send_to_batch((frame, options))
+
+        # Wait for the fake prediction
+        rect = prediction_future.result()
+        if self.metrics is not None:
+            self.metrics.observe("fake_detector_batch_wait_seconds",
+                                 time.perf_counter() - start)
+
         return [
             DetectionNode(
                 name="fake_box",
-                coords=[[10, 10], [100, 10], [100, 100], [10, 100]]
+                # convert [x1, y1, x2, y2] to [[x1,y1], [x1, y2]...]
+                coords=rect_to_coords(rect)
             )
         ]
 
-    # Batch process can be used to improve the performance, we will skip it in
-    # this example.
-    def batch_predict(self, input_data_list):
-        pass
+    # Batch process can be used to improve the performance. Here we simulate
+    # the cost of running a model on a batch, which is usually a fixed cost
+    # for the batch plus a smaller cost for each frame in it.
+    def batch_predict(
+            self,
+            input_data_list: List[Tuple[np.ndarray, Dict[str, OPTION_TYPE]]]) \
+            -> List[Any]:
+        batch_latency_ms = max(options["batch_latency_ms"]
+                               for _, options in input_data_list)
+        item_latency_ms = sum(options["item_latency_ms"]
+                              for _, options in input_data_list)
+        if batch_latency_ms + item_latency_ms > 0:
+            time.sleep((batch_latency_ms + item_latency_ms) / 1000)
+
+        # One fake [x1, y1, x2, y2] rect for every frame in the batch
+        return [[10, 10, 100, 100] for _ in input_data_list]
 
-    # This function can be implemented to perform clean-up. We can't skip it
-    # for this tutorial
+    # This function can be implemented to perform clean-up. Here we stop the
+    # batching thread started by BaseBackend.
     def close(self) -> None:
-        pass
+        super().close()
 
 
 # Define the Capsule class
@@ -52,4 +95,21 @@ class Capsule(BaseCapsule):
     # defined below
     backend_loader = lambda capsule_files, device: Backend(
         capsule_files=capsule_files, device=device)
-    options = {}
+    # The options for this capsule. They control how long the fake inference
+    # takes, to measure how batch size and concurrency affect throughput. By
+    # default it takes no time, so set them in a load test, like 10 ms per
+    # batch and 2 ms per frame.
+    options = {
+        "batch_latency_ms": FloatOption(
+            description="Simulated time to run a batch, no matter its size",
+            default=0.0,
+            min_val=0.0,
+            max_val=None,
+        ),
+        "item_latency_ms": FloatOption(
+            description="Simulated time added for each frame in a batch",
+            default=0.0,
+            min_val=0.0,
+            max_val=None,
+        ),
+    }
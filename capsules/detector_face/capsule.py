@@ -1,21 +1,668 @@
 # Import dependencies
-from typing import Dict
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import cv2
 import numpy as np
+import tensorflow as tf
 from vcap import (
     BaseCapsule,
     NodeDescription,
     DetectionNode,
     FloatOption,
+    IntOption,
     DETECTION_NODE_TYPE,
     OPTION_TYPE,
     BaseStreamState,
-    rect_to_coords,
 )
-from vcap_utils import TFObjectDetector
+from vcap_utils import BaseTFBackend, parse_dataset_metadata_bytes
+
+# The batch sizes and frame sizes (width, height) the model is run on once
+# while loading, so the first real frames don't pay for TensorFlow's lazy
+# initialization. Every input shape is initialized separately, so only a
+# tiny frame is run by default. Add the batch sizes and resolutions of your
+# streams to warm them up too, and the REGION_SIZES squares if you use
+# reuse_threshold, but keep in mind that a batch of 8 full HD frames takes
+# seconds to run on a CPU, on every load.
+WARMUP_BATCH_SIZES = [1]
+WARMUP_FRAME_SIZES = [(50, 50)]
+
+# In tiled mode, a face cut by a tile's edge is found by each tile as a
+# partial box. Boxes of different tiles are merged into one if their
+# intersection covers more than this fraction of the smaller box.
+TILE_MERGE_THRESHOLD = 0.5
+
+# Frames are compared as small grayscale thumbnails of this (width, height)
+# to decide if the last frame's faces can be reused. A thumbnail pixel counts
+# as changed if its brightness changed by more than the pixel threshold,
+# which ignores sensor noise and compression artifacts.
+SIGNATURE_SIZE = (64, 36)
+SIGNATURE_PIXEL_THRESHOLD = 20
+
+# The part of the frame that changed is grown by the margin, so faces on its
+# edge aren't cut off. The model is then run on a square window of the
+# smallest of these sizes that holds it, so regions of every stream have the
+# same few shapes, which are batched together and can be warmed up.
+REGION_MARGIN = 32
+REGION_SIZES = [256, 512, 768]
+
+
+class Predictions(NamedTuple):
+    """All predictions for one frame, stored as arrays. Index i of each array
+    describes the same prediction.
+    """
+
+    rects: np.ndarray
+    """Shape (n, 4), [x1, y1, x2, y2] in pixels on the frame"""
+
+    confidences: np.ndarray
+    """Shape (n,), the confidence of each prediction from 0 to 1"""
+
+    class_ids: np.ndarray
+    """Shape (n,), the label map id of each prediction"""
+
+
+def postprocess_output(boxes: np.ndarray,
+                       scores: np.ndarray,
+                       classes: np.ndarray,
+                       frame_shape: Tuple[int, ...],
+                       min_confidence: float) -> Predictions:
+    """Converts the raw TensorFlow output for one frame to Predictions,
+    without creating an object for each prediction.
+
+    :param boxes: Shape (n, 4), [y1, x1, y2, x2] relative to the frame size
+    :param scores: Shape (n,), the confidence of each box
+    :param classes: Shape (n,), the label map id of each box
+    :param frame_shape: The shape of the frame, (height, width, channels)
+    :param min_confidence: Boxes with a lower score are dropped
+    :return: The predictions that are confident enough
+    """
+    h, w = frame_shape[:2]
+    keep = scores >= min_confidence
+
+    # Convert the tensorflow format to 'rect' format of [x1, y1, x2, y2]
+    # pixels on frame
+    rects = np.round(boxes[keep][:, [1, 0, 3, 2]] * [w, h, w, h])
+
+    return Predictions(rects=rects.astype(np.int64),
+                       confidences=scores[keep].astype(np.float64),
+                       class_ids=classes[keep].astype(np.int64))
+
+
+def rects_to_coords(rects: np.ndarray) -> np.ndarray:
+    """Converts rects in the [x1, y1, x2, y2] format to coordinates, like
+    vcap.rect_to_coords but for many rects at once.
+
+    :param rects: Shape (n, 4)
+    :return: Shape (n, 4, 2), [[x1,y1], [x2, y1], [x2, y2], [x1, y2]]
+    """
+    return rects[:, [[0, 1], [2, 1], [2, 3], [0, 3]]]
+
+
+def non_max_suppression(rects: np.ndarray,
+                        confidences: np.ndarray,
+                        iou_threshold: float) -> np.ndarray:
+    """Removes duplicate boxes. Starting from the most confident box, every
+    box that overlaps with a kept box by more than iou_threshold is dropped.
+
+    :param rects: Shape (n, 4), [x1, y1, x2, y2]
+    :param confidences: Shape (n,)
+    :param iou_threshold: The max intersection over union allowed between two
+        kept boxes. 1 keeps every box.
+    :return: The indexes of the kept boxes, in their original order
+    """
+    # Compute the intersection over union of every pair of boxes at once
+    x1, y1, x2, y2 = rects.astype(np.float64).T
+    areas = (x2 - x1) * (y2 - y1)
+    intersection_w = np.minimum(x2[:, None], x2[None, :]) \
+        - np.maximum(x1[:, None], x1[None, :])
+    intersection_h = np.minimum(y2[:, None], y2[None, :]) \
+        - np.maximum(y1[:, None], y1[None, :])
+    intersections = intersection_w.clip(min=0) * intersection_h.clip(min=0)
+    unions = areas[:, None] + areas[None, :] - intersections
+    overlapping = intersections \
+        > iou_threshold * np.maximum(unions, np.finfo(np.float64).eps)
+
+    # Keep boxes from the most confident down, dropping any box that overlaps
+    # a box that was already kept
+    suppressed = np.zeros(len(rects), dtype=bool)
+    keep = []
+    for index in np.argsort(-confidences, kind="stable"):
+        if suppressed[index]:
+            continue
+        keep.append(index)
+        suppressed |= overlapping[index]
+
+    return np.sort(np.array(keep, dtype=np.intp))
+
+
+def predictions_to_detections(predictions: Predictions,
+                              class_id: int,
+                              threshold: float,
+                              iou_threshold: float) -> List[DetectionNode]:
+    """
+    :param predictions: All predictions for a frame
+    :param class_id: The label map id of the class to keep
+    :param threshold: Predictions with a lower confidence are dropped
+    :param iou_threshold: Predictions that overlap a more confident one by
+        more than this are dropped as duplicates
+    :return: A DetectionNode for every prediction that was kept
+    """
+    # Filter out detections that are not a face, or that have a low
+    # confidence, all at once
+    keep = ((predictions.class_ids == class_id)
+            & (predictions.confidences >= threshold))
+    rects = predictions.rects[keep]
+    confidences = predictions.confidences[keep]
+
+    # Drop duplicate faces, so capsules that run on each face don't process
+    # the same face twice
+    if iou_threshold < 1:
+        keep = non_max_suppression(rects, confidences, iou_threshold)
+        rects = rects[keep]
+        confidences = confidences[keep]
+
+    coords = rects_to_coords(rects)
+
+    # Create a DetectionNode for each prediction that was kept. It will be
+    # reused by any other capsules that require a face DetectionNode in their
+    # input type. An age classifier capsule would be an example of such a
+    # capsule.
+    return [
+        DetectionNode(
+            name="face",
+            coords=detection_coords,
+            extra_data={"detection_confidence": confidence}
+        )
+        for detection_coords, confidence
+        in zip(coords.tolist(), confidences.tolist())
+    ]
+
+
+def make_tiles(frame_shape: Tuple[int, ...],
+               tile_size: int,
+               tile_overlap: float) -> np.ndarray:
+    """Splits a frame into overlapping square tiles of the same size. The last
+    tile of each row and column is moved back to end at the frame's edge.
+
+    :param frame_shape: The shape of the frame, (height, width, channels)
+    :param tile_size: The width and height of each tile, in pixels
+    :param tile_overlap: How much neighboring tiles overlap, as a fraction of
+        the tile size
+    :return: Shape (n, 4), the [x1, y1, x2, y2] rect of each tile
+    """
+
+    # Helper function to get the start of each tile along one axis
+    def _starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        stride = max(1, int(tile_size * (1 - tile_overlap)))
+        starts = list(range(0, length - tile_size, stride))
+        return starts + [length - tile_size]
+
+    h, w = frame_shape[:2]
+    return np.array([[x1, y1, min(x1 + tile_size, w), min(y1 + tile_size, h)]
+                     for y1 in _starts(h) for x1 in _starts(w)],
+                    dtype=np.int64)
+
+
+def merge_tile_predictions(tile_predictions: List[Predictions],
+                           tiles: np.ndarray) -> Predictions:
+    """
+    :param tile_predictions: The predictions of each tile
+    :param tiles: Shape (n, 4), the rect of each tile, as made by make_tiles
+    :return: The predictions of all tiles, in frame coordinates. Faces found
+        by more than one tile are still duplicated, see merge_tile_duplicates.
+    """
+    # Move each rect from tile coordinates to frame coordinates
+    rects = [predictions.rects + tile[[0, 1, 0, 1]]
+             for predictions, tile in zip(tile_predictions, tiles)]
+    return Predictions(
+        rects=np.concatenate(rects),
+        confidences=np.concatenate([predictions.confidences
+                                    for predictions in tile_predictions]),
+        class_ids=np.concatenate([predictions.class_ids
+                                  for predictions in tile_predictions]))
+
+
+def merge_tile_duplicates(predictions: Predictions,
+                          tile_ids: np.ndarray,
+                          min_confidence: float,
+                          merge_threshold: float = TILE_MERGE_THRESHOLD) \
+        -> Predictions:
+    """Merges the boxes that different tiles found for the same face. A face
+    cut by a tile's edge is only partly in that tile, so its box has a low
+    intersection over union with the full box, but it's mostly covered by
+    it. Boxes are compared by their intersection over the smaller box
+    instead, and a merged box grows to hold every box merged into it.
+
+    :param predictions: The predictions of every tile, in frame coordinates
+    :param tile_ids: Shape (n,), the tile each prediction was found in
+    :param min_confidence: Predictions with a lower confidence are left as
+        they are, so they can't grow the boxes of confident faces
+    :param merge_threshold: The fraction of the smaller box two boxes must
+        share to be merged
+    :return: The predictions with duplicates merged, most confident first
+    """
+    rects = predictions.rects.copy()
+    areas = (rects[:, 2] - rects[:, 0]) * (rects[:, 3] - rects[:, 1])
+    candidates = predictions.confidences >= min_confidence
+
+    # Starting from the most confident box, boxes of other tiles are merged
+    # into it until none is left that overlaps the merged box enough. The
+    # merged box is compared again after growing, since two partial boxes on
+    # either side of a tile edge may only both overlap the whole face.
+    merged = np.zeros(len(rects), dtype=bool)
+    keep = []
+    for index in np.argsort(-predictions.confidences, kind="stable"):
+        if merged[index]:
+            continue
+        keep.append(index)
+        merged[index] = True
+        if not candidates[index]:
+            continue
+
+        group_tiles = {tile_ids[index]}
+        while True:
+            rect = rects[index]
+            intersection_w = np.minimum(rect[2], rects[:, 2]) \
+                - np.maximum(rect[0], rects[:, 0])
+            intersection_h = np.minimum(rect[3], rects[:, 3]) \
+                - np.maximum(rect[1], rects[:, 1])
+            intersections = intersection_w.clip(min=0) \
+                * intersection_h.clip(min=0)
+            rect_area = (rect[2] - rect[0]) * (rect[3] - rect[1])
+            smaller = np.maximum(np.minimum(areas, rect_area), 1)
+            duplicates = (candidates & ~merged
+                          & (intersections > merge_threshold * smaller)
+                          & (predictions.class_ids
+                             == predictions.class_ids[index])
+                          & ~np.isin(tile_ids, list(group_tiles)))
+            if not duplicates.any():
+                break
+
+            group = rects[duplicates]
+            rects[index, :2] = np.minimum(rect[:2], group[:, :2].min(axis=0))
+            rects[index, 2:] = np.maximum(rect[2:], group[:, 2:].max(axis=0))
+            merged |= duplicates
+            group_tiles.update(tile_ids[duplicates].tolist())
+
+    keep = np.array(keep, dtype=np.intp)
+    return Predictions(rects=rects[keep],
+                       confidences=predictions.confidences[keep],
+                       class_ids=predictions.class_ids[keep])
+
+
+def frame_signature(frame: np.ndarray) -> np.ndarray:
+    """
+    :param frame: A BGR frame
+    :return: A small grayscale thumbnail of the frame, see SIGNATURE_SIZE
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    # Area interpolation averages out noise while shrinking
+    return cv2.resize(gray, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def changed_region(changed: np.ndarray,
+                   frame_shape: Tuple[int, ...]) -> np.ndarray:
+    """
+    :param changed: The changed pixels of a frame's signature, as a boolean
+        array of the signature's shape. At least one must be True.
+    :param frame_shape: The shape of the frame, (height, width, channels)
+    :return: The [x1, y1, x2, y2] rect in the frame that holds every changed
+        pixel, grown by REGION_MARGIN
+    """
+    h, w = frame_shape[:2]
+    scale_x = w / changed.shape[1]
+    scale_y = h / changed.shape[0]
+    ys, xs = np.nonzero(changed)
+
+    x1 = xs.min() * scale_x - REGION_MARGIN
+    y1 = ys.min() * scale_y - REGION_MARGIN
+    x2 = (xs.max() + 1) * scale_x + REGION_MARGIN
+    y2 = (ys.max() + 1) * scale_y + REGION_MARGIN
+
+    return np.array([max(np.floor(x1), 0), max(np.floor(y1), 0),
+                     min(np.ceil(x2), w), min(np.ceil(y2), h)],
+                    dtype=np.int64)
+
+
+def region_window(region: np.ndarray,
+                  cached_rects: np.ndarray,
+                  frame_shape: Tuple[int, ...]) -> Optional[np.ndarray]:
+    """Finds the window to run the model on for a changed region. The window
+    must not cut any face of the last frame, since the model would only see
+    part of it, so the region is grown to hold every cached face the window
+    touches until none is cut.
+
+    :param region: The [x1, y1, x2, y2] rect of the frame that changed
+    :param cached_rects: Shape (n, 4), the faces of the last frame
+    :param frame_shape: The shape of the frame, (height, width, channels)
+    :return: The [x1, y1, x2, y2] window, a square of one of REGION_SIZES
+        unless the frame is smaller, or None if the region doesn't fit in any
+    """
+    h, w = frame_shape[:2]
+    rects = cached_rects.clip(0, [w, h, w, h])
+    while True:
+        x1, y1, x2, y2 = region
+        size = next((size for size in REGION_SIZES
+                     if x2 - x1 <= size and y2 - y1 <= size), None)
+        if size is None:
+            return None
+
+        # Center the window on the region, then move it into the frame
+        window_w, window_h = min(size, w), min(size, h)
+        window_x1 = int(np.clip((x1 + x2 - window_w) // 2, 0, w - window_w))
+        window_y1 = int(np.clip((y1 + y2 - window_h) // 2, 0, h - window_h))
+        window = np.array([window_x1, window_y1,
+                           window_x1 + window_w, window_y1 + window_h],
+                          dtype=np.int64)
+
+        touching = rects[(rects[:, 0] < window[2]) & (rects[:, 2] > window[0])
+                         & (rects[:, 1] < window[3])
+                         & (rects[:, 3] > window[1])]
+        grown = np.concatenate([np.minimum(region[:2],
+                                           touching[:, :2].min(axis=0,
+                                                               initial=w)),
+                                np.maximum(region[2:],
+                                           touching[:, 2:].max(axis=0,
+                                                               initial=0))])
+        if np.array_equal(grown, region):
+            return window
+        region = grown
+
+
+def replace_region(cached: Predictions, region: np.ndarray,
+                   region_predictions: Predictions) -> Predictions:
+    """
+    :param cached: The predictions of an earlier frame
+    :param region: The [x1, y1, x2, y2] rect the model was run on again
+    :param region_predictions: The new predictions in the region, in frame
+        coordinates
+    :return: The cached predictions that are entirely outside of the region,
+        and the new predictions
+    """
+    x1, y1, x2, y2 = region
+    rects = cached.rects
+    outside = ((rects[:, 2] <= x1) | (rects[:, 0] >= x2)
+               | (rects[:, 3] <= y1) | (rects[:, 1] >= y2))
+    return Predictions(
+        rects=np.concatenate([rects[outside], region_predictions.rects]),
+        confidences=np.concatenate([cached.confidences[outside],
+                                    region_predictions.confidences]),
+        class_ids=np.concatenate([cached.class_ids[outside],
+                                  region_predictions.class_ids]))
+
+
+class StreamState(BaseStreamState):
+    """Remembers the predictions of the last frame of a stream the model was
+    run on, and a signature of that frame. Frames that barely changed reuse
+    the predictions, which cuts the amount of inference on static cameras.
+
+    Each stream only keeps one set of predictions and one small signature.
+    The states of streams that haven't sent a frame in a while, and of the
+    least recently used streams past max_cached_streams, are cleared.
+    """
+
+    max_cached_streams = 1000
+    """The max number of streams to keep predictions for"""
+
+    max_idle_seconds = 300.0
+    """How long a stream can go without frames before its cache is cleared"""
+
+    # The states with a cache, least recently used first. They're weakly
+    # referenced, since BrainFrame drops the state of a stream once it's
+    # removed.
+    _recent: "OrderedDict[int, weakref.ref]" = OrderedDict()
+    _recent_lock = threading.Lock()
+
+    def __init__(self):
+        # BrainFrame may create a state and throw it away right after, so
+        # nothing is allocated until the first frame
+        self.signature: Optional[np.ndarray] = None
+        self.predictions: Optional[Predictions] = None
+        self.frame_shape: Optional[Tuple[int, ...]] = None
+        self.frames_since_inference = 0
+        self.last_used = 0.0
+
+        self.frames_seen = 0
+        self.frames_reused = 0
+        self.frames_region_only = 0
+
+    def store(self, signature: np.ndarray, predictions: Predictions,
+              frame_shape: Tuple[int, ...]) -> None:
+        self.signature = signature
+        self.predictions = predictions
+        self.frame_shape = frame_shape
+        self.touch()
+
+    def clear(self) -> None:
+        self.signature = None
+        self.predictions = None
+        self.frame_shape = None
+
+    def touch(self) -> None:
+        """Marks the stream as used, and clears the caches of the streams
+        that have been idle too long or are past max_cached_streams
+        """
+        now = time.monotonic()
+        self.last_used = now
+        with StreamState._recent_lock:
+            recent = StreamState._recent
+            recent[id(self)] = weakref.ref(self)
+            recent.move_to_end(id(self))
+
+            while len(recent) > 0:
+                key, state_ref = next(iter(recent.items()))
+                state = state_ref()
+                if state is not None \
+                        and len(recent) <= self.max_cached_streams \
+                        and now - state.last_used <= self.max_idle_seconds:
+                    break
+                del recent[key]
+                if state is not None:
+                    state.clear()
+
+
+class LoadTimings(NamedTuple):
+    """How long each step of loading a backend took, in seconds"""
+
+    parse: float
+    """Parsing the model bytes. 0 if another backend already parsed them."""
+
+    import_graph: float
+    """Importing the graph onto the device and creating the session"""
+
+    warmup: Dict[Tuple[int, int, int], float]
+    """Running the first batch of each (batch size, width, height)"""
+
+    @property
+    def total(self) -> float:
+        return self.parse + self.import_graph + sum(self.warmup.values())
+
+
+class _SharedGraphDef:
+    """A parsed model, and the number of backends using it"""
+
+    def __init__(self, model_bytes: bytes,
+                 graph_def: tf.compat.v1.GraphDef):
+        # The bytes are kept so their ID can't be reused while this exists
+        self.model_bytes = model_bytes
+        self.graph_def = graph_def
+        self.users = 0
+
+
+# Parsed models are shared between the backends of every device. BrainFrame
+# passes every device the same capsule files, so models are looked up by the
+# identity of their bytes, which doesn't need them to be hashed. A parsed
+# model is dropped once the last backend using it is closed.
+_graph_defs: Dict[int, _SharedGraphDef] = {}
+_graph_defs_lock = threading.Lock()
+
+
+# Helper function to parse the model bytes, or reuse an earlier parse
+def acquire_graph_def(model_bytes: bytes) \
+        -> Tuple[tf.compat.v1.GraphDef, bool]:
+    """
+    :param model_bytes: The bytes of a frozen TensorFlow model
+    :return: The parsed model, and True if it was parsed by this call. Call
+        release_graph_def once it isn't needed anymore.
+    """
+    with _graph_defs_lock:
+        shared = _graph_defs.get(id(model_bytes))
+        parsed = shared is None
+        if parsed:
+            graph_def = tf.compat.v1.GraphDef()
+            graph_def.ParseFromString(model_bytes)
+            shared = _SharedGraphDef(model_bytes, graph_def)
+            _graph_defs[id(model_bytes)] = shared
+        shared.users += 1
+        return shared.graph_def, parsed
+
+
+# Helper function to drop a parsed model once no backend uses it
+def release_graph_def(model_bytes: bytes) -> None:
+    with _graph_defs_lock:
+        shared = _graph_defs.get(id(model_bytes))
+        if shared is None or shared.model_bytes is not model_bytes:
+            return
+        shared.users -= 1
+        if shared.users <= 0:
+            del _graph_defs[id(model_bytes)]
 
 
 # Define the Backend Class
-class Backend(TFObjectDetector):
+class Backend(BaseTFBackend):
+    metrics = None
+    """If set, the time spent in each step of process_frame is observed in it.
+    Tools like scripts/benchmark_capsule.py set it to a metrics registry,
+    which only needs observe(name, seconds). BrainFrame leaves it unset, so
+    nothing is measured.
+    """
+
+    def __init__(self, model_bytes: bytes, metadata_bytes: bytes,
+                 device: str = None,
+                 warmup_batch_sizes: Sequence[int] = (1,),
+                 warmup_frame_sizes: Sequence[Tuple[int, int]] = ((50, 50),),
+                 confidence_thresh: float = 0.05):
+        """
+        :param model_bytes: The bytes of the frozen model
+        :param metadata_bytes: The bytes of the dataset metadata, with the
+            label map
+        :param device: The device to load the model onto, like "GPU:0"
+        :param warmup_batch_sizes: The batch sizes to run once while loading
+        :param warmup_frame_sizes: The frame sizes (width, height) to run each
+            warm-up batch size with
+        :param confidence_thresh: Predictions with a lower confidence are
+            dropped before post-processing
+        """
+        # The model is loaded here instead of by vcap_utils'
+        # TFObjectDetector, which always parses the model bytes itself
+        super().__init__()
+        self.min_confidence = confidence_thresh
+        self.label_map = parse_dataset_metadata_bytes(metadata_bytes)
+
+        start = time.perf_counter()
+        graph_def, parsed = acquire_graph_def(model_bytes)
+        self._model_bytes = model_bytes
+        parse_time = time.perf_counter() - start if parsed else 0.0
+
+        # The graph itself can't be shared, since the device of every op is
+        # set when it's imported
+        start = time.perf_counter()
+        self.graph = tf.Graph()
+        with self.graph.as_default(), tf.device(device):
+            tf.import_graph_def(graph_def, name="")
+
+        session_config = tf.compat.v1.ConfigProto()
+        if device is not None:
+            # Ops that can't run on the device are placed on the CPU instead
+            session_config.allow_soft_placement = True
+        self.session = tf.compat.v1.Session(graph=self.graph,
+                                            config=session_config)
+
+        self.image_tensor = self.graph.get_tensor_by_name("image_tensor:0")
+        self.boxes_tensor = self.graph.get_tensor_by_name(
+            "detection_boxes:0")
+        self.scores_tensor = self.graph.get_tensor_by_name(
+            "detection_scores:0")
+        self.classes_tensor = self.graph.get_tensor_by_name(
+            "detection_classes:0")
+        import_time = time.perf_counter() - start
+
+        # Compare predictions by label id instead of by name
+        self.face_class_id = next(class_id for class_id, name
+                                  in self.label_map.items() if name == "face")
+
+        warmup_times = self._warm_up(warmup_batch_sizes, warmup_frame_sizes)
+        self.load_timings = LoadTimings(parse=parse_time,
+                                        import_graph=import_time,
+                                        warmup=warmup_times)
+        logging.info(
+            f"Loaded face detector onto {device}: parse "
+            f"{parse_time * 1000:.0f} ms, import "
+            f"{import_time * 1000:.0f} ms, warm-up "
+            f"{sum(warmup_times.values()) * 1000:.0f} ms")
+
+    def _warm_up(self, batch_sizes: Sequence[int],
+                 frame_sizes: Sequence[Tuple[int, int]]) \
+            -> Dict[Tuple[int, int, int], float]:
+        """TensorFlow models run the first batch of every input shape slowly,
+        because of lazy initialization. Blank batches of every shape are run
+        here, so that cost is paid while loading instead of by the first
+        frames.
+
+        :return: How long each (batch size, width, height) took, in seconds
+        """
+        timings = {}
+        for width, height in frame_sizes:
+            frame = np.zeros((height, width, 3), dtype=np.uint8)
+            for batch_size in sorted(set(batch_sizes)):
+                # Run the batch directly, instead of through send_to_batch,
+                # so it isn't merged with any other batch
+                start = time.perf_counter()
+                self.batch_predict([frame] * batch_size)
+                timings[(batch_size, width, height)] = \
+                    time.perf_counter() - start
+        return timings
+
+    def batch_predict(self, frames: List[np.ndarray]) -> List[Predictions]:
+        """Runs the model on frames of any size. TensorFlow can only run
+        frames of the same shape together, so frames are grouped by shape.
+
+        :param frames: BGR frames
+        :return: The predictions of each frame, in the same order as frames
+        """
+        indexes_by_shape: Dict[Tuple[int, ...], List[int]] = {}
+        for index, frame in enumerate(frames):
+            indexes_by_shape.setdefault(frame.shape, []).append(index)
+
+        results: List[Optional[Predictions]] = [None] * len(frames)
+        for shape, indexes in indexes_by_shape.items():
+            # The model takes RGB frames
+            batch = np.stack([frames[index][..., ::-1] for index in indexes])
+            all_boxes, all_scores, all_classes = self.session.run(
+                [self.boxes_tensor, self.scores_tensor, self.classes_tensor],
+                feed_dict={self.image_tensor: batch})
+
+            # Keep the predictions of each frame as arrays instead of
+            # creating a DetectionPrediction object for each of them
+            for batch_index, index in enumerate(indexes):
+                results[index] = postprocess_output(
+                    all_boxes[batch_index],
+                    all_scores[batch_index],
+                    all_classes[batch_index],
+                    frame_shape=shape,
+                    min_confidence=self.min_confidence)
+        return results
+
+    def close(self) -> None:
+        super().close()
+        release_graph_def(self._model_bytes)
+
     def process_frame(self, frame: np.ndarray,
                       detection_node: None,
                       options: Dict[str, OPTION_TYPE],
@@ -24,41 +671,154 @@ class Backend(TFObjectDetector):
         :param frame: A numpy array of shape (height, width, 3)
         :param detection_node: None
         :param options: Example: {"threshold": 0.5}. Defined in Capsule class above.
-        :param state: (Unused in this capsule)
+        :param state: The stream's StreamState, which holds the faces of its
+            last frame when reuse_threshold is set
         :return: A list of detections
         """
 
-        # Send the frame to the BrainFrame backend. This function will return a
-        # queue. BrainFrame will batch_process() received frames and populate
-        # the queue with the results.
-        prediction_output_queue = self.send_to_batch(frame)
-
-        # Wait for predictions
-        predictions = prediction_output_queue.get()
-
-        # Iterate through all the predictions received in this frame
-        detection_nodes = []
-        for prediction in predictions:
-            # Filter out detections that is not a face.
-            if prediction.name != "face":
-                continue
-            # Filter out detection with low confidence.
-            if prediction.confidence < options["threshold"]:
-                continue
-
-            # Create a DetectionNode for the prediction. It will be reused by
-            # any other capsules that require a face DetectionNode in their
-            # input type. An age classifier capsule would be an example of such
-            # a capsule.
-            new_detection = DetectionNode(
-                name=prediction.name,
-                # convert [x1, y1, x2, y2] to [[x1,y1], [x1, y2]...]
-                coords=rect_to_coords(prediction.rect),
-                extra_data={"detection_confidence": prediction.confidence}
-            )
-            detection_nodes.append(new_detection)
-
-        return detection_nodes
+        if options["reuse_threshold"] > 0 and isinstance(state, StreamState):
+            predictions = self._predict_cached(frame, options, state)
+        else:
+            predictions = self._predict(frame, options)
+
+        # Drop faces with a low confidence, and duplicates
+        start = time.perf_counter()
+        detections = predictions_to_detections(
+            predictions,
+            class_id=self.face_class_id,
+            threshold=options["threshold"],
+            iou_threshold=options["iou_threshold"])
+
+        if self.metrics is not None:
+            self.metrics.observe("face_detector_postprocess_seconds",
+                                 time.perf_counter() - start)
+        return detections
+
+    def _wait_for_batch(self, frames: List[np.ndarray]) -> List[Predictions]:
+        """Sends frames to the BrainFrame backend to be batched with other
+        frames, and waits for their predictions.
+
+        :param frames: The frames to run the model on
+        :return: The predictions of each frame
+        """
+        # Send every frame before waiting on any of them, so they can be
+        # batched together. send_to_batch returns a future, and BrainFrame
+        # will batch_predict() received frames and set its result.
+        prediction_futures = [self.send_to_batch(frame) for frame in frames]
+
+        # The wait includes the time the frames spent queued behind other
+        # frames, and running the model
+        start = time.perf_counter()
+        predictions = [future.result() for future in prediction_futures]
+        if self.metrics is not None:
+            self.metrics.observe("face_detector_batch_wait_seconds",
+                                 time.perf_counter() - start)
+        return predictions
+
+    def _predict(self, frame: np.ndarray,
+                 options: Dict[str, OPTION_TYPE]) -> Predictions:
+        if options["tile_size"] > 0:
+            return self._predict_tiled(
+                frame,
+                tile_size=options["tile_size"],
+                tile_overlap=options["tile_overlap"],
+                min_confidence=options["threshold"])
+
+        # Send the frame to the BrainFrame backend and wait for predictions
+        return self._wait_for_batch([frame])[0]
+
+    def _predict_cached(self, frame: np.ndarray,
+                        options: Dict[str, OPTION_TYPE],
+                        state: StreamState) -> Predictions:
+        """Reuses the predictions of the stream's last frame if the frame
+        barely changed, and only runs the model on the part of the frame that
+        changed if it's small enough. Otherwise, the model is run on the whole
+        frame.
+        """
+        state.frames_seen += 1
+        signature = frame_signature(frame)
+
+        # Read the cache once, since another stream can clear it at any time
+        cached = state.predictions
+        reference = state.signature
+        if cached is None or reference is None \
+                or state.frame_shape != frame.shape \
+                or state.frames_since_inference >= options["max_reuse_frames"]:
+            predictions = self._predict(frame, options)
+            state.frames_since_inference = 0
+            state.store(signature, predictions, frame.shape)
+            return predictions
+
+        # Frames are compared against the last frame the model ran on, not
+        # the last frame, so slow changes add up until they're noticed
+        changed = cv2.absdiff(signature, reference) \
+            > SIGNATURE_PIXEL_THRESHOLD
+        state.frames_since_inference += 1
+        if changed.mean() < options["reuse_threshold"]:
+            state.frames_reused += 1
+            state.touch()
+            return cached
+
+        # Run the model on only the part of the frame that changed, if it's
+        # small. Tiles are already smaller than the frame, so this is skipped
+        # in tiled mode.
+        region = None
+        if options["tile_size"] == 0:
+            region = region_window(changed_region(changed, frame.shape),
+                                   cached.rects, frame.shape)
+        max_region_area = options["max_region_fraction"] \
+            * frame.shape[0] * frame.shape[1]
+        if region is None or (region[2] - region[0]) \
+                * (region[3] - region[1]) > max_region_area:
+            predictions = self._predict(frame, options)
+            state.frames_since_inference = 0
+            state.store(signature, predictions, frame.shape)
+            return predictions
+
+        x1, y1, x2, y2 = region
+        region_predictions = self._wait_for_batch([frame[y1:y2, x1:x2]])[0]
+        predictions = replace_region(
+            cached, region,
+            merge_tile_predictions([region_predictions], region[None]))
+
+        # Only the region is up to date in the reference signature now. The
+        # rest of the frame still has to be compared against the old one.
+        # The margin makes sure every changed pixel is fully in the region.
+        h, w = frame.shape[:2]
+        signature_h, signature_w = signature.shape
+        sx1 = int(np.ceil(x1 * signature_w / w))
+        sy1 = int(np.ceil(y1 * signature_h / h))
+        sx2 = int(x2 * signature_w // w)
+        sy2 = int(y2 * signature_h // h)
+        reference = reference.copy()
+        reference[sy1:sy2, sx1:sx2] = signature[sy1:sy2, sx1:sx2]
+
+        state.frames_region_only += 1
+        state.store(reference, predictions, frame.shape)
+        return predictions
+
+    def _predict_tiled(self, frame: np.ndarray,
+                       tile_size: int,
+                       tile_overlap: float,
+                       min_confidence: float) -> Predictions:
+        """Runs the model on full resolution tiles of the frame, so small faces
+        aren't lost when the frame is downscaled by the model. Faces found by
+        more than one tile are merged, whatever the iou_threshold option is.
+        """
+        tiles = make_tiles(frame.shape, tile_size, tile_overlap)
+
+        # The tiles are batched together. All tiles have the same size, so
+        # TensorFlow can run them as a single batch.
+        tile_predictions = self._wait_for_batch(
+            [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in tiles])
+
+        tile_ids = np.repeat(np.arange(len(tiles)),
+                             [len(predictions.rects)
+                              for predictions in tile_predictions])
+        return merge_tile_duplicates(
+            merge_tile_predictions(tile_predictions, tiles),
+            tile_ids=tile_ids,
+            min_confidence=min_confidence)
 
 
 # Define the Capsule class
@@ -83,20 +843,75 @@ class Capsule(BaseCapsule):
         extra_data=["detection_confidence"]
     )
 
-    # Define the backend_loader
+    # Each stream keeps the predictions of its last frame, to reuse them when
+    # the frame barely changed. This is only used if reuse_threshold is set.
+    stream_state = StreamState
+
+    # Define the backend_loader. Every device gets its own backend, but they
+    # all share the parsed model, and are warmed up before being used.
     backend_loader = lambda capsule_files, device: Backend(
         device=device,
         model_bytes=capsule_files["detector.pb"],
-        metadata_bytes=capsule_files["dataset_metadata.json"])
+        metadata_bytes=capsule_files["dataset_metadata.json"],
+        warmup_batch_sizes=WARMUP_BATCH_SIZES,
+        warmup_frame_sizes=WARMUP_FRAME_SIZES)
 
     # The options for this capsule. In this example, we will allow the user to
-    # set a threshold for the minimum detection confidence. This can be adjusted
-    # using the BrainFrame client or through REST API.
+    # set a threshold for the minimum detection confidence, and how much two
+    # faces can overlap before one is dropped as a duplicate. These can be
+    # adjusted using the BrainFrame client or through REST API.
     options = {
         "threshold": FloatOption(
             description="Filter out bad detections",
             default=0.5,
             min_val=0.0,
             max_val=1.0,
-        )
+        ),
+        "iou_threshold": FloatOption(
+            description="Filter out faces that overlap a more confident face "
+                        "by more than this. 1.0 keeps all faces.",
+            default=0.5,
+            min_val=0.0,
+            max_val=1.0,
+        ),
+        "tile_size": IntOption(
+            description="Run the model on square tiles of this many pixels "
+                        "instead of the whole frame, to find small faces in "
+                        "high resolution video. 0 uses the whole frame.",
+            default=0,
+            min_val=0,
+            max_val=None,
+        ),
+        "tile_overlap": FloatOption(
+            description="How much neighboring tiles overlap, as a fraction "
+                        "of the tile size",
+            default=0.2,
+            min_val=0.0,
+            max_val=0.9,
+        ),
+        "reuse_threshold": FloatOption(
+            description="Reuse the faces of the stream's last frame if less "
+                        "than this fraction of the frame changed, to save "
+                        "inference on static cameras. 0 runs the model on "
+                        "every frame.",
+            default=0.0,
+            min_val=0.0,
+            max_val=1.0,
+        ),
+        "max_reuse_frames": IntOption(
+            description="With reuse_threshold, run the model on the whole "
+                        "frame at least once every this many frames",
+            default=30,
+            min_val=1,
+            max_val=None,
+        ),
+        "max_region_fraction": FloatOption(
+            description="With reuse_threshold, only run the model on the "
+                        "part of the frame that changed if it's at most this "
+                        "fraction of the frame. 0 always runs the model on "
+                        "the whole frame.",
+            default=0.5,
+            min_val=0.0,
+            max_val=1.0,
+        ),
     }
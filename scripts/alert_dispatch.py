@@ -0,0 +1,341 @@
+# Import the dependencies
+import json
+import logging
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from queue import Empty, Full, Queue
+from typing import Callable, List, NamedTuple, Optional
+
+from brainframe.api import bf_codecs
+
+
+class AlertNotification(NamedTuple):
+    """A finished alert, ready to be sent to the notification sinks"""
+
+    alert: bf_codecs.Alert
+    """The alert that finished"""
+
+    alarm_name: str
+    """The name of the alarm that raised the alert"""
+
+    duration: float
+    """How long the alert lasted, in seconds"""
+
+    def to_message(self) -> str:
+        return (f"BrainFrame Alert: {self.alarm_name} \n"
+                f"Duration {self.duration}")
+
+
+class NotificationSink(ABC):
+    """Somewhere that alert notifications are sent to. Sinks are called from
+    the dispatcher's worker threads.
+    """
+
+    @abstractmethod
+    def send(self, notification: AlertNotification) -> None:
+        """Sends a notification, raising an error if it couldn't be sent"""
+
+    def close(self) -> None:
+        pass
+
+
+class WeChatSink(NotificationSink):
+    """Sends notifications as WeChat messages. The WeChat account must already
+    be logged in with itchat.auto_login().
+    """
+
+    def __init__(self, to_user_name: str = "filehelper"):
+        """
+        :param to_user_name: Who to send the messages to
+        """
+        # itchat is only needed when notifications are sent through WeChat
+        import itchat
+        self._wechat = itchat
+        self.to_user_name = to_user_name
+
+    def send(self, notification: AlertNotification) -> None:
+        self._wechat.send_msg(notification.to_message(),
+                              toUserName=self.to_user_name)
+
+
+class WebhookSink(NotificationSink):
+    """POSTs notifications as JSON to a URL"""
+
+    def __init__(self, url: str, timeout: float = 10):
+        """
+        :param url: The URL to POST to
+        :param timeout: The timeout of each request, in seconds
+        """
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, notification: AlertNotification) -> None:
+        data = json.dumps({
+            "alarm_name": notification.alarm_name,
+            "duration": notification.duration,
+            "alert": notification.alert.to_dict(),
+        }).encode("utf-8")
+        request = urllib.request.Request(
+            self.url, data=data,
+            headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class FileSink(NotificationSink):
+    """Appends notifications to a file, one JSON object per line"""
+
+    def __init__(self, path: Path):
+        """
+        :param path: The file to append to
+        """
+        self._file = open(str(path), "a")
+        self._lock = threading.Lock()
+
+    def send(self, notification: AlertNotification) -> None:
+        line = json.dumps({
+            "alarm_name": notification.alarm_name,
+            "duration": notification.duration,
+            "alert": notification.alert.to_dict(),
+        })
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class StubSink(NotificationSink):
+    """Keeps notifications in memory instead of sending them anywhere, for
+    testing. It can be made slow, to see how the dispatcher handles slow
+    sinks.
+    """
+
+    def __init__(self, delay: float = 0):
+        """
+        :param delay: How long each send takes, in seconds
+        """
+        self.delay = delay
+        self.notifications: List[AlertNotification] = []
+        self._lock = threading.Lock()
+
+    def send(self, notification: AlertNotification) -> None:
+        time.sleep(self.delay)
+        with self._lock:
+            self.notifications.append(notification)
+
+
+class DispatcherMetrics(NamedTuple):
+    queue_depth: int
+    """Alerts waiting to be sent"""
+
+    submitted: int
+    """Alerts accepted into the queue"""
+
+    duplicates: int
+    """Alerts ignored because they were already submitted"""
+
+    dropped: int
+    """Alerts dropped because the queue was full"""
+
+    sent: int
+    """Alerts that at least one sink sent"""
+
+    undelivered: int
+    """Alerts that no sink could send, or whose alarm couldn't be looked up.
+    They're forgotten, so they're sent again if they're submitted again.
+    """
+
+    failed: int
+    """Sends that raised an error, counted once per sink"""
+
+    lookup_failed: int
+    """Alerts whose alarm couldn't be looked up, so no sink was tried"""
+
+    last_lag: float
+    """Seconds between submitting the last sent alert and sending it"""
+
+    max_lag: float
+    """The highest lag seen so far"""
+
+
+class AlertDispatcher:
+    """Sends alert notifications from a pool of worker threads, so that
+    reading the zone status stream never waits on a slow sink.
+    """
+
+    _STOP = object()
+    """Put on the queue to tell a worker to stop"""
+
+    def __init__(self, sinks: List[NotificationSink],
+                 get_alarm: Callable[[int], bf_codecs.ZoneAlarm],
+                 num_workers: int = 4,
+                 max_queue_size: int = 1000,
+                 max_remembered_alerts: int = 100000):
+        """
+        :param sinks: Where to send notifications
+        :param get_alarm: Looks up an alarm by its ID, like
+            BrainFrameAPI.get_zone_alarm. It is called from the workers.
+        :param num_workers: The number of threads sending notifications
+        :param max_queue_size: Alerts submitted while this many are waiting
+            are dropped
+        :param max_remembered_alerts: How many alert IDs to remember for
+            de-duplication. The oldest are forgotten first.
+        """
+        self.sinks = sinks
+        self.get_alarm = get_alarm
+        self.max_remembered_alerts = max_remembered_alerts
+
+        self._queue: Queue = Queue(maxsize=max_queue_size)
+        self._seen_alert_ids: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._submitted = 0
+        self._duplicates = 0
+        self._dropped = 0
+        self._sent = 0
+        self._undelivered = 0
+        self._failed = 0
+        self._lookup_failed = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+
+        self._workers = [threading.Thread(target=self._worker,
+                                          name="AlertDispatcherThread",
+                                          daemon=True)
+                         for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, alert: bf_codecs.Alert) -> bool:
+        """Queues a finished alert to be sent. This never blocks.
+
+        :param alert: The alert to send
+        :return: True if the alert was queued, False if it was a duplicate or
+            the queue was full
+        """
+        with self._lock:
+            if alert.id is not None:
+                if alert.id in self._seen_alert_ids:
+                    self._duplicates += 1
+                    return False
+                self._seen_alert_ids[alert.id] = None
+                if len(self._seen_alert_ids) > self.max_remembered_alerts:
+                    self._seen_alert_ids.popitem(last=False)
+
+        try:
+            self._queue.put_nowait((alert, time.perf_counter()))
+        except Full:
+            with self._lock:
+                self._dropped += 1
+                # Forget the alert, so it can be submitted again once the
+                # queue has room
+                self._seen_alert_ids.pop(alert.id, None)
+            return False
+
+        with self._lock:
+            self._submitted += 1
+        return True
+
+    def submit_finished_alerts(self,
+                               zone_status_packet: dict,
+                               min_duration: float = 0) -> None:
+        """Submits every finished alert in a zone status packet.
+
+        :param zone_status_packet: A packet from
+            BrainFrameAPI.get_zone_status_stream
+        :param min_duration: Alerts shorter than this, in seconds, are ignored
+        """
+        for stream_id, zone_statuses in zone_status_packet.items():
+            for zone_name, zone_status in zone_statuses.items():
+                for alert in zone_status.alerts:
+                    # Check if the alert has ended
+                    if alert.end_time is None:
+                        continue
+
+                    # Check if the alert lasted long enough
+                    if alert.end_time - alert.start_time > min_duration:
+                        self.submit(alert)
+
+    def metrics(self) -> DispatcherMetrics:
+        with self._lock:
+            return DispatcherMetrics(queue_depth=self._queue.qsize(),
+                                     submitted=self._submitted,
+                                     duplicates=self._duplicates,
+                                     dropped=self._dropped,
+                                     sent=self._sent,
+                                     undelivered=self._undelivered,
+                                     failed=self._failed,
+                                     lookup_failed=self._lookup_failed,
+                                     last_lag=self._last_lag,
+                                     max_lag=self._max_lag)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Stops the workers once every queued alert is sent, and closes the
+        sinks.
+
+        :param timeout: How long to wait for each worker to finish
+        """
+        for _ in self._workers:
+            self._queue.put(self._STOP)
+        for worker in self._workers:
+            worker.join(timeout)
+        for sink in self.sinks:
+            sink.close()
+
+    def _worker(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=1)
+            except Empty:
+                continue
+            if item is self._STOP:
+                break
+
+            alert, submitted_at = item
+            try:
+                alarm = self.get_alarm(alert.alarm_id)
+            except Exception:
+                logging.exception(f"Could not get alarm {alert.alarm_id}")
+                with self._lock:
+                    self._lookup_failed += 1
+                self._forget_undelivered(alert)
+                continue
+
+            notification = AlertNotification(
+                alert=alert,
+                alarm_name=alarm.name,
+                duration=alert.end_time - alert.start_time)
+
+            delivered = False
+            for sink in self.sinks:
+                try:
+                    sink.send(notification)
+                    delivered = True
+                except Exception:
+                    logging.exception(f"Could not send alert {alert.id} to "
+                                      f"{type(sink).__name__}")
+                    with self._lock:
+                        self._failed += 1
+
+            if not delivered:
+                self._forget_undelivered(alert)
+                continue
+
+            lag = time.perf_counter() - submitted_at
+            with self._lock:
+                self._sent += 1
+                self._last_lag = lag
+                self._max_lag = max(self._max_lag, lag)
+
+    def _forget_undelivered(self, alert: bf_codecs.Alert) -> None:
+        # Forget the alert, so it's sent again the next time it's submitted,
+        # like when it shows up in the next zone status packet
+        with self._lock:
+            self._undelivered += 1
+            self._seen_alert_ids.pop(alert.id, None)
@@ -0,0 +1,199 @@
+# Import the dependencies
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from brainframe.api import bf_codecs
+
+# Set this environment variable to a directory to keep the state of crawls,
+# like result caches and checkpoints, somewhere other than the default
+STATE_DIR_ENV = "BRAINFRAME_STATE_DIR"
+DEFAULT_STATE_DIR = Path.home() / ".cache" / "brainframe_tutorials"
+
+
+def state_dir(archive: Path) -> Path:
+    """Finds the directory to keep the state of an archive's crawls in. It's
+    outside of the archive, so the archive only holds images and can be
+    read-only.
+
+    :param archive: The root directory of the archive
+    :return: A directory for this archive only, which is created if needed
+    """
+    root = Path(os.environ.get(STATE_DIR_ENV) or DEFAULT_STATE_DIR)
+
+    # Archives with the same name in different places get their own state
+    archive = Path(archive).resolve()
+    path_hash = hashlib.sha256(str(archive).encode("utf-8")).hexdigest()
+    directory = root / f"{archive.name}-{path_hash[:12]}"
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def iter_images(root: Path,
+                suffixes: Iterable[str] = (".png", ".jpg"),
+                start_after: Optional[Path] = None) -> Iterator[Path]:
+    """Walks through the directory tree under root and yields image paths one
+    at a time, without listing the whole tree up front. Paths are yielded in
+    sorted order, so a crawl can be resumed from any path.
+
+    :param root: The directory to search for images
+    :param suffixes: The file extensions of images to yield
+    :param start_after: If provided, only paths that come after this one are
+        yielded. Directories that only hold earlier paths are not entered.
+    :return: A generator of image paths
+    """
+    suffixes = set(suffixes)
+    start_parts: Optional[Tuple[str, ...]] = None
+    if start_after is not None:
+        start_parts = Path(start_after).relative_to(root).parts
+
+    def _walk(directory: Path, parts: Tuple[str, ...]) -> Iterator[Path]:
+        # Only the entries of one directory are held in memory at a time
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+
+        for entry in entries:
+            entry_parts = parts + (entry.name,)
+
+            if entry.is_dir(follow_symlinks=False):
+                # Paths are walked in sorted order, so a directory can be
+                # skipped when all of its contents sort before start_after
+                if start_parts is not None \
+                        and entry_parts < start_parts[:len(entry_parts)]:
+                    continue
+                yield from _walk(Path(entry.path), entry_parts)
+
+            elif Path(entry.name).suffix in suffixes:
+                if start_parts is not None and entry_parts <= start_parts:
+                    continue
+                yield Path(entry.path)
+
+    yield from _walk(Path(root), ())
+
+
+class ResultCache:
+    """Stores process_image results on disk, so images that have already been
+    processed with the same capsules and options are not sent to BrainFrame
+    again. Images are identified by the hash of their contents, so renamed or
+    moved images are still found in the cache.
+    """
+
+    def __init__(self, db_path: Path,
+                 capsule_names: List[str],
+                 option_vals: Dict[str, Dict[str, object]]):
+        """
+        :param db_path: The SQLite file to store results in
+        :param capsule_names: The capsules the images are processed with
+        :param option_vals: The capsule options the images are processed with
+        """
+        # The results depend on the capsules and options used, so they are
+        # part of every key
+        config = json.dumps({"capsule_names": sorted(capsule_names),
+                             "option_vals": option_vals},
+                            sort_keys=True)
+        self._config_hash = hashlib.sha256(config.encode("utf-8")).hexdigest()
+
+        # The cache is used from the bulk processing threads
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(db_path),
+                                           check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, detections TEXT NOT NULL)")
+
+        # Keys of images that were looked up, so they don't need to be hashed
+        # again when their results are stored
+        self._pending_keys: Dict[Path, str] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def _make_key(self, image_path: Path) -> str:
+        content_hash = hashlib.sha256(image_path.read_bytes()).hexdigest()
+        return f"{content_hash}:{self._config_hash}"
+
+    def get(self, image_path: Path) -> Optional[List[bf_codecs.Detection]]:
+        """
+        :param image_path: The image to look up
+        :return: The cached detections, or None if the image isn't cached
+        """
+        key = self._make_key(image_path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT detections FROM results WHERE key = ?",
+                (key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                self._pending_keys[image_path] = key
+                return None
+
+            self.hits += 1
+        return [bf_codecs.Detection.from_dict(d) for d in json.loads(row[0])]
+
+    def put(self, image_path: Path,
+            detections: List[bf_codecs.Detection]) -> None:
+        """
+        :param image_path: The image that was processed
+        :param detections: The results of processing the image
+        """
+        with self._lock:
+            key = self._pending_keys.pop(image_path, None)
+        if key is None:
+            key = self._make_key(image_path)
+
+        data = json.dumps([detection.to_dict() for detection in detections])
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (key, detections) "
+                "VALUES (?, ?)", (key, data))
+
+    def discard(self, image_path: Path) -> None:
+        """Forgets the key of an image that was looked up, for when its
+        results won't be stored, like when processing it failed
+
+        :param image_path: The image that was looked up
+        """
+        with self._lock:
+            self._pending_keys.pop(image_path, None)
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class Checkpoint:
+    """Remembers the last image a crawl finished, so an interrupted crawl can
+    resume where it stopped. Results must be saved in the order that
+    iter_images yields them.
+    """
+
+    def __init__(self, checkpoint_path: Path):
+        """
+        :param checkpoint_path: The file to store the checkpoint in
+        """
+        self.checkpoint_path = Path(checkpoint_path)
+
+    def load(self) -> Optional[Path]:
+        """
+        :return: The last finished image, or None if there is no checkpoint
+        """
+        if not self.checkpoint_path.exists():
+            return None
+        return Path(self.checkpoint_path.read_text().strip())
+
+    def save(self, image_path: Path) -> None:
+        # Write to a temporary file first, so the checkpoint is never left
+        # half written if the crawl is interrupted
+        temp_path = self.checkpoint_path.with_name(
+            self.checkpoint_path.name + ".tmp")
+        temp_path.write_text(str(image_path))
+        os.replace(str(temp_path), str(self.checkpoint_path))
+
+    def clear(self) -> None:
+        if self.checkpoint_path.exists():
+            self.checkpoint_path.unlink()
@@ -0,0 +1,303 @@
+# Import the dependencies
+import importlib.util
+import resource
+import threading
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+from vcap import BaseStreamState, OPTION_TYPE
+
+from bulk_processing import ThroughputStats
+from frame_pipeline import iter_video_frames
+from metrics import REGISTRY, SamplingProfiler
+
+
+# Helper function to load a capsule from its (unpackaged) directory
+def load_capsule_dir(capsule_dir: Path) -> Tuple[ModuleType, Dict[str, bytes]]:
+    """
+    :param capsule_dir: A directory with a capsule.py, meta.conf and any model
+        files the capsule needs
+    :return: The imported capsule.py module, and the capsule files by name,
+        the same way BrainFrame passes them to the backend_loader
+    """
+    spec = importlib.util.spec_from_file_location(
+        f"capsule_{capsule_dir.name}", str(capsule_dir / "capsule.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    capsule_files = {path.name: path.read_bytes()
+                     for path in capsule_dir.iterdir() if path.is_file()}
+    return module, capsule_files
+
+
+# Helper function that wraps the capsule's Backend to record batch sizes
+def instrument_batches(module: ModuleType, batch_sizes: List[int]) -> None:
+    """
+    :param module: The capsule module, as returned by load_capsule_dir. The
+        backend_loader looks up the Backend class in this module when it's
+        called, so the class is swapped out before loading the backend.
+    :param batch_sizes: The size of every batch is appended to this list
+    """
+
+    class InstrumentedBackend(module.Backend):
+        def batch_predict(self, input_data_list):
+            batch_sizes.append(len(input_data_list))
+            return super().batch_predict(input_data_list)
+
+    module.Backend = InstrumentedBackend
+
+
+# Helper function to load the frames that will be fed to the capsule
+def load_frames(source: Path, max_frames: int) -> List[np.ndarray]:
+    """
+    :param source: A video file, or a directory of images
+    :param max_frames: The max number of frames to load into memory
+    :return: A list of BGR frames
+    """
+    frames = []
+    if source.is_dir():
+        for image_path in sorted(source.iterdir()):
+            if image_path.suffix not in [".png", ".jpg"]:
+                continue
+            frame = cv2.imread(str(image_path))
+            if frame is not None:
+                frames.append(frame)
+            if len(frames) >= max_frames:
+                break
+    else:
+        # Frames are decoded in worker processes. They're views of the
+        # pipeline's shared memory, so they're copied to be kept.
+        for frame in iter_video_frames(source, num_workers=2):
+            frames.append(frame.image.copy())
+            if len(frames) >= max_frames:
+                break
+
+    if len(frames) == 0:
+        raise IOError(f"Could not read any frames from {source}. If it's a "
+                      f"file from this repo, make sure Git LFS pulled it.")
+    return frames
+
+
+# Helper function to parse option values from the command line
+def parse_option_vals(capsule_options: dict, overrides: List[str]) \
+        -> Dict[str, OPTION_TYPE]:
+    """
+    :param capsule_options: The options field of the Capsule class
+    :param overrides: Strings in the form of name=value
+    :return: The default option values, with the overrides applied
+    """
+    option_vals = {name: option.default
+                   for name, option in capsule_options.items()}
+
+    for override in overrides:
+        name, value = override.split("=", 1)
+        if name not in capsule_options:
+            raise ValueError(f"The capsule has no option named {name}")
+
+        # Convert the value to the same type as the option's default
+        default = capsule_options[name].default
+        if isinstance(default, bool):
+            option_vals[name] = value.lower() in ["true", "1", "yes"]
+        else:
+            option_vals[name] = type(default)(value)
+
+        capsule_options[name].check(option_vals[name])
+
+    return option_vals
+
+
+def run_stream(backend, frames: List[np.ndarray],
+               option_vals: Dict[str, OPTION_TYPE],
+               state: BaseStreamState, fps: float, duration: float,
+               start_offset: int, stats: ThroughputStats) -> None:
+    """Feeds frames to the backend at a fixed rate, like a video stream would.
+
+    :param backend: The backend to process the frames with
+    :param frames: The frames to loop over
+    :param option_vals: The capsule options to use
+    :param state: The stream state, kept for the whole stream
+    :param fps: The target frame rate, or 0 to send frames as fast as possible
+    :param duration: How long to run the stream for, in seconds
+    :param start_offset: The first frame to send, so streams don't all send
+        the same frame at the same time
+    :param stats: The latency of every frame is recorded in it
+    """
+    end_time = time.perf_counter() + duration
+    next_frame_time = time.perf_counter()
+    frame_index = start_offset
+
+    while time.perf_counter() < end_time:
+        # Wait until it's time for the next frame. If the capsule is too slow
+        # to keep up, the next frame is sent right away.
+        if fps > 0:
+            delay = next_frame_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame_time += 1 / fps
+
+        frame = frames[frame_index % len(frames)]
+        frame_index += 1
+
+        start = time.perf_counter()
+        backend.process_frame(frame, None, option_vals, state)
+        stats.record(time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark a capsule locally, without a BrainFrame server")
+    parser.add_argument("--capsule", type=Path,
+                        default=Path("../capsules/detector_bounding_box_fake"),
+                        help="The directory of the capsule to benchmark")
+    parser.add_argument("--frames", type=Path,
+                        default=Path("../videos/social_distancing.mp4"),
+                        help="A video file or a directory of images to use "
+                             "as frames")
+    parser.add_argument("--max-frames", type=int, default=100,
+                        help="The max number of frames to load into memory")
+    parser.add_argument("--streams", type=int, default=8,
+                        help="The number of simulated streams")
+    parser.add_argument("--fps", type=float, default=15,
+                        help="The frame rate of each stream, 0 for as fast as "
+                             "possible")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="How long to run the benchmark for, in seconds")
+    parser.add_argument("--device", default="CPU:0",
+                        help="The device to load the backend onto")
+    parser.add_argument("--option", action="append", default=[],
+                        metavar="NAME=VALUE",
+                        help="Set a capsule option. Can be used many times.")
+    parser.add_argument("--metrics", type=Path,
+                        help="Write the time spent in each step of "
+                             "process_frame to this file, as JSON if it ends "
+                             "with .json and as Prometheus text otherwise")
+    parser.add_argument("--profile", type=Path,
+                        help="Sample the stacks of every thread while the "
+                             "streams run, and write them to this file as "
+                             "folded stacks for a flame graph")
+    args = parser.parse_args()
+
+    module, capsule_files = load_capsule_dir(args.capsule)
+    capsule_class = module.Capsule
+    option_vals = parse_option_vals(capsule_class.options, args.option)
+
+    # Load the backend the same way BrainFrame would, and time it
+    batch_sizes: List[int] = []
+    instrument_batches(module, batch_sizes)
+    load_start = time.perf_counter()
+    backend = capsule_class.backend_loader(capsule_files, args.device)
+    load_time = time.perf_counter() - load_start
+
+    # Ignore any batches run while the backend was loading
+    batch_sizes.clear()
+
+    # Capsules that support it observe the time spent in each step of
+    # process_frame in the registry
+    if args.metrics is not None:
+        REGISTRY.enabled = True
+        backend.metrics = REGISTRY
+
+    frames = load_frames(args.frames, args.max_frames)
+
+    # Capsules can define their own StreamState class
+    state_class = getattr(capsule_class, "stream_state", BaseStreamState)
+    if not isinstance(state_class, type):
+        state_class = BaseStreamState
+
+    # The first frame shows if loading left any initialization to be done
+    # by the first real frames
+    first_frame_start = time.perf_counter()
+    backend.process_frame(frames[0], None, option_vals, state_class())
+    first_frame_latency = time.perf_counter() - first_frame_start
+    batch_sizes.clear()
+
+    stats = ThroughputStats()
+    states = [state_class() for _ in range(args.streams)]
+    threads = [
+        threading.Thread(
+            target=run_stream,
+            kwargs={
+                "backend": backend,
+                "frames": frames,
+                "option_vals": option_vals,
+                "state": states[stream_index],
+                "fps": args.fps,
+                "duration": args.duration,
+                "start_offset": stream_index * len(frames) // args.streams,
+                "stats": stats,
+            })
+        for stream_index in range(args.streams)
+    ]
+
+    print(f"Running {capsule_class.name} on {args.streams} streams at "
+          f"{args.fps} fps for {args.duration} s, options: {option_vals}")
+    profiler = None
+    if args.profile is not None:
+        profiler = SamplingProfiler()
+        profiler.start()
+
+    stats.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    backend.close()
+
+    if profiler is not None:
+        profiler.stop()
+        profiler.write(args.profile)
+
+    # Peak RSS is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"Backend load time: {load_time * 1000:.1f} ms")
+    # Backends that time their own loading, like the face detector's
+    load_timings = getattr(backend, "load_timings", None)
+    if load_timings is not None:
+        warmups = ", ".join(
+            f"{batch_size}x{width}x{height}: {seconds * 1000:.1f} ms"
+            for (batch_size, width, height), seconds
+            in load_timings.warmup.items())
+        print(f"  parse: {load_timings.parse * 1000:.1f} ms, "
+              f"import: {load_timings.import_graph * 1000:.1f} ms, "
+              f"warm-up: {warmups}")
+    print(f"First frame latency: {first_frame_latency * 1000:.1f} ms")
+    print(f"Frames processed: {len(stats.latencies)}, "
+          f"{stats.images_per_second:.2f} frames/s")
+    print(f"Frame latency p50: {stats.percentile(50) * 1000:.1f} ms, "
+          f"p90: {stats.percentile(90) * 1000:.1f} ms, "
+          f"p99: {stats.percentile(99) * 1000:.1f} ms")
+    if len(batch_sizes) > 0:
+        print(f"Batches: {len(batch_sizes)}, "
+              f"mean size: {np.mean(batch_sizes):.2f}, "
+              f"max size: {max(batch_sizes)}")
+    print(f"Peak RSS: {peak_rss_mb:.1f} MB")
+
+    # Stream states that cache results, like the face detector's, count the
+    # frames they saved inference on
+    frames_seen = sum(getattr(state, "frames_seen", 0) for state in states)
+    if frames_seen > 0:
+        frames_reused = sum(state.frames_reused for state in states)
+        frames_region_only = sum(state.frames_region_only
+                                 for state in states)
+        print(f"Frames reused from the stream state: {frames_reused} of "
+              f"{frames_seen} ({frames_reused / frames_seen * 100:.1f}%), "
+              f"run on the changed region only: {frames_region_only}")
+
+    if args.metrics is not None:
+        for frame_latency in stats.latencies:
+            REGISTRY.observe("capsule_process_frame_seconds", frame_latency)
+        REGISTRY.write(args.metrics)
+        print(f"Metrics written to {args.metrics}")
+    if profiler is not None:
+        print(f"Profile written to {args.profile}, "
+              f"{sum(profiler.samples.values())} samples")
+
+
+if __name__ == "__main__":
+    main()
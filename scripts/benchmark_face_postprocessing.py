@@ -0,0 +1,119 @@
+# Import the dependencies
+import importlib.util
+import timeit
+from argparse import ArgumentParser
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from vcap import DetectionNode, rect_to_coords
+from vcap_utils import TFObjectDetector
+
+# The face capsule, which holds the vectorized post-processing
+CAPSULE_PATH = Path("../capsules/detector_face/capsule.py")
+
+# The label map of the face capsule's dataset_metadata.json
+LABEL_MAP = {1: "face", 2: "background"}
+FACE_CLASS_ID = 1
+
+# The confidence threshold TFObjectDetector uses by default
+MIN_CONFIDENCE = 0.05
+
+
+# Helper function to generate the raw output of the model for one frame
+def make_model_output(num_predictions: int, seed: int = 0):
+    """
+    :param num_predictions: How many boxes the model returned
+    :param seed: Seed for the random generator, so runs are repeatable
+    :return: The boxes, scores and classes arrays, like TensorFlow returns
+    """
+    rng = np.random.default_rng(seed)
+    corners = rng.uniform(0, 1, size=(num_predictions, 2, 2))
+    boxes = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+    scores = rng.uniform(0, 1, size=num_predictions).astype(np.float32)
+    classes = rng.choice([1.0, 2.0], size=num_predictions).astype(np.float32)
+    return boxes, scores, classes
+
+
+# The post-processing the face capsule did before, for comparison
+def loop_postprocessing(frame, boxes, scores, classes, threshold):
+    detector = SimpleNamespace(min_confidence=MIN_CONFIDENCE,
+                               label_map=LABEL_MAP)
+    predictions = TFObjectDetector._postprocess_output(
+        detector, frame, boxes, scores, classes)
+
+    detection_nodes = []
+    for prediction in predictions:
+        if prediction.name != "face":
+            continue
+        if prediction.confidence < threshold:
+            continue
+        detection_nodes.append(DetectionNode(
+            name=prediction.name,
+            coords=rect_to_coords(prediction.rect),
+            extra_data={"detection_confidence": prediction.confidence}
+        ))
+    return detection_nodes
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--predictions", type=int, nargs="+",
+                        default=[10, 100, 1000],
+                        help="The numbers of raw predictions per frame")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="The capsule's threshold option")
+    parser.add_argument("--iou-threshold", type=float, default=0.5,
+                        help="The capsule's iou_threshold option, used by "
+                             "the nms implementation")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="How many times to time each implementation")
+    args = parser.parse_args()
+
+    spec = importlib.util.spec_from_file_location("face_capsule",
+                                                  str(CAPSULE_PATH))
+    capsule = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(capsule)
+
+    # The vectorized post-processing from the capsule. NMS is disabled with
+    # an IoU threshold of 1, to compare against the loop without it.
+    def vectorized_postprocessing(frame, boxes, scores, classes, threshold,
+                                  iou_threshold=1.0):
+        predictions = capsule.postprocess_output(
+            boxes, scores, classes,
+            frame_shape=frame.shape,
+            min_confidence=MIN_CONFIDENCE)
+        return capsule.predictions_to_detections(
+            predictions, class_id=FACE_CLASS_ID, threshold=threshold,
+            iou_threshold=iou_threshold)
+
+    # The same, with the capsule's duplicate removal enabled
+    def nms_postprocessing(frame, boxes, scores, classes, threshold):
+        return vectorized_postprocessing(frame, boxes, scores, classes,
+                                         threshold, args.iou_threshold)
+
+    implementations = {
+        "loop": loop_postprocessing,
+        "vectorized": vectorized_postprocessing,
+        "nms": nms_postprocessing,
+    }
+
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+
+    print(f"{'raw':>6} {'impl':>10} {'faces':>6} {'best us':>10}")
+    for num_predictions in args.predictions:
+        boxes, scores, classes = make_model_output(num_predictions)
+
+        for name, postprocessing in implementations.items():
+            detections = postprocessing(frame, boxes, scores, classes,
+                                        args.threshold)
+            best = min(timeit.repeat(
+                lambda: postprocessing(frame, boxes, scores, classes,
+                                       args.threshold),
+                repeat=args.repeat, number=1))
+            print(f"{num_predictions:>6} {name:>10} {len(detections):>6} "
+                  f"{best * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Import the dependencies
+import statistics
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import cv2
+from vcap import BaseStreamState
+
+from benchmark_capsule import load_capsule_dir, load_frames, \
+    parse_option_vals
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measure the face detector's frame latency for different "
+                    "tile sizes")
+    parser.add_argument("--capsule", type=Path,
+                        default=Path("../capsules/detector_face"),
+                        help="The directory of the face capsule")
+    parser.add_argument("--frames", type=Path,
+                        default=Path("../images/people_and_cats"),
+                        help="A video file or a directory of images to use "
+                             "as frames")
+    parser.add_argument("--resolution", type=int, nargs=2,
+                        default=[3840, 2160], metavar=("WIDTH", "HEIGHT"),
+                        help="Frames are resized to this resolution")
+    parser.add_argument("--tile-sizes", type=int, nargs="+",
+                        default=[0, 2048, 1024, 512],
+                        help="The tile sizes to benchmark, 0 for no tiling")
+    parser.add_argument("--tile-overlap", type=float, default=0.2,
+                        help="How much neighboring tiles overlap")
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="How many frames to time for each tile size")
+    parser.add_argument("--device", default="CPU:0",
+                        help="The device to load the backend onto")
+    args = parser.parse_args()
+
+    module, capsule_files = load_capsule_dir(args.capsule)
+    backend = module.Capsule.backend_loader(capsule_files, args.device)
+
+    frames = [cv2.resize(frame, tuple(args.resolution))
+              for frame in load_frames(args.frames, args.repeat)]
+    state = BaseStreamState()
+
+    print(f"{'tile size':>10} {'tiles':>6} {'faces':>6} {'median ms':>10}")
+    for tile_size in args.tile_sizes:
+        option_vals = parse_option_vals(
+            module.Capsule.options,
+            [f"tile_size={tile_size}", f"tile_overlap={args.tile_overlap}"])
+        num_tiles = 1
+        if tile_size > 0:
+            num_tiles = len(module.make_tiles(frames[0].shape, tile_size,
+                                              args.tile_overlap))
+
+        latencies = []
+        num_faces = 0
+        for i in range(args.repeat):
+            frame = frames[i % len(frames)]
+            start = time.perf_counter()
+            detections = backend.process_frame(frame, None, option_vals, state)
+            latencies.append(time.perf_counter() - start)
+            num_faces += len(detections)
+
+        print(f"{tile_size:>10} {num_tiles:>6} "
+              f"{num_faces / args.repeat:>6.1f} "
+              f"{statistics.median(latencies) * 1000:>10.1f}")
+
+    backend.close()
+
+
+if __name__ == "__main__":
+    main()
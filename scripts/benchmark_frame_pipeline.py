@@ -0,0 +1,76 @@
+# Import the dependencies
+import os
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from frame_pipeline import FramePipeline, iter_video_frames, probe_video
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark decoding a video file with different numbers "
+                    "of worker processes")
+    parser.add_argument("--video", type=Path,
+                        default=Path("../videos/social_distancing.mp4"),
+                        help="The video to decode")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=[1, 2, 4, os.cpu_count()],
+                        help="The worker counts to try")
+    parser.add_argument("--stride", type=int, default=1,
+                        help="Only decode every stride-th frame")
+    parser.add_argument("--size", type=int, nargs=2, default=None,
+                        metavar=("WIDTH", "HEIGHT"),
+                        help="Resize frames to this size")
+    parser.add_argument("--chunk-frames", type=int, default=64,
+                        help="The number of consecutive frames each worker "
+                             "decodes at a time")
+    args = parser.parse_args()
+
+    info = probe_video(args.video)
+    size = tuple(args.size) if args.size is not None else None
+    print(f"{args.video}: {info.width}x{info.height}, {info.fps:.1f} fps, "
+          f"{info.frame_count} frames, stride {args.stride}, "
+          f"resized to {size}")
+
+    # Helper function to time decoding every frame. Each frame is touched so
+    # the views are actually read, like a consumer would. Starting the workers
+    # takes a while, so frames/s is measured from the first frame. With a
+    # single frame, there's nothing after it, so the whole run is measured.
+    def _time(frames):
+        num_frames = 0
+        start = time.perf_counter()
+        first_frame_time = None
+        for frame in frames:
+            int(frame.image.max())
+            num_frames += 1
+            if first_frame_time is None:
+                first_frame_time = time.perf_counter()
+        end = time.perf_counter()
+        if num_frames == 0:
+            parser.error(f"No frames were decoded from {args.video}")
+        if num_frames == 1:
+            frames_per_second = 1 / (end - start)
+        else:
+            frames_per_second = (num_frames - 1) / (end - first_frame_time)
+        return num_frames, first_frame_time - start, frames_per_second
+
+    num_frames, startup, baseline = _time(iter_video_frames(
+        args.video, num_workers=0, stride=args.stride, size=size))
+    print(f"{'in process':>12}: {num_frames} frames, {baseline:8.1f} "
+          f"frames/s, first frame after {startup * 1000:.0f} ms")
+
+    for num_workers in sorted(set(args.workers)):
+        pipeline = FramePipeline(args.video,
+                                 num_workers=num_workers,
+                                 stride=args.stride,
+                                 size=size,
+                                 chunk_frames=args.chunk_frames)
+        num_frames, startup, frames_per_second = _time(pipeline)
+        print(f"{num_workers:>4} workers: {num_frames} frames, "
+              f"{frames_per_second:8.1f} frames/s, first frame after "
+              f"{startup * 1000:.0f} ms, {frames_per_second / baseline:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Import the dependencies
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Callable, List
+
+import cv2
+import numpy as np
+
+from brainframe.api import BrainFrameAPI
+
+from bulk_processing import ThroughputStats, process_images, read_image, \
+    read_encoded_image
+from pooled_session import PooledSession
+from stub_server import StubBrainFrameServer
+
+CAPSULE_NAMES = ["classifier_vehicle_color_openvino",
+                 "detector_person_vehicle_bike_openvino"]
+
+
+# Helper function to write photo-like JPEGs to use when no images are given
+def make_images(directory: Path, num_images: int, width: int, height: int,
+                quality: int) -> List[Path]:
+    """
+    :param directory: Where to write the images
+    :param num_images: How many images to write
+    :param width: The width of each image
+    :param height: The height of each image
+    :param quality: The JPEG quality, from 0 to 100, like a camera would use
+    :return: The paths of the images
+    """
+    rng = np.random.default_rng(0)
+    image_paths = []
+    for index in range(num_images):
+        # Smooth gradients and a few shapes, with some sensor noise,
+        # compress about like a photo does. Pure noise would not.
+        x = np.linspace(0, 255, width)[None, :, None]
+        y = np.linspace(0, 255, height)[:, None, None]
+        image = (x * rng.uniform(0, 1, 3) + y * rng.uniform(0, 1, 3)) / 2
+        for _ in range(5):
+            x1, y1 = rng.integers(0, width), rng.integers(0, height)
+            cv2.rectangle(image, (int(x1), int(y1)),
+                          (int(x1 + width / 4), int(y1 + height / 4)),
+                          rng.uniform(0, 255, 3).tolist(), -1)
+        image += rng.normal(0, 4, image.shape)
+        image = image.clip(0, 255).astype(np.uint8)
+
+        image_path = directory / f"car_{index:04}.jpg"
+        cv2.imwrite(str(image_path), image,
+                    [cv2.IMWRITE_JPEG_QUALITY, quality])
+        image_paths.append(image_path)
+    return image_paths
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark sending images to process_image one at a time "
+                    "against keeping many requests in flight over pooled "
+                    "connections, with and without re-encoding the images")
+    parser.add_argument("--images", type=Path,
+                        help="A directory of JPEGs to send. By default, "
+                             "synthetic images are generated.")
+    parser.add_argument("--num-images", type=int, default=200,
+                        help="The number of synthetic images to generate")
+    parser.add_argument("--size", type=int, nargs=2, default=[1280, 720],
+                        metavar=("WIDTH", "HEIGHT"),
+                        help="The size of the synthetic images")
+    parser.add_argument("--quality", type=int, default=85,
+                        help="The JPEG quality of the synthetic images")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="The number of requests in flight at once when "
+                             "batching")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="How long the stub server takes per request, in "
+                             "seconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.images is not None:
+            image_paths = sorted(path for path in args.images.iterdir()
+                                 if path.suffix in [".jpg", ".jpeg"])
+        else:
+            image_paths = make_images(Path(temp_dir), args.num_images,
+                                      *args.size, args.quality)
+        file_bytes = sum(path.stat().st_size for path in image_paths)
+        print(f"{len(image_paths)} images, "
+              f"{file_bytes / len(image_paths) / 1024:.1f} KiB per file on "
+              f"disk, server latency {args.latency * 1000:.0f} ms")
+
+        # Helper function to process every image and report how it went
+        def _run(name: str, concurrency: int, pooled: bool,
+                 decode: Callable) -> float:
+            server = StubBrainFrameServer(latency=args.latency).start()
+            api = BrainFrameAPI(server.url)
+            session = PooledSession(api, pool_size=concurrency) \
+                if pooled else None
+
+            stats = ThroughputStats()
+            start = time.perf_counter()
+            cpu_start = time.process_time()
+            for _ in process_images(api, image_paths,
+                                    capsule_names=CAPSULE_NAMES,
+                                    option_vals={},
+                                    concurrency=concurrency,
+                                    ordered=False,
+                                    stats=stats,
+                                    decode=decode):
+                pass
+            elapsed = time.perf_counter() - start
+            cpu_time = time.process_time() - cpu_start
+
+            if session is not None:
+                session.close()
+            server.close()
+
+            # The CPU time includes the stub server's, which is about the
+            # same for every run
+            images_per_second = len(image_paths) / elapsed
+            print(f"{name:>34}: {images_per_second:7.1f} images/s, "
+                  f"{server.bytes_received / len(image_paths) / 1024:6.1f} "
+                  f"KiB/image on the wire, "
+                  f"{cpu_time / len(image_paths) * 1000:5.1f} ms CPU/image")
+            return images_per_second
+
+        # The original script: one image at a time, decoded and re-encoded,
+        # with a new connection per request
+        baseline = _run("one at a time, re-encoded", 1, False, read_image)
+        batched = _run("batched, re-encoded", args.concurrency, True,
+                       read_image)
+        raw = _run("batched, file bytes", args.concurrency, True,
+                   read_encoded_image)
+        print(f"Batched is {batched / baseline:.1f}x faster, and sending the "
+              f"file bytes {raw / baseline:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
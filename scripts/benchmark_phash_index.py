@@ -0,0 +1,71 @@
+# Import the dependencies
+import random
+import time
+from argparse import ArgumentParser
+
+from phash_index import BKTree, hamming_distance
+
+
+# Helper function to make a hash that differs from another in a few bits
+def _flip_bits(image_hash: int, num_bits: int) -> int:
+    for bit in random.sample(range(64), num_bits):
+        image_hash ^= 1 << bit
+    return image_hash
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark looking up near duplicate images in a BK-tree "
+                    "of perceptual hashes, against comparing every hash")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000],
+                        help="The index sizes to try")
+    parser.add_argument("--radius", type=int, default=6,
+                        help="The max Hamming distance of a near duplicate")
+    parser.add_argument("--queries", type=int, default=200,
+                        help="The number of lookups to time at each size")
+    args = parser.parse_args()
+
+    random.seed(0)
+    for size in args.sizes:
+        hashes = [random.getrandbits(64) for _ in range(size)]
+        tree = BKTree()
+        start = time.perf_counter()
+        for value, image_hash in enumerate(hashes):
+            tree.add(image_hash, value)
+        build_time = time.perf_counter() - start
+
+        # Half of the queries are near duplicates of an indexed image, the
+        # other half are new images
+        queries = []
+        for query_index in range(args.queries):
+            if query_index % 2 == 0:
+                queries.append(_flip_bits(random.choice(hashes),
+                                          random.randint(0, args.radius)))
+            else:
+                queries.append(random.getrandbits(64))
+
+        start = time.perf_counter()
+        tree_matches = [tree.search(query, args.radius) for query in queries]
+        tree_time = (time.perf_counter() - start) / len(queries)
+
+        start = time.perf_counter()
+        scan_matches = [[image_hash for image_hash in hashes
+                         if hamming_distance(query, image_hash)
+                         <= args.radius]
+                        for query in queries]
+        scan_time = (time.perf_counter() - start) / len(queries)
+
+        # Both have to find exactly the same hashes
+        for tree_match, scan_match in zip(tree_matches, scan_matches):
+            assert sorted(match[1] for match in tree_match) \
+                == sorted(scan_match)
+
+        print(f"{size:>8} hashes: built in {build_time * 1000:.0f} ms, "
+              f"BK-tree {tree_time * 1000:8.3f} ms/lookup, "
+              f"scan {scan_time * 1000:8.3f} ms/lookup, "
+              f"{scan_time / tree_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Import the dependencies
+import timeit
+from argparse import ArgumentParser
+
+import numpy as np
+
+from distancing import ENGINES
+
+
+# Helper function to generate a frame's worth of fake person detections
+def make_people(num_people: int, frame_width: int, frame_height: int,
+                seed: int = 0) -> np.ndarray:
+    """
+    :param num_people: How many person bboxes to generate
+    :param frame_width: The width of the frame the people are placed in
+    :param frame_height: The height of the frame the people are placed in
+    :param seed: Seed for the random generator, so runs are repeatable
+    :return: An array of shape (num_people, 4, 2) of rectangular coords
+    """
+    rng = np.random.default_rng(seed)
+    # A person is roughly 60 pixels wide and 160 pixels tall
+    sizes = rng.normal((60, 160), (10, 25), size=(num_people, 2)).clip(10)
+    x1 = rng.uniform(0, frame_width - sizes[:, 0])
+    y1 = rng.uniform(0, frame_height - sizes[:, 1])
+    x2 = x1 + sizes[:, 0]
+    y2 = y1 + sizes[:, 1]
+    return np.stack([np.stack([x1, y1], axis=1),
+                     np.stack([x2, y1], axis=1),
+                     np.stack([x2, y2], axis=1),
+                     np.stack([x1, y2], axis=1)], axis=1).round()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--min-distance", type=int, default=500,
+                        help="The min distance allowed between two people")
+    parser.add_argument("--people", type=int, nargs="+",
+                        default=[10, 100, 1000],
+                        help="The numbers of people per frame to benchmark")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="How many times to time each engine")
+    parser.add_argument("--engines", choices=list(ENGINES), nargs="+",
+                        default=["loop", "matrix", "grid"],
+                        help="The engines to benchmark")
+    parser.add_argument("--scaling", action="store_true",
+                        help="Instead of a 1080p frame, grow the frame with "
+                             "the number of people to keep the crowd density "
+                             "constant, like a tiled stadium feed")
+    parser.add_argument("--max-pairs", type=float, default=1e7,
+                        help="Skip the loop and matrix engines when a frame "
+                             "has more pairs of people than this")
+    args = parser.parse_args()
+
+    print(f"{'people':>8} {'engine':>8} {'pairs':>8} {'best ms':>10}")
+    for num_people in args.people:
+        frame_width, frame_height = 1920, 1080
+        if args.scaling:
+            # 100 people per 1080p frame worth of pixels
+            scale = max(1.0, (num_people / 100) ** 0.5)
+            frame_width = int(frame_width * scale)
+            frame_height = int(frame_height * scale)
+        coords = make_people(num_people, frame_width, frame_height)
+
+        for name in args.engines:
+            engine = ENGINES[name]
+            num_pairs = num_people * (num_people - 1) / 2
+            if name != "grid" and num_pairs > args.max_pairs:
+                print(f"{num_people:>8} {name:>8} {'skipped':>8}")
+                continue
+
+            violations = engine(coords, args.min_distance)
+            best = min(timeit.repeat(
+                lambda: engine(coords, args.min_distance),
+                repeat=args.repeat, number=1))
+            print(f"{num_people:>8} {name:>8} {len(violations.first):>8} "
+                  f"{best * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Import the dependencies
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from types import SimpleNamespace
+
+from alert_dispatch import AlertDispatcher, StubSink
+from distancing import ENGINES, packet_to_people
+from violation_tracker import ViolationTracker
+from zone_status_log import read_zone_status_log, replay_zone_statuses
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark the social distancing and alert notification "
+                    "analytics by replaying a recorded zone status log")
+    parser.add_argument("log", type=Path,
+                        help="A log recorded with zone_status_log.py or "
+                             "social_distancing.py --record")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="How much faster than real time to replay, or 0 "
+                             "for as fast as possible")
+    parser.add_argument("--min-distance", type=int, default=500,
+                        help="The min distance allowed between two people")
+    parser.add_argument("--engine", choices=list(ENGINES), default="grid",
+                        help="How to find people that are too close")
+    parser.add_argument("--default-zone", default="Screen",
+                        help="The zone to check for social distancing")
+    args = parser.parse_args()
+
+    # The length of the recording, to compare the replay against real time
+    received_times = [received_time for received_time, _
+                      in read_zone_status_log(args.log)]
+    if len(received_times) == 0:
+        raise IOError(f"{args.log} has no packets")
+    recorded_duration = received_times[-1] - received_times[0]
+
+    tracker = ViolationTracker(args.min_distance, engine=args.engine)
+    # Alarms aren't recorded, so every alarm gets a placeholder name
+    sink = StubSink()
+    dispatcher = AlertDispatcher(
+        sinks=[sink],
+        get_alarm=lambda alarm_id: SimpleNamespace(name=f"Alarm {alarm_id}"))
+
+    num_packets = 0
+    num_events = 0
+    start = time.perf_counter()
+    for zone_status_packet in replay_zone_statuses(args.log,
+                                                   speed=args.speed):
+        num_packets += 1
+
+        # The same analytics as social_distancing.py --track
+        stream_people = packet_to_people(zone_status_packet,
+                                         zone_names={},
+                                         default_zone_name=args.default_zone)
+        for stream_id, people in stream_people.items():
+            num_events += len(tracker.update(stream_id, people))
+
+        # The same analytics as sending_notifications_to_wechat.py
+        dispatcher.submit_finished_alerts(zone_status_packet, min_duration=5)
+    elapsed = time.perf_counter() - start
+    dispatcher.close()
+
+    speedup = recorded_duration / elapsed if elapsed > 0 else 0.0
+    print(f"Replayed {num_packets} packets in {elapsed:.2f} s, "
+          f"{num_packets / elapsed:.1f} packets/s, {speedup:.1f}x real time")
+    print(f"Violation events: {num_events}, violations computed for "
+          f"{tracker.frames_computed} frames and reused for "
+          f"{tracker.frames_reused} frames")
+    print(f"Alerts sent: {len(sink.notifications)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+# Import the dependencies
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, \
+    wait
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, \
+    NamedTuple, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from brainframe.api import BrainFrameAPI, bf_codecs
+from brainframe.api.stubs.base_stub import DEFAULT_TIMEOUT
+
+from archive_crawler import ResultCache
+from metrics import REGISTRY
+from motion_gate import MotionGate
+
+
+class ImageResult(NamedTuple):
+    """The result of processing one image"""
+
+    image_path: Path
+    """The image that was processed"""
+
+    detections: List[bf_codecs.Detection]
+    """Everything BrainFrame found in the image"""
+
+    latency: float
+    """How long the process_image call took, in seconds"""
+
+    from_cache: bool = False
+    """True if the detections were found in a ResultCache instead of being
+    processed by BrainFrame
+    """
+
+    reused: bool = False
+    """True if the image barely changed from an earlier image of the same
+    camera, so that image's detections were reused instead of processing it
+    """
+
+    error: Optional[Exception] = None
+    """If the image couldn't be read or processed, the error. Its detections
+    are empty then.
+    """
+
+
+class EncodedImage(NamedTuple):
+    """An image file's bytes, sent to BrainFrame as they are instead of being
+    decoded and encoded again
+    """
+
+    data: bytes
+    """The contents of the file"""
+
+    mime_type: str
+    """The format of the file, like image/jpeg"""
+
+
+# The MIME type of every image file suffix that can be sent as it is
+IMAGE_MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+}
+
+
+class ThroughputStats:
+    """Collects the latency of every processed image, to report how fast a
+    bulk processing job is going.
+    """
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self.start_time = time.perf_counter()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self.latencies.append(latency)
+            self.end_time = time.perf_counter()
+
+    @property
+    def images_per_second(self) -> float:
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        elapsed = self.end_time - self.start_time
+        return len(self.latencies) / elapsed if elapsed > 0 else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """
+        :param percent: The percentile to get, between 0 and 100
+        :return: The latency at that percentile, in seconds
+        """
+        if len(self.latencies) == 0:
+            return 0.0
+        latencies = sorted(self.latencies)
+        index = round(percent / 100 * (len(latencies) - 1))
+        return latencies[index]
+
+    def summary(self) -> str:
+        return (f"Processed {len(self.latencies)} images at "
+                f"{self.images_per_second:.2f} images/s, latency "
+                f"p50: {self.percentile(50) * 1000:.1f} ms, "
+                f"p99: {self.percentile(99) * 1000:.1f} ms")
+
+
+# Helper function to read an image, raising an error instead of returning None
+def read_image(image_path: Path) -> np.ndarray:
+    """
+    :param image_path: The image file to read
+    :return: The image in BGR format
+    """
+    image_array = cv2.imread(str(image_path))
+    if image_array is None:
+        raise IOError(f"Could not read the image {image_path}")
+    return image_array
+
+
+# Helper function to read an image file without decoding it
+def read_encoded_image(image_path: Path) -> EncodedImage:
+    """
+    :param image_path: A JPEG or PNG file
+    :return: The bytes of the file
+    """
+    mime_type = IMAGE_MIME_TYPES.get(image_path.suffix.lower())
+    if mime_type is None:
+        raise ValueError(f"Can't send {image_path} without decoding it, only "
+                         f"{', '.join(IMAGE_MIME_TYPES)} files can be")
+    return EncodedImage(data=image_path.read_bytes(), mime_type=mime_type)
+
+
+def process_encoded_image(api: BrainFrameAPI, image: EncodedImage,
+                          capsule_names: List[str],
+                          option_vals: Dict[str, Dict[str, object]],
+                          timeout: float = DEFAULT_TIMEOUT) \
+        -> List[bf_codecs.Detection]:
+    """Like api.process_image, but sends an image file's bytes as they are.
+    api.process_image takes a decoded image and encodes it as a JPEG again,
+    which costs CPU time. The request may be a little larger than with a new
+    encoding, depending on how the file was compressed.
+
+    :param api: The API to process the image with
+    :param image: The image to process, as read by read_encoded_image
+    :param capsule_names: The names of capsules to enable while processing
+    :param option_vals: The capsule options to use while processing
+    :param timeout: The timeout to use for this request
+    :return: All detections in the image
+    """
+    metadata = json.dumps({"plugins": capsule_names,
+                           "options": option_vals})
+    extension = image.mime_type.split("/")[-1]
+    files = {
+        "image": (f"image.{extension}", image.data, image.mime_type),
+        "metadata": ("metadata.json", metadata.encode("utf-8"),
+                     "application/json"),
+    }
+    response = api._post_multipart("/api/process_image", timeout, files)
+    return [bf_codecs.Detection.from_dict(d) for d in response]
+
+
+def process_images(api: BrainFrameAPI,
+                   image_paths: Iterable[Path],
+                   capsule_names: List[str],
+                   option_vals: Dict[str, Dict[str, object]],
+                   concurrency: int = 8,
+                   decode_workers: int = 2,
+                   ordered: bool = True,
+                   stats: Optional[ThroughputStats] = None,
+                   decode: Callable[[Path], Union[np.ndarray,
+                                                  EncodedImage]] = read_image,
+                   cache: Optional[ResultCache] = None,
+                   gate: Optional[MotionGate] = None,
+                   camera_of: Optional[Callable[[Path], Hashable]] = None) \
+        -> Iterator[ImageResult]:
+    """Runs api.process_image on many images, keeping several requests in
+    flight at once so the server can batch them together. Images are decoded
+    in a separate thread pool while earlier images are being sent.
+
+    :param api: The API to process the images with
+    :param image_paths: The images to process. This can be a generator, only
+        a few images past the ones in flight are read from it at a time.
+    :param capsule_names: The names of capsules to enable while processing
+    :param option_vals: The capsule options to use while processing
+    :param concurrency: The max number of process_image calls in flight
+    :param decode_workers: The number of threads decoding images
+    :param ordered: If True, results are yielded in the same order as
+        image_paths. Otherwise, they are yielded as soon as they are ready.
+    :param stats: If provided, the latency of every call is recorded in it
+    :param decode: The function used to load an image from a path. Use
+        read_encoded_image to send image files as they are, without decoding
+        and encoding them again.
+    :param cache: If provided, images found in the cache are not sent to
+        BrainFrame, and new results are stored in it
+    :param gate: If provided, images that barely changed from the last
+        processed image of the same camera aren't sent to BrainFrame, and
+        reuse that image's detections instead. Images are checked in the
+        order of image_paths.
+    :param camera_of: Returns the camera an image is from, for the gate. By
+        default, every directory is one camera.
+    :return: A generator of results, one per image. Images that couldn't be
+        read or processed have a result with an error.
+    """
+
+    # Helper function that loads an image, unless its results are cached
+    def _load(image_path: Path) \
+            -> Tuple[Union[np.ndarray, EncodedImage, None],
+                     Optional[List[bf_codecs.Detection]]]:
+        if cache is not None:
+            detections = cache.get(image_path)
+            if detections is not None:
+                return None, detections
+        return decode(image_path), None
+
+    # The detections of the last processed image of each camera, which are
+    # reused by the images the gate skips. Only used from the gate thread.
+    # Like the gate, the least recently seen cameras are forgotten first.
+    references: OrderedDict = OrderedDict()
+
+    # Helper function that runs a decoded image through the gate. It's run
+    # from a single thread, so images are checked in order.
+    def _gate(image_path: Path, decoded: Future) \
+            -> Tuple[Optional[Future], Optional[Future]]:
+        """
+        :return: A future to set to the image's detections once it's
+            processed, or a future of the detections it should reuse
+        """
+        image_array, cached_detections = decoded.result()
+        if cached_detections is not None:
+            return None, None
+
+        if isinstance(image_array, EncodedImage):
+            # The gate only looks at a small thumbnail, so a JPEG can be
+            # decoded at a fraction of its size for it
+            image_array = cv2.imdecode(
+                np.frombuffer(image_array.data, dtype=np.uint8),
+                cv2.IMREAD_REDUCED_GRAYSCALE_4)
+
+        camera = image_path.parent if camera_of is None \
+            else camera_of(image_path)
+        if not gate.should_process(camera, image_array):
+            if camera in references:
+                references.move_to_end(camera)
+                return None, references[camera]
+            # The gate remembers an image that wasn't processed here, like
+            # when it's reused across calls, so this image is processed and
+            # becomes the camera's reference in the gate too
+            gate.process_anyway(camera, image_array)
+
+        references[camera] = Future()
+        references.move_to_end(camera)
+        while len(references) > gate.max_cameras:
+            references.popitem(last=False)
+        return references[camera], None
+
+    # Helper function that waits for a decoded image and sends it to
+    # BrainFrame
+    def _process(image_path: Path, decoded: Future,
+                 gated: Optional[Future]) -> ImageResult:
+        try:
+            image_array, cached_detections = decoded.result()
+            if cached_detections is not None:
+                REGISTRY.inc("bulk_images_from_cache_total")
+                return ImageResult(image_path=image_path,
+                                   detections=cached_detections,
+                                   latency=0.0,
+                                   from_cache=True)
+
+            reference, reused = (None, None) if gated is None \
+                else gated.result()
+            if reused is not None:
+                REGISTRY.inc("bulk_images_reused_total")
+                # The reference image was submitted earlier, so it's already
+                # being processed or ahead in the queue
+                return ImageResult(image_path=image_path,
+                                   detections=reused.result(),
+                                   latency=0.0,
+                                   reused=True)
+
+            start = time.perf_counter()
+            try:
+                if isinstance(image_array, EncodedImage):
+                    detections = process_encoded_image(
+                        api, image_array,
+                        capsule_names=capsule_names,
+                        option_vals=option_vals,
+                    )
+                else:
+                    detections = api.process_image(
+                        img_bgr=image_array,
+                        capsule_names=capsule_names,
+                        option_vals=option_vals,
+                    )
+            except Exception as exc:
+                if reference is not None:
+                    reference.set_exception(exc)
+                raise
+            latency = time.perf_counter() - start
+            REGISTRY.observe("bulk_process_image_seconds", latency)
+
+            if reference is not None:
+                reference.set_result(detections)
+            if stats is not None:
+                stats.record(latency)
+            if cache is not None:
+                cache.put(image_path, detections)
+            return ImageResult(image_path=image_path,
+                               detections=detections,
+                               latency=latency)
+        except Exception as exc:
+            # One bad image shouldn't stop the whole job, so the error is
+            # returned with its result instead of being raised
+            logging.error(f"Could not process the image {image_path}: {exc}")
+            REGISTRY.inc("bulk_images_failed_total")
+            return ImageResult(image_path=image_path,
+                               detections=[],
+                               latency=0.0,
+                               error=exc)
+        finally:
+            # Images that were looked up in the cache but never stored, like
+            # reused images or images that couldn't be read or processed,
+            # mustn't leave their key behind
+            if cache is not None:
+                cache.discard(image_path)
+
+    # Keep some decoded images ready for when a request slot frees up, while
+    # bounding the number of images held in memory
+    max_pending = concurrency * 2
+    pending = deque()
+
+    if stats is not None:
+        stats.start()
+
+    with ThreadPoolExecutor(decode_workers) as decode_pool, \
+            ThreadPoolExecutor(1) as gate_pool, \
+            ThreadPoolExecutor(concurrency) as request_pool:
+
+        # Helper function that waits for at least one pending result
+        def _next_results() -> List[ImageResult]:
+            if ordered:
+                return [pending.popleft().result()]
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+            return [future.result() for future in done]
+
+        for image_path in image_paths:
+            decoded = decode_pool.submit(_load, image_path)
+            gated = None
+            if gate is not None:
+                gated = gate_pool.submit(_gate, image_path, decoded)
+            pending.append(request_pool.submit(_process, image_path, decoded,
+                                               gated))
+
+            if len(pending) >= max_pending:
+                yield from _next_results()
+
+        while len(pending) > 0:
+            yield from _next_results()
@@ -1,15 +1,27 @@
 # Import necessary libraries
 from pathlib import Path
 
-import cv2
-
 from brainframe.api import BrainFrameAPI
 
+from archive_crawler import Checkpoint, ResultCache, iter_images, \
+    state_dir
+from bulk_processing import ThroughputStats, process_images
+from metadata_cache import MetadataCache
+from metrics import configure_from_env
+from motion_gate import MotionGate
+
+# Set BRAINFRAME_METRICS or BRAINFRAME_PROFILE to measure where the time
+# goes
+configure_from_env()
+
 # Initialize the API and connect to the server
 api = BrainFrameAPI("http://localhost")
 
+# Cache configurations read from the server, so they're only requested once
+metadata = MetadataCache(api)
+
 # Get the names of existing capsules
-loaded_capsules = api.get_capsules()
+loaded_capsules = metadata.get_capsules()
 loaded_capsules_names = [capsule.name for capsule in loaded_capsules]
 
 # Print out the capsules names
@@ -18,37 +30,81 @@ print(f"Loaded Capsules: {loaded_capsules_names}")
 # Root directory containing the images.
 IMAGE_ARCHIVE = Path("../images/people_and_cats")
 
-# Iterate through all images in the directory
-for image_path in IMAGE_ARCHIVE.iterdir():
-    # Use only PNGs and JPGs
-    if image_path.suffix not in [".png", ".jpg"]:
-        continue
+# The max number of images being processed by BrainFrame at once. Sending
+# several images at a time lets the server batch them together.
+CONCURRENCY = 8
+
+# The names of capsules to enable while processing the image
+CAPSULE_NAMES = ["detector_people_and_vehicles_fast"]
+
+# The capsule options you want to set. You can check the available capsule
+# options with the client. Or in the code snippet above that printed capsule
+# names, also print the capsule metadata.
+OPTION_VALS = {
+    "detector_people_and_vehicles_fast": {
+        # This capsule is able to detect people, vehicles, and animals. In this
+        # example we want to filter out detections that are not animals.
+        "filter_mode": "only_animals",
+        "threshold": 0.9,
+    }
+}
+
+# Results are kept on disk, so images are only sent to BrainFrame once even
+# if the crawl is run again. The checkpoint remembers how far an interrupted
+# crawl got. Both are kept in a state directory outside of the archive, which
+# BRAINFRAME_STATE_DIR can change.
+STATE_DIR = state_dir(IMAGE_ARCHIVE)
+cache = ResultCache(STATE_DIR / "crawl_cache.sqlite",
+                    CAPSULE_NAMES, OPTION_VALS)
+checkpoint = Checkpoint(STATE_DIR / "crawl_checkpoint.txt")
 
-    # Get the image array
-    image_array = cv2.imread(str(image_path))
-
-    # Perform inference on the image and get the results
-    detections = api.process_image(
-        # Image array
-        img_bgr=image_array,
-        # The names of capsules to enable while processing the image
-        capsule_names=["detector_people_and_vehicles_fast"],
-        # The capsule options you want to set. You can check the available
-        # capsule options with the client. Or in the code snippet above that
-        # printed capsule names, also print the capsule metadata.
-        option_vals={
-            "detector_people_and_vehicles_fast": {
-                # This capsule is able to detect people, vehicles, and animals.
-                # In this example we want to filter out detections that are not
-                # animals.
-                "filter_mode": "only_animals",
-                "threshold": 0.9,
-            }
-        }
-    )
+# Find all PNGs and JPGs in the archive and its subdirectories, starting after
+# the last image of the previous crawl if it was interrupted
+image_paths = iter_images(IMAGE_ARCHIVE,
+                          suffixes=[".png", ".jpg"],
+                          start_after=checkpoint.load())
+
+# Keep track of how fast the images are processed
+stats = ThroughputStats()
+
+# Images in the same directory are usually frames from the same camera, and
+# most frames of a static camera are nearly identical. Images that barely
+# changed from the last processed image in their directory aren't sent to
+# BrainFrame, and reuse that image's detections instead.
+gate = MotionGate(threshold=0.01)
+
+# Perform inference on the images and get the results. The images are read
+# and sent to BrainFrame in the background. Results are returned in order, so
+# the checkpoint can be saved after each one.
+results = process_images(
+    api,
+    image_paths,
+    capsule_names=CAPSULE_NAMES,
+    option_vals=OPTION_VALS,
+    concurrency=CONCURRENCY,
+    ordered=True,
+    stats=stats,
+    cache=cache,
+    gate=gate,
+)
+
+# Iterate through the results of all images in the directory
+for result in results:
+    detections = result.detections
 
     print()
-    print(f"Processed image {image_path.name} and got {detections}")
+    if result.error is not None:
+        # The error was already logged. The checkpoint still moves past the
+        # image, so a resumed crawl doesn't stop on it again.
+        print(f"Skipping image {result.image_path.name}")
+        checkpoint.save(result.image_path)
+        continue
+    elif result.reused:
+        print(f"Image {result.image_path.name} barely changed, reusing "
+              f"{detections}")
+    else:
+        print(f"Processed image {result.image_path.name} and got "
+              f"{detections}")
 
     # Filter the cat detections using the class name
     cat_detections = [detection for detection in detections
@@ -56,3 +112,15 @@ for image_path in IMAGE_ARCHIVE.iterdir():
 
     if len(cat_detections) > 0:
         print(f"This image contains {len(cat_detections)} cat(s)")
+
+    checkpoint.save(result.image_path)
+
+# The crawl is done, so the next one starts from the beginning. Images that
+# were already processed will be found in the cache.
+checkpoint.clear()
+cache.close()
+
+print()
+print(stats.summary())
+print(f"Cache hits: {cache.hits}, misses: {cache.misses}")
+print(gate.summary())
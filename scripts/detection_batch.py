@@ -0,0 +1,274 @@
+# Import the dependencies
+import sys
+import threading
+import uuid
+from itertools import chain
+from typing import (Any, Dict, Iterator, List, Optional, Sequence, Tuple,
+                    Union)
+
+import numpy as np
+
+from brainframe.api import bf_codecs
+from brainframe.api.stubs.zone_statuses import ZONE_STATUS_TYPE
+
+# Every class name gets a small integer ID the first time it's seen, so
+# detections can be filtered by class by comparing integers. The IDs are
+# shared by every batch, so they can be compared across batches.
+_class_ids: Dict[str, int] = {}
+_class_ids_lock = threading.Lock()
+CLASS_NAMES: List[str] = []
+"""The class name of each class ID"""
+
+
+# Helper function to get the ID of a class name, giving it one if it's new
+def class_id(class_name: str) -> int:
+    try:
+        return _class_ids[class_name]
+    except KeyError:
+        with _class_ids_lock:
+            if class_name not in _class_ids:
+                # Every batch refers to the same copy of the name
+                CLASS_NAMES.append(sys.intern(class_name))
+                _class_ids[class_name] = len(CLASS_NAMES) - 1
+            return _class_ids[class_name]
+
+
+class DetectionView:
+    """One detection of a DetectionBatch. It reads from the batch's arrays,
+    instead of copying them.
+    """
+
+    __slots__ = ["_batch", "index"]
+
+    def __init__(self, batch: "DetectionBatch", index: int):
+        self._batch = batch
+        self.index = index
+
+    @property
+    def class_name(self) -> str:
+        return CLASS_NAMES[self._batch.class_ids[self.index]]
+
+    @property
+    def bounds(self) -> np.ndarray:
+        """[x_min, y_min, x_max, y_max]"""
+        return self._batch.bounds[self.index]
+
+    @property
+    def center(self) -> Tuple[float, float]:
+        x, y = self._batch.centers[self.index]
+        return float(x), float(y)
+
+    @property
+    def confidence(self) -> float:
+        return float(self._batch.confidences[self.index])
+
+    @property
+    def track_id(self) -> Optional[uuid.UUID]:
+        return self._batch.track_ids[self.index]
+
+    @property
+    def detection(self) -> bf_codecs.Detection:
+        """The original Detection, for fields that aren't stored as arrays,
+        like attributes and children
+        """
+        return self._batch.detections[self.index]
+
+    @property
+    def attributes(self) -> Dict[str, str]:
+        return self.detection.attributes
+
+    @property
+    def extra_data(self) -> Dict[str, Any]:
+        return self.detection.extra_data
+
+    def __repr__(self) -> str:
+        return (f"DetectionView(class_name={self.class_name!r}, "
+                f"bounds={self.bounds.tolist()}, "
+                f"confidence={self.confidence})")
+
+
+class DetectionBatch:
+    """The detections of a frame or image, stored as arrays. Index i of each
+    array describes the same detection. Filtering and geometry work on all
+    detections at once, instead of one Detection object at a time.
+    """
+
+    __slots__ = ["bounds", "centers", "class_ids", "confidences",
+                 "track_ids", "detections"]
+
+    def __init__(self, bounds: np.ndarray,
+                 centers: np.ndarray,
+                 class_ids: np.ndarray,
+                 confidences: np.ndarray,
+                 track_ids: List[Optional[uuid.UUID]],
+                 detections: List[bf_codecs.Detection]):
+        """
+        :param bounds: Shape (n, 4), [x_min, y_min, x_max, y_max] of each
+            detection
+        :param centers: Shape (n, 2), the mean of each detection's coords,
+            like Detection.center
+        :param class_ids: Shape (n,), the class ID of each detection, see
+            class_id
+        :param confidences: Shape (n,), the detection_confidence of each
+            detection, NaN where it isn't known
+        :param track_ids: The tracking ID of each detection, None where the
+            detection isn't tracked
+        :param detections: The original Detection of each detection
+        """
+        self.bounds = bounds
+        self.centers = centers
+        self.class_ids = class_ids
+        self.confidences = confidences
+        self.track_ids = track_ids
+        self.detections = detections
+
+    @classmethod
+    def from_detections(cls, detections: Sequence[bf_codecs.Detection],
+                        class_name: Optional[str] = None) \
+            -> "DetectionBatch":
+        """
+        :param detections: Detections, like the results of
+            BrainFrameAPI.process_image or the detections within a zone
+        :param class_name: If provided, only detections of this class are
+            kept. Filtering while converting is cheaper than converting every
+            detection and using of_class.
+        :return: The detections as a batch
+        """
+        if class_name is not None:
+            detections = [detection for detection in detections
+                          if detection.class_name == class_name]
+        if len(detections) == 0:
+            return cls.empty()
+
+        # All points are read into one flat array in a single pass, which is
+        # much faster than letting NumPy work out the shape of nested lists
+        coords = [detection.coords for detection in detections]
+        num_points = [len(points) for points in coords]
+        points = np.fromiter(chain.from_iterable(chain.from_iterable(coords)),
+                             dtype=np.float64, count=2 * sum(num_points))
+
+        if min(num_points) == max(num_points):
+            # Usually every detection is a box with the same number of
+            # points, so the points can be reduced along a single axis
+            points = points.reshape((len(coords), num_points[0], 2))
+            bounds = np.concatenate([points.min(axis=1), points.max(axis=1)],
+                                    axis=1)
+            centers = points.mean(axis=1)
+        else:
+            # Otherwise each detection's run of points is reduced separately
+            points = points.reshape((-1, 2))
+            num_points = np.array(num_points)
+            starts = np.concatenate([[0], np.cumsum(num_points[:-1])])
+            bounds = np.concatenate(
+                [np.minimum.reduceat(points, starts, axis=0),
+                 np.maximum.reduceat(points, starts, axis=0)], axis=1)
+            centers = np.add.reduceat(points, starts, axis=0) \
+                / num_points[:, None]
+
+        return cls(
+            bounds=bounds,
+            centers=centers,
+            class_ids=np.array([class_id(detection.class_name)
+                                for detection in detections],
+                               dtype=np.int32),
+            confidences=np.array(
+                [detection.extra_data.get("detection_confidence", np.nan)
+                 for detection in detections], dtype=np.float64),
+            track_ids=[detection.track_id for detection in detections],
+            detections=list(detections))
+
+    @classmethod
+    def empty(cls) -> "DetectionBatch":
+        return cls(bounds=np.empty((0, 4), dtype=np.float64),
+                   centers=np.empty((0, 2), dtype=np.float64),
+                   class_ids=np.empty(0, dtype=np.int32),
+                   confidences=np.empty(0, dtype=np.float64),
+                   track_ids=[],
+                   detections=[])
+
+    def select(self, selection: Union[np.ndarray, Sequence[int]]) \
+            -> "DetectionBatch":
+        """
+        :param selection: A boolean mask, or the indexes of the detections
+            to keep
+        :return: A new batch with only the selected detections
+        """
+        indexes = np.asarray(selection)
+        if indexes.dtype == bool:
+            indexes = np.flatnonzero(indexes)
+        else:
+            indexes = indexes.astype(np.intp)
+        return DetectionBatch(
+            bounds=self.bounds[indexes],
+            centers=self.centers[indexes],
+            class_ids=self.class_ids[indexes],
+            confidences=self.confidences[indexes],
+            track_ids=[self.track_ids[index] for index in indexes.tolist()],
+            detections=[self.detections[index]
+                        for index in indexes.tolist()])
+
+    def of_class(self, class_name: str) -> "DetectionBatch":
+        """
+        :param class_name: The class of detections to keep, like "person"
+        :return: A new batch with only the detections of that class
+        """
+        if class_name not in _class_ids:
+            # No detection of any batch has ever had this class
+            return DetectionBatch.empty()
+        return self.select(self.class_ids == _class_ids[class_name])
+
+    @property
+    def coords(self) -> np.ndarray:
+        """Shape (n, 4, 2), the corners of each detection's bounds, in the
+        same order as Detection.bbox
+        """
+        return self.bounds[:, [[0, 1], [2, 1], [2, 3], [0, 3]]]
+
+    @property
+    def class_names(self) -> List[str]:
+        return [CLASS_NAMES[class_id_] for class_id_
+                in self.class_ids.tolist()]
+
+    def __len__(self) -> int:
+        return len(self.class_ids)
+
+    def __getitem__(self, index: int) -> DetectionView:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("DetectionBatch index out of range")
+        return DetectionView(self, index)
+
+    def __iter__(self) -> Iterator[DetectionView]:
+        for index in range(len(self)):
+            yield DetectionView(self, index)
+
+    def __repr__(self) -> str:
+        return f"DetectionBatch({list(self)})"
+
+
+# Helper function to pull the detections within a zone of every stream out
+# of a zone status packet
+def packet_to_batches(zone_status_packet: ZONE_STATUS_TYPE,
+                      zone_names: Dict[int, str],
+                      default_zone_name: str = "Screen",
+                      class_name: Optional[str] = None) \
+        -> Dict[int, Tuple[float, DetectionBatch]]:
+    """
+    :param zone_status_packet: A packet from
+        BrainFrameAPI.get_zone_status_stream
+    :param zone_names: The zone to use for each stream, by stream ID
+    :param default_zone_name: The zone to use for streams not in zone_names
+    :param class_name: If provided, only detections of this class are kept
+    :return: {stream_id: (tstamp, detections within the zone)}
+    """
+    batches = {}
+    for stream_id, zone_statuses in zone_status_packet.items():
+        zone_name = zone_names.get(stream_id, default_zone_name)
+        zone_status = zone_statuses.get(zone_name)
+        if zone_status is None:
+            continue
+        batches[stream_id] = (
+            zone_status.tstamp,
+            DetectionBatch.from_detections(zone_status.within, class_name))
+    return batches
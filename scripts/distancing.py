@@ -0,0 +1,422 @@
+# Import the dependencies
+import math
+import uuid
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from brainframe.api.stubs.zone_statuses import ZONE_STATUS_TYPE
+
+from detection_batch import packet_to_batches
+
+
+class Violations(NamedTuple):
+    """Every pair of detections that is closer than the minimum distance. The
+    three arrays have the same length, and index k describes one pair.
+    """
+
+    first: np.ndarray
+    """Index of the first detection of each pair"""
+
+    second: np.ndarray
+    """Index of the second detection of each pair, always > first"""
+
+    distances: np.ndarray
+    """Distance between the two detections, 0 if their bboxes overlap"""
+
+
+class StreamPeople(NamedTuple):
+    """The people in one stream's zone status"""
+
+    tstamp: float
+    """When the frame was processed, in Unix Time (seconds)"""
+
+    coords: np.ndarray
+    """Shape (n, 4, 2), the coords of each person"""
+
+    track_ids: List[Optional[uuid.UUID]]
+    """The tracking ID of each person, None where the person isn't tracked"""
+
+
+# Helper function to pull the people of every stream out of a zone status
+# packet
+def packet_to_people(zone_status_packet: ZONE_STATUS_TYPE,
+                     zone_names: Dict[int, str],
+                     default_zone_name: str = "Screen",
+                     class_name: str = "person") -> Dict[int, StreamPeople]:
+    """
+    :param zone_status_packet: A packet from
+        BrainFrameAPI.get_zone_status_stream
+    :param zone_names: The zone to use for each stream, by stream ID
+    :param default_zone_name: The zone to use for streams not in zone_names
+    :param class_name: Only detections of this class are used
+    :return: The people in each stream, by stream ID
+    """
+    stream_people = {}
+    for stream_id, (tstamp, people) in packet_to_batches(
+            zone_status_packet, zone_names, default_zone_name,
+            class_name).items():
+        stream_people[stream_id] = StreamPeople(
+            tstamp=tstamp,
+            coords=people.coords,
+            track_ids=people.track_ids)
+
+    return stream_people
+
+
+# Helper function to pull the person coords of every stream out of a zone
+# status packet
+def packet_to_coords(zone_status_packet: ZONE_STATUS_TYPE,
+                     zone_names: Dict[int, str],
+                     default_zone_name: str = "Screen",
+                     class_name: str = "person") -> Dict[int, np.ndarray]:
+    """
+    :param zone_status_packet: A packet from
+        BrainFrameAPI.get_zone_status_stream
+    :param zone_names: The zone to use for each stream, by stream ID
+    :param default_zone_name: The zone to use for streams not in zone_names
+    :param class_name: Only detections of this class are used
+    :return: {stream_id: coords}, where coords has a shape of (n, 4, 2)
+    """
+    stream_people = packet_to_people(zone_status_packet, zone_names,
+                                     default_zone_name, class_name)
+    return {stream_id: people.coords
+            for stream_id, people in stream_people.items()}
+
+
+# Helper function to compute the bounds of every bbox once per frame
+def coords_to_bounds(coords: np.ndarray) -> np.ndarray:
+    """
+    :param coords: An array of shape (n, points, 2)
+    :return: An array of shape (n, 4) with [x_min, y_min, x_max, y_max] rows
+    """
+    return np.concatenate([coords.min(axis=1), coords.max(axis=1)], axis=1)
+
+
+# Helper function to check if two detections are overlapped
+def is_overlapped(coords1: List[List[int]], coords2: List[List[int]]) -> bool:
+    """
+    :param coords1: Coords of the first Detection
+    :param coords2: Coords of the second Detection
+    :return: If the two Detections' bboxes are overlapped
+    """
+
+    # Sort the x, y in ascending order
+    coords1_sorted_x = sorted([c[0] for c in coords1])
+    coords2_sorted_x = sorted([c[0] for c in coords2])
+    coords1_sorted_y = sorted([c[1] for c in coords1])
+    coords2_sorted_y = sorted([c[1] for c in coords2])
+
+    # Return False if the rects do not overlap horizontally
+    if coords1_sorted_x[0] > coords2_sorted_x[-1] \
+            or coords2_sorted_x[0] > coords1_sorted_x[-1]:
+        return False
+
+    # Return False if the rects do not overlap vertically
+    if coords1_sorted_y[0] > coords2_sorted_y[-1] \
+            or coords2_sorted_y[0] > coords1_sorted_y[-1]:
+        return False
+
+    # Otherwise, the two rects must overlap
+    return True
+
+
+# Helper function to calculate the distance between the center points of two
+# detections
+def get_distance(coords1: List[List[int]], coords2: List[List[int]]) -> float:
+    """
+    :param coords1: Coords of the first Detection
+    :param coords2: Coords of the second Detection
+    :return: Distance between the center of the two Detections
+    """
+    center1_x = sum(c[0] for c in coords1) / len(coords1)
+    center1_y = sum(c[1] for c in coords1) / len(coords1)
+    center2_x = sum(c[0] for c in coords2) / len(coords2)
+    center2_y = sum(c[1] for c in coords2) / len(coords2)
+    return math.hypot(center1_x - center2_x, center1_y - center2_y)
+
+
+def find_violations_loop(coords: np.ndarray,
+                         min_distance: float) -> Violations:
+    """The original pair-by-pair Python loop. It is kept as a reference for
+    the other engines and for benchmarking.
+
+    :param coords: An array of shape (n, 4, 2) with the coords of each person
+    :param min_distance: The minimum distance between two people
+    :return: Every pair of people closer than min_distance
+    """
+    coords_list = coords.tolist()
+    first, second, distances = [], [], []
+
+    # Compare the distance between each detections.
+    for i, current_coords in enumerate(coords_list):
+        for j in range(i + 1, len(coords_list)):
+            target_coords = coords_list[j]
+            # If the bbox representing two people are overlapped, the
+            # distance is 0, otherwise it's the distance between the
+            # center of these two bbox.
+            if is_overlapped(current_coords, target_coords):
+                distance = 0
+            else:
+                distance = get_distance(current_coords, target_coords)
+
+            if distance < min_distance:
+                first.append(i)
+                second.append(j)
+                distances.append(distance)
+
+    return Violations(first=np.array(first, dtype=np.intp),
+                      second=np.array(second, dtype=np.intp),
+                      distances=np.array(distances, dtype=np.float64))
+
+
+# Helper function that finds the distance between bboxes, the same way as
+# is_overlapped and get_distance
+def _distances(bounds_a: np.ndarray, bounds_b: np.ndarray) -> np.ndarray:
+    """
+    :param bounds_a: An array of bounds, as returned by coords_to_bounds
+    :param bounds_b: An array of bounds that broadcasts with bounds_a
+    :return: The distance between each pair of bboxes, 0 where they overlap
+    """
+    # Same rule as is_overlapped: the rects overlap unless they are separated
+    # horizontally or vertically
+    overlapped = ((bounds_a[..., 0] <= bounds_b[..., 2])
+                  & (bounds_b[..., 0] <= bounds_a[..., 2])
+                  & (bounds_a[..., 1] <= bounds_b[..., 3])
+                  & (bounds_b[..., 1] <= bounds_a[..., 3]))
+
+    # The center of a rect is the middle of its bounds
+    centers_a = (bounds_a[..., :2] + bounds_a[..., 2:]) / 2
+    centers_b = (bounds_b[..., :2] + bounds_b[..., 2:]) / 2
+    delta = centers_a - centers_b
+    distances = np.hypot(delta[..., 0], delta[..., 1])
+
+    distances[overlapped] = 0
+    return distances
+
+
+# Helper function that compares every bbox in bounds_a against every bbox in
+# bounds_b at once
+def _pairwise_distances(bounds_a: np.ndarray,
+                        bounds_b: np.ndarray) -> np.ndarray:
+    """
+    :param bounds_a: An array of shape (n, 4), as returned by coords_to_bounds
+    :param bounds_b: An array of shape (m, 4), as returned by coords_to_bounds
+    :return: An array of shape (n, m) with the distance between each pair, 0
+        where the bboxes overlap
+    """
+    return _distances(bounds_a[:, None, :], bounds_b[None, :, :])
+
+
+def find_violations_matrix(coords: np.ndarray,
+                           min_distance: float) -> Violations:
+    """Compares every pair of people at once with NumPy. Memory use grows with
+    the square of the number of people.
+
+    :param coords: An array of shape (n, 4, 2) with the coords of each person
+    :param min_distance: The minimum distance between two people
+    :return: Every pair of people closer than min_distance
+    """
+    bounds = coords_to_bounds(coords)
+    distances = _pairwise_distances(bounds, bounds)
+
+    # Only keep the upper triangle, so each pair is reported once and nobody
+    # is compared against themselves
+    violating = np.triu(distances < min_distance, k=1)
+    first, second = np.nonzero(violating)
+
+    return Violations(first=first,
+                      second=second,
+                      distances=distances[first, second])
+
+
+# The cells that are compared against each cell of the grid. Only half of the
+# neighborhood is needed, since the other half compares against this cell.
+_NEIGHBOR_OFFSETS = ((1, -1), (1, 0), (1, 1), (0, 1))
+
+
+def find_violations_grid(coords: np.ndarray,
+                         min_distance: float) -> Violations:
+    """Places people in a uniform grid of min_distance sized cells, and only
+    compares people in neighboring cells. This scales close to linearly with
+    the number of people, as long as they are spread out over the frame.
+    People with a bbox larger than a cell are compared against the cells
+    within reach of their bbox instead.
+
+    :param coords: An array of shape (n, 4, 2) with the coords of each person
+    :param min_distance: The minimum distance between two people
+    :return: Every pair of people closer than min_distance
+    """
+    bounds = coords_to_bounds(coords)
+    if len(bounds) == 0 or min_distance <= 0:
+        return _empty_violations()
+    cell_size = min_distance
+
+    # Find the cell each person's center is in
+    centers = (bounds[:, :2] + bounds[:, 2:]) / 2
+    cells = np.floor(centers / cell_size).astype(np.int64)
+
+    # Two overlapping bboxes can have centers further apart than min_distance.
+    # That can't happen for bboxes that fit in a cell, since they're at most
+    # one cell apart. Larger bboxes, like people close to the camera, look
+    # for smaller people further away instead of making every cell larger.
+    sizes = (bounds[:, 2:] - bounds[:, :2]).max(axis=1)
+    is_large = sizes > cell_size
+
+    firsts, seconds, all_distances = _find_small_violations(
+        bounds, cells, np.flatnonzero(~is_large), min_distance)
+    if is_large.any():
+        first, second, distances = _find_large_violations(
+            bounds, cells, sizes, np.flatnonzero(is_large), min_distance)
+        firsts.append(first)
+        seconds.append(second)
+        all_distances.append(distances)
+
+    first = np.concatenate(firsts)
+    second = np.concatenate(seconds)
+    distances = np.concatenate(all_distances)
+
+    # Report pairs the same way as the other engines: first < second, sorted
+    first, second = np.minimum(first, second), np.maximum(first, second)
+    pair_order = np.lexsort((second, first))
+    return Violations(first=first[pair_order],
+                      second=second[pair_order],
+                      distances=distances[pair_order])
+
+
+# Helper function that finds the violations between people whose bboxes fit
+# in a cell, by comparing the people of each cell against its neighbors
+def _find_small_violations(bounds: np.ndarray, cells: np.ndarray,
+                           small: np.ndarray, min_distance: float) \
+        -> Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]]:
+    """
+    :param bounds: The bounds of everyone, as returned by coords_to_bounds
+    :param cells: The cell of everyone's center
+    :param small: The indexes of the people to compare
+    :param min_distance: The minimum distance between two people
+    :return: The first people, second people and distances of the
+        violations, in chunks
+    """
+    # Group the people by the cell their center is in
+    cell_order = np.lexsort((cells[small, 1], cells[small, 0]))
+    order = small[cell_order]
+    unique_cells, starts = np.unique(cells[order], axis=0, return_index=True)
+    ends = np.append(starts[1:], len(order))
+    grid: Dict[Tuple[int, int], np.ndarray] = {
+        (cell_x, cell_y): order[start:end]
+        for (cell_x, cell_y), start, end
+        in zip(unique_cells.tolist(), starts, ends)
+    }
+
+    firsts, seconds, all_distances = [], [], []
+    for (cell_x, cell_y), members in grid.items():
+        member_bounds = bounds[members]
+
+        # Compare people within the same cell
+        distances = _pairwise_distances(member_bounds, member_bounds)
+        a, b = np.nonzero(np.triu(distances < min_distance, k=1))
+        firsts.append(members[a])
+        seconds.append(members[b])
+        all_distances.append(distances[a, b])
+
+        # Compare people against the neighboring cells
+        for offset_x, offset_y in _NEIGHBOR_OFFSETS:
+            neighbors = grid.get((cell_x + offset_x, cell_y + offset_y))
+            if neighbors is None:
+                continue
+            distances = _pairwise_distances(member_bounds, bounds[neighbors])
+            a, b = np.nonzero(distances < min_distance)
+            firsts.append(members[a])
+            seconds.append(neighbors[b])
+            all_distances.append(distances[a, b])
+
+    # Keep the chunks from being empty, for np.concatenate
+    firsts.append(np.empty(0, dtype=np.intp))
+    seconds.append(np.empty(0, dtype=np.intp))
+    all_distances.append(np.empty(0, dtype=np.float64))
+    return firsts, seconds, all_distances
+
+
+# Helper function that finds the violations of people whose bboxes don't fit
+# in a cell, against everyone who isn't larger than them
+def _find_large_violations(bounds: np.ndarray, cells: np.ndarray,
+                           sizes: np.ndarray, large: np.ndarray,
+                           min_distance: float) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :param bounds: The bounds of everyone, as returned by coords_to_bounds
+    :param cells: The cell of everyone's center
+    :param sizes: The larger side of everyone's bbox
+    :param large: The indexes of the people that look for violations
+    :param min_distance: The minimum distance between two people, which is
+        also the size of a cell
+    :return: The first people, second people and distances of the violations
+    """
+    cell_size = min_distance
+
+    # Sort everyone by their cell, column by column, so the people in a
+    # range of rows of a column are next to each other
+    order = np.lexsort((cells[:, 1], cells[:, 0]))
+    min_cell = cells.min(axis=0)
+    max_cell = cells.max(axis=0)
+    num_rows = max_cell[1] - min_cell[1] + 1
+    cell_keys = ((cells[order, 0] - min_cell[0]) * num_rows
+                 + cells[order, 1] - min_cell[1])
+
+    # The center of a smaller bbox that overlaps this one is at most half
+    # this one's size away from it, and a center closer than min_distance to
+    # its center is at most min_distance away from it
+    reach = np.maximum(cell_size, sizes[large] / 2)[:, None]
+    cell_ranges = np.floor(np.concatenate(
+        [bounds[large, :2] - reach, bounds[large, 2:] + reach],
+        axis=1) / cell_size).astype(np.int64)
+    cell_ranges[:, :2] = np.maximum(cell_ranges[:, :2], min_cell)
+    cell_ranges[:, 2:] = np.minimum(cell_ranges[:, 2:], max_cell)
+
+    # Look up the people in the range of rows of each column within reach
+    num_columns = np.maximum(cell_ranges[:, 2] - cell_ranges[:, 0] + 1, 0)
+    searches = np.repeat(np.arange(len(large)), num_columns)
+    columns = cell_ranges[searches, 0] + _ranges(num_columns)
+    column_keys = (columns - min_cell[0]) * num_rows - min_cell[1]
+    starts = np.searchsorted(cell_keys,
+                             column_keys + cell_ranges[searches, 1], "left")
+    ends = np.searchsorted(cell_keys,
+                           column_keys + cell_ranges[searches, 3], "right")
+    counts = np.maximum(ends - starts, 0)
+    first = np.repeat(large[searches], counts)
+    second = order[np.repeat(starts, counts) + _ranges(counts)]
+
+    # Each pair is only checked by the larger person, or by the first of two
+    # people of the same size
+    checked = ((sizes[second] < sizes[first])
+               | ((sizes[second] == sizes[first]) & (second > first)))
+    first, second = first[checked], second[checked]
+
+    distances = _distances(bounds[first], bounds[second])
+    violating = distances < min_distance
+    return first[violating], second[violating], distances[violating]
+
+
+# Helper function that counts up from 0 to each count, one after another
+def _ranges(counts: np.ndarray) -> np.ndarray:
+    """
+    :param counts: The length of each range
+    :return: The concatenated ranges, like [0, 1, 2, 0, 1] for [3, 2]
+    """
+    ends = np.cumsum(counts)
+    return np.arange(ends[-1] if len(ends) > 0 else 0) \
+        - np.repeat(ends - counts, counts)
+
+
+def _empty_violations() -> Violations:
+    return Violations(first=np.empty(0, dtype=np.intp),
+                      second=np.empty(0, dtype=np.intp),
+                      distances=np.empty(0, dtype=np.float64))
+
+
+# The available engines, by the name used to select them on the command line
+ENGINES: Dict[str, Callable[[np.ndarray, float], Violations]] = {
+    "grid": find_violations_grid,
+    "matrix": find_violations_matrix,
+    "loop": find_violations_loop,
+}
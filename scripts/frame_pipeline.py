@@ -0,0 +1,306 @@
+# Import the dependencies
+import multiprocessing
+import weakref
+from itertools import count
+from multiprocessing import shared_memory
+from pathlib import Path
+from queue import Empty
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class VideoFrame(NamedTuple):
+    """A decoded frame of a video file"""
+
+    index: int
+    """The index of the frame in the video, counting skipped frames"""
+
+    timestamp: float
+    """The time of the frame from the start of the video, in seconds"""
+
+    image: np.ndarray
+    """The frame in BGR format. With a FramePipeline, this is a view of shared
+    memory that is reused once the next frame is requested, so copy it if it
+    needs to be kept.
+    """
+
+
+class VideoInfo(NamedTuple):
+    width: int
+    height: int
+    fps: float
+    frame_count: int
+
+
+# Helper function to read the size, frame rate and length of a video
+def probe_video(video_path: Path) -> VideoInfo:
+    capture = cv2.VideoCapture(str(video_path))
+    try:
+        if not capture.isOpened():
+            raise IOError(f"Could not open the video {video_path}. If it's a "
+                          f"file from this repo, make sure Git LFS pulled it.")
+        return VideoInfo(
+            width=int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            height=int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            fps=capture.get(cv2.CAP_PROP_FPS) or 30.0,
+            frame_count=int(capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+    finally:
+        capture.release()
+
+
+def _decode_worker(video_path: str,
+                   chunks: List[Tuple[int, Optional[int]]],
+                   stride: int,
+                   size: Optional[Tuple[int, int]],
+                   shm_name: str,
+                   ring_shape: Tuple[int, ...],
+                   free_slots: multiprocessing.Queue,
+                   ready: multiprocessing.Queue) -> None:
+    """Decodes chunks of a video into this worker's slots of the ring buffer.
+    Runs in its own process.
+
+    :param video_path: The video to decode
+    :param chunks: The (start, end) frame indexes of every chunk to decode,
+        in order. An end of None decodes until the end of the video.
+    :param stride: Only every stride-th frame is decoded
+    :param size: The (width, height) to resize frames to, or None
+    :param shm_name: The name of the shared memory holding the ring buffer
+    :param ring_shape: The shape of the ring buffer, (slots, h, w, 3)
+    :param free_slots: Slots this worker may write to. The consumer puts them
+        back once it's done with them.
+    :param ready: Where this worker reports decoded frames, as ("frame",
+        index, slot), finished chunks as ("end",), the end of the video as
+        ("eof",), and errors as ("error", message)
+    """
+    # Every worker is its own process, so OpenCV's own threads would only
+    # compete with the other workers
+    cv2.setNumThreads(1)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray(ring_shape, dtype=np.uint8, buffer=shm.buf)
+    capture = cv2.VideoCapture(video_path)
+    try:
+        position = None
+        for start, end in chunks:
+            # Only seek when the chunk doesn't follow the last one, seeking
+            # is slower than reading
+            if position != start:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+            indexes = count(start) if end is None else range(start, end)
+            for index in indexes:
+                # Frames that are skipped are grabbed but not converted
+                if not capture.grab():
+                    ready.put(("eof",))
+                    return
+                position = index + 1
+                if index % stride != 0:
+                    continue
+
+                success, frame = capture.retrieve()
+                if not success:
+                    ready.put(("eof",))
+                    return
+
+                slot = free_slots.get()
+                if size is not None:
+                    cv2.resize(frame, size, dst=ring[slot],
+                               interpolation=cv2.INTER_AREA)
+                else:
+                    ring[slot] = frame
+                ready.put(("frame", index, slot))
+
+            ready.put(("end",))
+        ready.put(("eof",))
+    except Exception as exc:
+        ready.put(("error", f"{type(exc).__name__}: {exc}"))
+    finally:
+        capture.release()
+        del ring
+        shm.close()
+
+
+# Helper function to release the ring buffer's shared memory
+def _release_shared_memory(shm: shared_memory.SharedMemory) -> None:
+    shm.close()
+    shm.unlink()
+
+
+class FramePipeline:
+    """Decodes a video file in several processes at once. Workers decode
+    chunks of consecutive frames, taking turns, and write them into a ring
+    buffer in shared memory. Frames are yielded in order as views into that
+    buffer, so they're never copied between processes.
+
+    Every worker has its own slots in the ring buffer. A worker that gets
+    ahead of the consumer waits for its slots to be freed, which bounds the
+    memory used no matter how long the video is.
+    """
+
+    def __init__(self, video_path: Path,
+                 num_workers: int = 4,
+                 stride: int = 1,
+                 size: Optional[Tuple[int, int]] = None,
+                 chunk_frames: int = 64,
+                 slots_per_worker: Optional[int] = None):
+        """
+        :param video_path: The video to decode
+        :param num_workers: The number of decoding processes
+        :param stride: Only every stride-th frame is decoded, for example 5
+            to get 6 frames a second from a 30 fps video
+        :param size: The (width, height) to resize frames to, or None to keep
+            their original size
+        :param chunk_frames: The number of consecutive frames each worker
+            decodes at a time. Workers have to seek to the start of every
+            chunk, which is slow, so chunks shouldn't be too small.
+        :param slots_per_worker: The number of frames each worker can have
+            waiting in the ring buffer. Defaults to one chunk's worth, so
+            every worker can stay busy.
+        """
+        self.video_path = Path(video_path)
+        self.num_workers = num_workers
+        self.stride = stride
+        self.info = probe_video(self.video_path)
+        if size is None:
+            size = (self.info.width, self.info.height)
+            self._resize = None
+        else:
+            self._resize = size
+        self.size = size
+
+        # Chunks start on a multiple of stride, so the same frames are kept
+        # as when decoding the whole video in one process
+        chunk_frames = max(chunk_frames // stride, 1) * stride
+        self._chunks: List[Tuple[int, Optional[int]]] = [
+            (start, start + chunk_frames)
+            for start in range(0, self.info.frame_count, chunk_frames)]
+        # The frame count is only an estimate from the container, so the last
+        # chunk is decoded until the end of the video, wherever that is. If
+        # the container doesn't know the frame count at all, this leaves a
+        # single chunk, which one worker decodes sequentially.
+        if len(self._chunks) > 0:
+            self._chunks[-1] = (self._chunks[-1][0], None)
+        else:
+            self._chunks = [(0, None)]
+        self.slots_per_worker = slots_per_worker \
+            or max(chunk_frames // stride, 2)
+
+    def __iter__(self) -> Iterator[VideoFrame]:
+        num_workers = max(min(self.num_workers, len(self._chunks)), 1)
+        width, height = self.size
+        ring_shape = (num_workers * self.slots_per_worker, height, width, 3)
+        shm = shared_memory.SharedMemory(
+            create=True, size=int(np.prod(ring_shape)))
+        ring = np.ndarray(ring_shape, dtype=np.uint8, buffer=shm.buf)
+
+        # Yielded frames are views of the ring buffer, and the consumer may
+        # still hold one after it stops iterating. The shared memory is only
+        # released once the ring and every view of it are gone, since reading
+        # a view of released memory crashes the interpreter.
+        weakref.finalize(ring, _release_shared_memory, shm)
+
+        # Workers are started fresh instead of forked, since forking a
+        # process that already uses OpenCV can deadlock
+        context = multiprocessing.get_context("spawn")
+        free_slots = []
+        ready = []
+        workers = []
+        for worker_index in range(num_workers):
+            worker_free = context.Queue()
+            first_slot = worker_index * self.slots_per_worker
+            for slot in range(first_slot, first_slot + self.slots_per_worker):
+                worker_free.put(slot)
+            free_slots.append(worker_free)
+            ready.append(context.Queue())
+
+            worker = context.Process(
+                target=_decode_worker,
+                args=(str(self.video_path),
+                      self._chunks[worker_index::num_workers],
+                      self.stride, self._resize, shm.name, ring_shape,
+                      worker_free, ready[worker_index]),
+                daemon=True)
+            worker.start()
+            workers.append(worker)
+
+        try:
+            for chunk_index in range(len(self._chunks)):
+                worker_index = chunk_index % num_workers
+                while True:
+                    message = self._get(ready[worker_index],
+                                        workers[worker_index])
+                    if message[0] == "end":
+                        break
+                    if message[0] == "eof":
+                        return
+                    if message[0] == "error":
+                        raise IOError(f"Could not decode {self.video_path}: "
+                                      f"{message[1]}")
+
+                    _, index, slot = message
+                    yield VideoFrame(index=index,
+                                     timestamp=index / self.info.fps,
+                                     image=ring[slot])
+                    # The consumer is done with the frame once it asks for
+                    # the next one
+                    free_slots[worker_index].put(slot)
+        finally:
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+            del ring
+
+    @staticmethod
+    def _get(queue: multiprocessing.Queue,
+             worker: multiprocessing.Process) -> tuple:
+        # Wait for the worker's next message, without waiting forever if it
+        # died
+        while True:
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                if not worker.is_alive():
+                    raise IOError(f"A decode worker stopped with exit code "
+                                  f"{worker.exitcode}")
+
+
+def iter_video_frames(video_path: Path,
+                      num_workers: int = 0,
+                      stride: int = 1,
+                      size: Optional[Tuple[int, int]] = None) \
+        -> Iterator[VideoFrame]:
+    """Yields the frames of a video file, decoded in this process or by a
+    FramePipeline.
+
+    :param video_path: The video to decode
+    :param num_workers: The number of decoding processes, or 0 to decode in
+        this process
+    :param stride: Only every stride-th frame is decoded
+    :param size: The (width, height) to resize frames to, or None to keep
+        their original size
+    :return: A generator of frames, in order
+    """
+    if num_workers > 0:
+        yield from FramePipeline(video_path, num_workers=num_workers,
+                                 stride=stride, size=size)
+        return
+
+    fps = probe_video(video_path).fps
+    capture = cv2.VideoCapture(str(video_path))
+    try:
+        index = 0
+        while capture.grab():
+            if index % stride == 0:
+                success, frame = capture.retrieve()
+                if not success:
+                    break
+                if size is not None:
+                    frame = cv2.resize(frame, size,
+                                       interpolation=cv2.INTER_AREA)
+                yield VideoFrame(index=index, timestamp=index / fps,
+                                 image=frame)
+            index += 1
+    finally:
+        capture.release()
@@ -2,12 +2,19 @@
 from pathlib import Path
 from brainframe.api import BrainFrameAPI, bf_codecs
 
+from metadata_cache import MetadataCache
+from storage_upload import upload_file
+
 
 # Initialize the API and connect to the server
 api = BrainFrameAPI("http://localhost")
 
+# Cache configurations read from the server, so they're only requested once.
+# Changes made through the cache keep it up to date.
+metadata = MetadataCache(api)
+
 # Check the existing streams and print them out
-stream_configs = api.get_stream_configurations()
+stream_configs = metadata.get_stream_configurations()
 print("Existing streams: ", stream_configs)
 
 # Create a new IP camera StreamConfiguration codec
@@ -36,11 +43,9 @@ new_web_camera_stream_config = bf_codecs.StreamConfiguration(
     premises_id=None,
 )
 
-# Upload the local file to the database and create a storage id
-storage_id = api.new_storage(
-    data=Path("../videos/shopping_cashier_gone.mp4").read_bytes(),
-    mime_type="application/octet-stream"
-)
+# Upload the local file to the database and create a storage id. The file is
+# streamed in chunks instead of being read into memory.
+storage_id = upload_file(api, Path("../videos/shopping_cashier_gone.mp4"))
 # Create a local file stream configuration codec
 new_local_file_stream_config = bf_codecs.StreamConfiguration(
     # The display name on the client side
@@ -55,7 +60,7 @@ new_local_file_stream_config = bf_codecs.StreamConfiguration(
 )
 
 # Tell the server to connect to the stream configuration
-new_local_file_stream_config = api.set_stream_configuration(
+new_local_file_stream_config = metadata.set_stream_configuration(
     new_local_file_stream_config)
 
 # Start analysis on the stream
@@ -0,0 +1,172 @@
+# Import the dependencies
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from brainframe.api import BrainFrameAPI, bf_codecs
+
+
+class TTLCache:
+    """A thread-safe cache where entries expire after a time to live, and the
+    least recently used entries are evicted once it's full.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        """
+        :param ttl: How long an entry is valid for, in seconds
+        :param max_size: The max number of entries to keep
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        # Entries in least to most recently used order, as
+        # {key: (value, expiry time)}
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """
+        :param key: The key of the entry
+        :param load: Called to get the value when the entry is missing or
+            expired
+        :return: The cached or newly loaded value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Load outside of the lock, so a slow request doesn't block lookups
+        # of other keys
+        value = load()
+        self.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """
+        :param key: The entry to remove, or None to remove every entry
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class MetadataCache:
+    """Caches the stream, zone, alarm and capsule configurations read from
+    BrainFrame, which rarely change, so they aren't requested again every time
+    they're looked up. Changes made through this class invalidate the
+    affected entries.
+    """
+
+    _ALL = "all"
+    """The key used for lists of every configuration"""
+
+    def __init__(self, api: BrainFrameAPI, ttl: float = 60,
+                 max_size: int = 10000):
+        """
+        :param api: The API to load configurations with
+        :param ttl: How long a configuration is used before it's requested
+            again, in seconds
+        :param max_size: The max number of configurations of each type to
+            keep
+        """
+        self.api = api
+        self.alarms = TTLCache(ttl, max_size)
+        self.zones = TTLCache(ttl, max_size)
+        self.streams = TTLCache(ttl, max_size)
+        self.capsules = TTLCache(ttl, max_size)
+
+    def prefetch(self) -> None:
+        """Loads every stream, zone and alarm configuration with a few bulk
+        requests, instead of one request per configuration later on.
+        """
+        stream_configs = self.api.get_stream_configurations()
+        self.streams.set(self._ALL, stream_configs)
+        for stream_config in stream_configs:
+            self.streams.set(stream_config.id, stream_config)
+
+        for zone in self.api.get_zones():
+            self.zones.set(zone.id, zone)
+            for alarm in zone.alarms:
+                self.alarms.set(alarm.id, alarm)
+
+        self.capsules.set(self._ALL, self.api.get_capsules())
+
+    def get_zone_alarm(self, alarm_id: int) -> bf_codecs.ZoneAlarm:
+        return self.alarms.get(alarm_id,
+                               lambda: self.api.get_zone_alarm(alarm_id))
+
+    def get_zone(self, zone_id: int) -> bf_codecs.Zone:
+        return self.zones.get(zone_id, lambda: self.api.get_zone(zone_id))
+
+    def get_stream_configuration(self, stream_id: int) \
+            -> bf_codecs.StreamConfiguration:
+        return self.streams.get(
+            stream_id, lambda: self.api.get_stream_configuration(stream_id))
+
+    def get_stream_configurations(self) -> List[bf_codecs.StreamConfiguration]:
+        return self.streams.get(self._ALL,
+                                self.api.get_stream_configurations)
+
+    def get_capsules(self) -> List[bf_codecs.Capsule]:
+        return self.capsules.get(self._ALL, self.api.get_capsules)
+
+    def set_stream_configuration(
+            self, stream_config: bf_codecs.StreamConfiguration) \
+            -> bf_codecs.StreamConfiguration:
+        stream_config = self.api.set_stream_configuration(stream_config)
+        self.streams.invalidate(self._ALL)
+        self.streams.set(stream_config.id, stream_config)
+        return stream_config
+
+    def set_zone(self, zone: bf_codecs.Zone) -> bf_codecs.Zone:
+        zone = self.api.set_zone(zone)
+        self.zones.set(zone.id, zone)
+        for alarm in zone.alarms:
+            self.alarms.set(alarm.id, alarm)
+        return zone
+
+    def set_zone_alarm(self, alarm: bf_codecs.ZoneAlarm) \
+            -> bf_codecs.ZoneAlarm:
+        alarm = self.api.set_zone_alarm(alarm)
+        self.alarms.set(alarm.id, alarm)
+        # The zone holds a copy of its alarms
+        self.zones.invalidate(alarm.zone_id)
+        return alarm
+
+    def invalidate(self) -> None:
+        """Forgets every configuration, for when they were changed outside of
+        this cache.
+        """
+        for cache in [self.alarms, self.zones, self.streams, self.capsules]:
+            cache.invalidate()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        :return: The hits, misses and size of each type of configuration
+        """
+        return {name: {"hits": cache.hits,
+                       "misses": cache.misses,
+                       "size": len(cache)}
+                for name, cache in [("alarms", self.alarms),
+                                    ("zones", self.zones),
+                                    ("streams", self.streams),
+                                    ("capsules", self.capsules)]}
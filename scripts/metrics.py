@@ -0,0 +1,394 @@
+# Import the dependencies
+import atexit
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Bucket upper bounds, in seconds, that cover everything from a local
+# computation to a slow REST call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Set these environment variables to a file path to turn on metrics or the
+# sampling profiler for any script that calls configure_from_env
+METRICS_ENV = "BRAINFRAME_METRICS"
+PROFILE_ENV = "BRAINFRAME_PROFILE"
+
+# How often the metrics file is rewritten while the script runs, in seconds
+METRICS_INTERVAL_ENV = "BRAINFRAME_METRICS_INTERVAL"
+DEFAULT_METRICS_INTERVAL = 15.0
+
+
+class Counter:
+    """A value that only goes up, like the number of images processed"""
+
+    __slots__ = ["name", "help_text", "value", "_lock"]
+
+    def __init__(self, name: str, help_text: str = ""):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """Counts observations, like latencies, in buckets, so percentiles can be
+    estimated without keeping every observation
+    """
+
+    __slots__ = ["name", "help_text", "buckets", "counts", "sum", "count",
+                 "_lock"]
+
+    def __init__(self, name: str, help_text: str = "",
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        :param name: The name of the metric
+        :param help_text: What the metric measures
+        :param buckets: The upper bound of each bucket, in increasing order.
+            Observations above the last bound are only counted in the total.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            if index < len(self.counts):
+                self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> "_Timer":
+        """
+        :return: A context manager that observes how long its body took
+        """
+        return _Timer(self)
+
+    def cumulative_counts(self) -> Dict[str, int]:
+        """
+        :return: The number of observations <= each bound, keyed like
+            Prometheus' "le" label
+        """
+        counts = {}
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            counts[repr(float(bound))] = total
+        counts["+Inf"] = self.count
+        return counts
+
+
+class _Timer:
+    __slots__ = ["_histogram", "_start"]
+
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+        self._start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class _NullTimer:
+    """Used in place of a _Timer while metrics are disabled, so timing a
+    block only costs a method call
+    """
+
+    __slots__ = []
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Registry:
+    """Holds every metric by name. Metrics are only recorded while the
+    registry is enabled, so instrumented code costs next to nothing when
+    nobody is measuring it.
+
+    Capsules can't import this module, since they're packaged on their own.
+    Instead, their Backend has a metrics attribute that a harness like
+    benchmark_capsule.py sets to a registry, and they only call observe and
+    inc on it.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        return self._get_or_create(name, lambda: Counter(name, help_text))
+
+    def histogram(self, name: str, help_text: str = "",
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(name,
+                                   lambda: Histogram(name, help_text, buckets))
+
+    def inc(self, name: str, amount: float = 1) -> None:
+        if self.enabled:
+            self.counter(name).inc(amount)
+
+    def observe(self, name: str, value: float) -> None:
+        if self.enabled:
+            self.histogram(name).observe(value)
+
+    def timer(self, name: str):
+        """
+        :param name: The histogram to observe the time in
+        :return: A context manager that times its body, if enabled
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return self.histogram(name).time()
+
+    def timed_iter(self, iterable: Iterable[T], name: str) -> Iterator[T]:
+        """Yields the items of an iterable, observing how long each one took
+        to arrive. This separates waiting on a stream, like
+        get_zone_status_stream, from the work done on each item.
+
+        :param iterable: The items to yield
+        :param name: The histogram to observe the wait in
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - start)
+            yield item
+
+    def _get_or_create(self, name: str, create):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(name, create())
+        return metric
+
+    def _sorted_metrics(self) -> list:
+        # Metrics can be created by other threads while they're written out
+        with self._lock:
+            return sorted(self._metrics.items())
+
+    def to_prometheus(self) -> str:
+        """
+        :return: Every metric in the Prometheus text format, for example to
+            be picked up by node_exporter's textfile collector
+        """
+        lines = []
+        for name, metric in self._sorted_metrics():
+            if metric.help_text:
+                lines.append(f"# HELP {name} {metric.help_text}")
+            if isinstance(metric, Counter):
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {metric.value}")
+                continue
+
+            lines.append(f"# TYPE {name} histogram")
+            for bound, count in metric.cumulative_counts().items():
+                lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f"{name}_sum {metric.sum}")
+            lines.append(f"{name}_count {metric.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        metrics = {}
+        for name, metric in self._sorted_metrics():
+            if isinstance(metric, Counter):
+                metrics[name] = {"type": "counter", "value": metric.value}
+            else:
+                metrics[name] = {
+                    "type": "histogram",
+                    "count": metric.count,
+                    "sum": metric.sum,
+                    "buckets": metric.cumulative_counts(),
+                }
+        return metrics
+
+    def write(self, path: Path) -> None:
+        """Writes every metric to a file, as JSON if the file ends with
+        .json and in the Prometheus text format otherwise
+        """
+        path = Path(path)
+        if path.suffix == ".json":
+            text = json.dumps(self.to_dict(), indent=2)
+        else:
+            text = self.to_prometheus()
+
+        # Write to a temporary file first, so a collector never reads a half
+        # written file
+        temp_path = path.with_name(path.name + ".tmp")
+        temp_path.write_text(text)
+        temp_path.replace(path)
+
+
+REGISTRY = Registry()
+"""The registry used by the scripts' instrumentation"""
+
+
+class PeriodicWriter:
+    """Writes a registry to a file every few seconds from a background
+    thread. Scripts like social_distancing.py run until they're stopped, so
+    metrics written only at exit would never reach a collector while they
+    run.
+    """
+
+    def __init__(self, registry: Registry, path: Path,
+                 interval: float = DEFAULT_METRICS_INTERVAL):
+        """
+        :param registry: The metrics to write
+        :param path: The file to write them to, see Registry.write
+        :param interval: The time between writes, in seconds
+        """
+        self.registry = registry
+        self.path = Path(path)
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="PeriodicWriter",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops writing periodically, and writes the metrics one last time"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.registry.write(self.path)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.registry.write(self.path)
+
+
+class SamplingProfiler:
+    """Samples the call stack of every thread at a fixed interval, from a
+    background thread. The samples are written as folded stacks, which
+    flamegraph.pl and speedscope turn into flame graphs.
+
+    Sampling only pauses the program for as long as it takes to read the
+    stacks, so it can stay on under load, unlike cProfile.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        """
+        :param interval: The time between samples, in seconds
+        """
+        self.interval = interval
+        self.samples: StackCounter = StackCounter()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="SamplingProfiler",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} "
+                                 f"({Path(code.co_filename).name}:"
+                                 f"{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path: Path) -> None:
+        """Writes the samples as folded stacks, one "stack count" per line"""
+        with Path(path).open("w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+def configure_from_env(registry: Registry = REGISTRY) -> None:
+    """Turns on metrics and the sampling profiler if their environment
+    variables are set, and writes them out when the script exits. Nothing is
+    recorded otherwise.
+
+    For example, BRAINFRAME_METRICS=metrics.prom writes Prometheus metrics,
+    BRAINFRAME_METRICS=metrics.json writes JSON and
+    BRAINFRAME_PROFILE=profile.folded writes folded stacks. Metrics are also
+    rewritten every BRAINFRAME_METRICS_INTERVAL seconds while the script
+    runs, 15 by default.
+    """
+    metrics_path = os.environ.get(METRICS_ENV)
+    if metrics_path:
+        registry.enabled = True
+        interval = float(os.environ.get(METRICS_INTERVAL_ENV,
+                                        DEFAULT_METRICS_INTERVAL))
+        writer = PeriodicWriter(registry, Path(metrics_path), interval)
+        writer.start()
+        atexit.register(writer.stop)
+
+    profile_path = os.environ.get(PROFILE_ENV)
+    if profile_path:
+        profiler = SamplingProfiler()
+        profiler.start()
+
+        # Helper function to stop the profiler before writing its samples
+        def _write_profile():
+            profiler.stop()
+            profiler.write(Path(profile_path))
+
+        atexit.register(_write_profile)
+
+    # A script killed with SIGTERM exits without running atexit functions,
+    # so it's turned into a normal exit, unless the script handles it itself
+    if (metrics_path or profile_path) \
+            and threading.current_thread() is threading.main_thread() \
+            and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+
+# Helper function to exit like on Ctrl+C when the script is terminated
+def _exit_on_sigterm(signum: int, frame) -> None:
+    raise SystemExit(128 + signum)
@@ -0,0 +1,123 @@
+# Import the dependencies
+import threading
+from collections import OrderedDict
+from typing import Hashable, Tuple
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Decides if a frame changed enough from the last processed frame of the
+    same camera to be worth running inference on. Frames are compared as
+    small grayscale thumbnails, which costs a tiny fraction of inference.
+
+    Frames are always compared against the last frame that was processed,
+    not the last frame seen, so slow changes add up until they're large
+    enough to be processed.
+    """
+
+    def __init__(self, threshold: float = 0.01,
+                 pixel_threshold: int = 20,
+                 thumbnail_size: Tuple[int, int] = (64, 36),
+                 max_cameras: int = 10000):
+        """
+        :param threshold: The fraction of thumbnail pixels that must have
+            changed for the frame to be processed, from 0 to 1
+        :param pixel_threshold: How much a thumbnail pixel's brightness must
+            change, from 0 to 255, to count as changed. This ignores sensor
+            noise and compression artifacts.
+        :param thumbnail_size: The (width, height) frames are shrunk to before
+            being compared
+        :param max_cameras: The max number of cameras to remember the last
+            processed frame of. The least recently seen are forgotten first.
+        """
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.thumbnail_size = thumbnail_size
+        self.max_cameras = max_cameras
+
+        # The thumbnail of the last processed frame of each camera
+        self._references: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.frames_seen = 0
+        self.frames_skipped = 0
+
+    def thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        """
+        :param frame: A BGR or grayscale frame
+        :return: A small grayscale version of the frame
+        """
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # Area interpolation averages out noise while shrinking
+        return cv2.resize(frame, self.thumbnail_size,
+                          interpolation=cv2.INTER_AREA)
+
+    def should_process(self, camera: Hashable, frame: np.ndarray) -> bool:
+        """Checks a frame, and remembers it as the camera's last processed
+        frame if it should be processed. Frames of a camera must be checked in
+        order.
+
+        :param camera: Identifies the camera the frame is from, like the
+            directory of an image
+        :param frame: The frame to check
+        :return: True if the frame changed enough to be processed
+        """
+        thumbnail = self.thumbnail(frame)
+
+        with self._lock:
+            self.frames_seen += 1
+            reference = self._references.get(camera)
+            if reference is not None and reference.shape == thumbnail.shape:
+                self._references.move_to_end(camera)
+                difference = cv2.absdiff(thumbnail, reference)
+                changed = np.count_nonzero(
+                    difference > self.pixel_threshold) / difference.size
+                if changed < self.threshold:
+                    self.frames_skipped += 1
+                    return False
+
+            self._remember(camera, thumbnail)
+            return True
+
+    def process_anyway(self, camera: Hashable, frame: np.ndarray) -> None:
+        """Remembers a frame that should_process skipped as the camera's last
+        processed frame, for when it ends up being processed anyway. It's no
+        longer counted as skipped.
+
+        :param camera: The camera the frame is from
+        :param frame: The frame that was skipped
+        """
+        thumbnail = self.thumbnail(frame)
+
+        with self._lock:
+            self.frames_skipped -= 1
+            self._remember(camera, thumbnail)
+
+    def _remember(self, camera: Hashable, thumbnail: np.ndarray) -> None:
+        """Sets the camera's last processed thumbnail. The lock must be held.
+        """
+        self._references[camera] = thumbnail
+        self._references.move_to_end(camera)
+        while len(self._references) > self.max_cameras:
+            self._references.popitem(last=False)
+
+    def forget(self, camera: Hashable) -> None:
+        """Forgets a camera's last processed frame, so its next frame is
+        always processed
+        """
+        with self._lock:
+            self._references.pop(camera, None)
+
+    @property
+    def skip_rate(self) -> float:
+        if self.frames_seen == 0:
+            return 0.0
+        return self.frames_skipped / self.frames_seen
+
+    def summary(self) -> str:
+        return (f"Skipped {self.frames_skipped} of {self.frames_seen} frames "
+                f"({self.skip_rate * 100:.1f}%) that barely changed, saving "
+                f"{self.frames_skipped} inference calls")
@@ -0,0 +1,157 @@
+# Import the dependencies
+import logging
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from distancing import ENGINES, Violations
+
+# Called with the stream ID, the coords of the people in the stream and the
+# violations that were found
+RESULT_CALLBACK_TYPE = Callable[[int, np.ndarray, Violations], None]
+
+
+# Runs in the worker processes. Only arrays are sent to and from the workers,
+# which are much cheaper to pickle than Detection objects.
+def _find_shard_violations(shard: List[Tuple[int, np.ndarray]],
+                           min_distance: float,
+                           engine: str) -> List[Tuple[int, Violations]]:
+    find_violations = ENGINES[engine]
+    return [(stream_id, find_violations(coords, min_distance))
+            for stream_id, coords in shard]
+
+
+class ParallelDistancing:
+    """Finds social distancing violations for many streams at once, by
+    splitting the streams of each zone status packet across a pool of worker
+    processes.
+
+    If the workers fall behind, packets don't queue up. Instead, each stream
+    keeps only its newest coords until the workers are free, and older coords
+    of the stream are dropped, so results stay close to real time.
+    """
+
+    def __init__(self, min_distance: float,
+                 on_result: RESULT_CALLBACK_TYPE,
+                 engine: str = "grid",
+                 num_workers: int = None,
+                 max_packets_in_flight: int = 2):
+        """
+        :param min_distance: The minimum distance between two people
+        :param on_result: Called with the results of each stream. It's called
+            from a background thread.
+        :param engine: The name of the engine used to find violations, one of
+            distancing.ENGINES
+        :param num_workers: The number of worker processes, defaults to the
+            number of CPUs
+        :param max_packets_in_flight: While this many packets are being
+            processed, the streams of new packets wait for the workers
+        """
+        self.min_distance = min_distance
+        self.on_result = on_result
+        self.engine = engine
+        self.max_packets_in_flight = max_packets_in_flight
+
+        self._num_workers = num_workers or os.cpu_count() or 1
+        self._pool = ProcessPoolExecutor(self._num_workers)
+        self._lock = threading.Lock()
+        self._packets_in_flight = 0
+        self._closed = False
+
+        # The newest coords of each stream that's waiting for the workers
+        self._pending: Dict[int, np.ndarray] = {}
+
+        self.processed = 0
+        self.dropped = 0
+        """Coords of a stream that were replaced by newer coords of the same
+        stream before the workers got to them
+        """
+
+    def submit(self, stream_coords: Dict[int, np.ndarray]) -> bool:
+        """Starts processing the streams of one packet. This doesn't wait for
+        the results.
+
+        :param stream_coords: {stream_id: coords}, as returned by
+            distancing.packet_to_coords
+        :return: False if the workers are busy, so the streams wait until
+            they're free, unless newer coords of the stream arrive first
+        """
+        streams = {stream_id: coords
+                   for stream_id, coords in stream_coords.items()
+                   if len(coords) > 0}
+        if len(streams) == 0:
+            return True
+
+        with self._lock:
+            if self._packets_in_flight >= self.max_packets_in_flight:
+                self.dropped += len(streams.keys() & self._pending.keys())
+                self._pending.update(streams)
+                return False
+
+            # Waiting streams are sent along, unless this packet has newer
+            # coords for them
+            self._packets_in_flight += 1
+            streams = {**self._pending, **streams}
+            self._pending = {}
+
+        self._start(streams)
+        return True
+
+    def _start(self, streams: Dict[int, np.ndarray]) -> None:
+        """Sends streams to the workers, as one packet"""
+        stream_items = list(streams.items())
+
+        # Split the streams into one shard per worker
+        num_shards = min(self._num_workers, len(stream_items))
+        shards = [stream_items[i::num_shards] for i in range(num_shards)]
+
+        # Shards are submitted under the lock, so close() can't shut the pool
+        # down between checking if it's closed and submitting them
+        with self._lock:
+            if self._closed:
+                self._packets_in_flight -= 1
+                return
+            futures = [self._pool.submit(_find_shard_violations, shard,
+                                         self.min_distance, self.engine)
+                       for shard in shards]
+
+        # Count the packet as done once its last shard is done
+        remaining = [len(futures)]
+
+        def _on_shard_done(future: Future) -> None:
+            next_streams = None
+            try:
+                for stream_id, violations in future.result():
+                    self.on_result(stream_id, streams[stream_id], violations)
+            except Exception:
+                logging.exception("Could not process a shard of streams")
+            finally:
+                with self._lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        self.processed += 1
+                        # The streams that waited for the workers take the
+                        # packet's place right away
+                        if len(self._pending) > 0:
+                            next_streams = self._pending
+                            self._pending = {}
+                        else:
+                            self._packets_in_flight -= 1
+
+            if next_streams is not None:
+                self._start(next_streams)
+
+        for future in futures:
+            future.add_done_callback(_on_shard_done)
+
+    def close(self) -> None:
+        """Waits for the packets in flight, and stops the worker processes.
+        Streams still waiting for the workers are dropped.
+        """
+        with self._lock:
+            self._closed = True
+            self._pending = {}
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,271 @@
+# Import the dependencies
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from brainframe.api import bf_codecs
+
+
+# Helper function to compute the perceptual hash of an image
+def perceptual_hash(image: np.ndarray) -> int:
+    """Computes a 64 bit pHash. Images that look alike get hashes that differ
+    in only a few bits, even after resizing, recompression or small changes
+    in brightness.
+
+    :param image: A BGR or grayscale image
+    :return: The hash, as an integer
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA)
+
+    # Keep the lowest frequencies of the image, which describe its overall
+    # structure rather than its details
+    frequencies = cv2.dct(np.float32(small))[:8, :8]
+    # The first frequency is the average brightness, which would throw off
+    # the median
+    median = np.median(frequencies.flatten()[1:])
+    bits = (frequencies > median).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+# The Lab colors of two cells of a color signature must be at least this far
+# apart for the cell to count as a different color. Small changes in exposure
+# or white balance stay below it.
+COLOR_CELL_THRESHOLD = 20.0
+
+
+# Helper function to describe the colors of an image, which the perceptual
+# hash ignores
+def color_signature(image: np.ndarray) -> np.ndarray:
+    """Shrinks the image to 8x8 cells, in the Lab color space. Two images of
+    the same framing with a different colored car get about the same
+    perceptual hash, but the cells of the car get different colors.
+
+    :param image: A BGR image
+    :return: Shape (64, 3), the Lab color of each cell
+    """
+    small = cv2.resize(image, (8, 8), interpolation=cv2.INTER_AREA)
+    lab = cv2.cvtColor(small, cv2.COLOR_BGR2LAB)
+    return lab.reshape((-1, 3)).astype(np.float32)
+
+
+def color_distance(signature1: np.ndarray, signature2: np.ndarray) -> float:
+    """
+    :return: The fraction of cells of two color signatures that have a
+        different color, from 0 to 1
+    """
+    differences = np.linalg.norm(signature1 - signature2, axis=-1)
+    return float(np.mean(differences > COLOR_CELL_THRESHOLD))
+
+
+class ImageSignature(NamedTuple):
+    """What near duplicate images are matched by"""
+
+    image_hash: int
+    """The perceptual hash of the image"""
+
+    colors: np.ndarray
+    """The color signature of the image"""
+
+
+# Helper function to read the signature of an image file without decoding it
+# at full size
+def read_image_signature(image_path: Path) -> ImageSignature:
+    """
+    :param image_path: The image file to read
+    :return: The perceptual hash and color signature of the image
+    """
+    # JPEGs can be decoded at a quarter of their size for a fraction of the
+    # cost, which is plenty for a 32x32 hash
+    image = cv2.imread(str(image_path), cv2.IMREAD_REDUCED_COLOR_4)
+    if image is None:
+        raise IOError(f"Could not read the image {image_path}")
+    return ImageSignature(image_hash=perceptual_hash(image),
+                          colors=color_signature(image))
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    return bin(hash1 ^ hash2).count("1")
+
+
+class BKTree:
+    """A tree of hashes that finds every hash within a Hamming distance of
+    another hash, without comparing it to every hash in the tree.
+
+    Each node's children are keyed by their distance to the node. By the
+    triangle inequality, only the children whose key is within the search
+    radius of the query's distance to the node can hold a match.
+    """
+
+    def __init__(self):
+        # Nodes are [hash, value, {distance: child node}]
+        self._root: Optional[list] = None
+        self._size = 0
+
+    def add(self, image_hash: int, value: Any) -> None:
+        self._size += 1
+        if self._root is None:
+            self._root = [image_hash, value, {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(image_hash, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [image_hash, value, {}]
+                return
+            node = child
+
+    def search(self, image_hash: int, radius: int) \
+            -> List[Tuple[int, int, Any]]:
+        """
+        :param image_hash: The hash to search for
+        :param radius: The max Hamming distance of a match
+        :return: Every match as (distance, hash, value), closest first
+        """
+        matches = []
+        if self._root is None:
+            return matches
+
+        stack = [self._root]
+        while stack:
+            node_hash, value, children = stack.pop()
+            distance = hamming_distance(image_hash, node_hash)
+            if distance <= radius:
+                matches.append((distance, node_hash, value))
+
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class IndexEntry:
+    """An image in the index. Its detections are None until it's processed."""
+
+    __slots__ = ["image_path", "signature", "detections"]
+
+    def __init__(self, image_path: Path, signature: ImageSignature,
+                 detections: Optional[List[bf_codecs.Detection]] = None):
+        self.image_path = image_path
+        self.signature = signature
+        self.detections = detections
+
+
+class IndexMatch(NamedTuple):
+    entry: IndexEntry
+    """The closest image in the index"""
+
+    distance: int
+    """The Hamming distance between the two hashes"""
+
+    color_distance: float
+    """The distance between the two color signatures, see color_distance"""
+
+
+class PerceptualHashIndex:
+    """Remembers the perceptual hash, color signature and detections of
+    processed images, so near duplicates of them can reuse their detections.
+    Processed images are stored in an SQLite file and loaded into a BK-tree
+    when the index is opened.
+
+    Detections depend on the capsules and options the images were processed
+    with, so they're stored along with them, and only detections of the same
+    configuration are reused.
+    """
+
+    def __init__(self, db_path: Path, config: Any = None):
+        """
+        :param db_path: The SQLite file to store the index in
+        :param config: Anything JSON serializable that describes how images
+            are processed, like the capsule names and options
+        """
+        self.config_key = json.dumps(config, sort_keys=True)
+        self._connection = sqlite3.connect(str(db_path))
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS image_signatures "
+                "(image_path TEXT NOT NULL, config TEXT NOT NULL, "
+                "image_hash TEXT NOT NULL, colors BLOB NOT NULL, "
+                "detections TEXT NOT NULL, "
+                "PRIMARY KEY (image_path, config))")
+
+        self._tree = BKTree()
+        rows = self._connection.execute(
+            "SELECT image_path, image_hash, colors, detections "
+            "FROM image_signatures WHERE config = ?", (self.config_key,))
+        for image_path, image_hash, colors, detections in rows:
+            signature = ImageSignature(
+                image_hash=int(image_hash, 16),
+                colors=np.frombuffer(colors, dtype=np.float32).reshape(
+                    (-1, 3)))
+            entry = IndexEntry(
+                image_path=Path(image_path),
+                signature=signature,
+                detections=[bf_codecs.Detection.from_dict(d)
+                            for d in json.loads(detections)])
+            self._tree.add(signature.image_hash, entry)
+
+    def find(self, signature: ImageSignature, radius: int,
+             max_color_distance: float) -> Optional[IndexMatch]:
+        """
+        :param signature: The signature of the image to look up
+        :param radius: The max Hamming distance of a near duplicate's hash
+        :param max_color_distance: The max color distance of a near
+            duplicate. Images with about the same structure but different
+            colors, like different colored cars shot from the same spot, are
+            not near duplicates.
+        :return: The closest near duplicate, or None if there isn't one
+        """
+        for distance, _, entry in self._tree.search(signature.image_hash,
+                                                    radius):
+            colors_apart = color_distance(signature.colors,
+                                          entry.signature.colors)
+            if colors_apart <= max_color_distance:
+                return IndexMatch(entry=entry, distance=distance,
+                                  color_distance=colors_apart)
+        return None
+
+    def add(self, image_path: Path, signature: ImageSignature) -> IndexEntry:
+        """Adds an image that's about to be processed, so later near
+        duplicates can be matched to it right away. It's only saved once its
+        detections are set.
+
+        :param image_path: The image
+        :param signature: The signature of the image
+        :return: The new entry
+        """
+        entry = IndexEntry(image_path=image_path, signature=signature)
+        self._tree.add(signature.image_hash, entry)
+        return entry
+
+    def set_detections(self, entry: IndexEntry,
+                       detections: List[bf_codecs.Detection]) -> None:
+        entry.detections = detections
+        data = json.dumps([detection.to_dict() for detection in detections])
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO image_signatures "
+                "(image_path, config, image_hash, colors, detections) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (str(entry.image_path), self.config_key,
+                 f"{entry.signature.image_hash:016x}",
+                 entry.signature.colors.astype(np.float32).tobytes(), data))
+
+    def __len__(self) -> int:
+        return len(self._tree)
+
+    def close(self) -> None:
+        self._connection.close()
+
@@ -0,0 +1,50 @@
+# Import the dependencies
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from brainframe.api import BrainFrameAPI
+
+
+class PooledSession:
+    """Sends every request of a BrainFrameAPI through one requests.Session
+    with a connection pool. By default, the API opens a new connection for
+    every request, which adds a TCP (and TLS) handshake to each call and
+    quickly runs out of sockets when many requests are sent at once.
+    """
+
+    def __init__(self, api: BrainFrameAPI, pool_size: int = 16):
+        """
+        :param api: The API to send requests for. Its requests are sent
+            through this session from now on.
+        :param pool_size: The max number of connections kept open to the
+            server. This should be at least the number of threads sending
+            requests at once.
+        """
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+
+        # BaseStub._send_request is a static method, so replacing it on the
+        # instance is enough for every stub to use the pool
+        api._send_request = self._send_request
+
+    def _send_request(self, request: requests.Request, timeout: float) \
+            -> requests.Response:
+        with self._lock:
+            self.requests_sent += 1
+        prepared = request.prepare()
+        # GET responses are streamed like the API does by default, so that
+        # get_zone_status_stream still works. Other responses are read right
+        # away, so their connection goes back to the pool even when the
+        # caller never reads the body, like for deletes.
+        stream = request.method == "GET"
+        return self.session.send(prepared, stream=stream, timeout=timeout)
+
+    def close(self) -> None:
+        self.session.close()
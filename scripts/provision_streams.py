@@ -0,0 +1,373 @@
+# Import the dependencies
+import json
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from brainframe.api import BrainFrameAPI, bf_codecs
+
+from pooled_session import PooledSession
+
+
+class StreamSpec(NamedTuple):
+    """Everything the manifest says about one stream"""
+
+    config: bf_codecs.StreamConfiguration
+    """The stream configuration, without an ID"""
+
+    zones: List[bf_codecs.Zone]
+    """The zones of the stream, with their alarms. The stream ID is filled in
+    once the stream exists.
+    """
+
+    option_vals: Dict[str, Dict[str, object]]
+    """The capsule option values of the stream, by capsule name"""
+
+    analyze: bool
+    """If the stream should be analyzed"""
+
+
+class StreamReport(NamedTuple):
+    """What was done to provision one stream"""
+
+    name: str
+    """The name of the stream"""
+
+    changes: List[str]
+    """A description of every change, empty if the stream was up to date"""
+
+    elapsed: float
+    """How long it took to check and apply the changes, in seconds"""
+
+
+# Helper function to turn an alarm from the manifest into a ZoneAlarm. Fields
+# that are usually left alone can be left out of the manifest.
+def parse_alarm(alarm: dict) -> bf_codecs.ZoneAlarm:
+    """
+    :param alarm: An alarm in the same format as ZoneAlarm.to_dict(), where
+        IDs and optional fields may be missing
+    :return: The alarm
+    """
+    condition_defaults = {"with_attribute": None,
+                          "window_duration": 5.0,
+                          "window_threshold": 0.5,
+                          "intersection_point": "bottom",
+                          "id": None}
+    alarm = dict({"rate_conditions": [],
+                  "count_conditions": [],
+                  "use_active_time": False,
+                  "active_start_time": "00:00:00",
+                  "active_end_time": "23:59:59",
+                  "id": None,
+                  "zone_id": None,
+                  "stream_id": None},
+                 **alarm)
+    alarm["count_conditions"] = [dict(condition_defaults, **condition)
+                                 for condition in alarm["count_conditions"]]
+    alarm["rate_conditions"] = [dict(condition_defaults, **condition)
+                                for condition in alarm["rate_conditions"]]
+    return bf_codecs.ZoneAlarm.from_dict(alarm)
+
+
+def load_manifest(manifest_path: Path) -> List[StreamSpec]:
+    """Reads a manifest of streams to provision. It can be JSON, or YAML if
+    PyYAML is installed. For example:
+
+        streams:
+          - name: Entrance
+            connection_type: ip_camera
+            connection_options:
+              url: rtsp://192.168.1.20/stream
+            capsule_option_vals:
+              detector_people_and_vehicles_fast:
+                threshold: 0.9
+            zones:
+              - name: Door
+                coords: [[0, 0], [500, 0], [500, 500], [0, 500]]
+                alarms:
+                  - name: Crowded door
+                    count_conditions:
+                      - test: ">"
+                        check_value: 5
+                        with_class_name: person
+
+    :param manifest_path: The manifest file
+    :return: A spec for every stream in the manifest
+    """
+    text = Path(manifest_path).read_text()
+    if Path(manifest_path).suffix in [".yaml", ".yml"]:
+        # PyYAML is only needed for YAML manifests
+        import yaml
+        manifest = yaml.safe_load(text)
+    else:
+        manifest = json.loads(text)
+
+    specs = []
+    names = set()
+    for stream in manifest["streams"]:
+        if stream["name"] in names:
+            raise ValueError(f"The manifest has more than one stream named "
+                             f"{stream['name']}")
+        names.add(stream["name"])
+
+        config = bf_codecs.StreamConfiguration(
+            name=stream["name"],
+            connection_type=bf_codecs.StreamConfiguration.ConnType(
+                stream["connection_type"]),
+            connection_options=stream["connection_options"],
+            runtime_options=stream.get("runtime_options", {}),
+            metadata=stream.get("metadata", {}),
+            premises_id=stream.get("premises_id"),
+        )
+        zones = [bf_codecs.Zone(name=zone["name"],
+                                stream_id=None,
+                                coords=zone.get("coords"),
+                                alarms=[parse_alarm(alarm)
+                                        for alarm in zone.get("alarms", [])])
+                 for zone in stream.get("zones", [])]
+        specs.append(StreamSpec(
+            config=config,
+            zones=zones,
+            option_vals=stream.get("capsule_option_vals", {}),
+            analyze=stream.get("analyze", True)))
+
+    return specs
+
+
+# Helper function to remove the IDs the server fills in, so a configuration
+# from the server can be compared with one from the manifest
+def _without_ids(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _without_ids(item) for key, item in value.items()
+                if key not in ["id", "zone_id", "stream_id"]}
+    if isinstance(value, list):
+        return [_without_ids(item) for item in value]
+    return value
+
+
+def _comparable_alarms(zone: bf_codecs.Zone) -> List[dict]:
+    alarms = [_without_ids(alarm.to_dict()) for alarm in zone.alarms]
+    return sorted(alarms, key=lambda alarm: json.dumps(alarm, sort_keys=True))
+
+
+def _connection_changed(existing: bf_codecs.StreamConfiguration,
+                        wanted: bf_codecs.StreamConfiguration) -> bool:
+    return (existing.connection_type != wanted.connection_type
+            or existing.connection_options != wanted.connection_options
+            or existing.premises_id != wanted.premises_id
+            or existing.metadata != wanted.metadata)
+
+
+def provision_stream(api: BrainFrameAPI, spec: StreamSpec,
+                     existing: Optional[bf_codecs.StreamConfiguration],
+                     dry_run: bool = False,
+                     prune: bool = False) -> StreamReport:
+    """Makes one stream on the server match its spec. Only what differs from
+    the spec is changed.
+
+    :param api: The API to provision the stream with
+    :param spec: What the stream should look like
+    :param existing: The stream on the server with the same name, if any
+    :param dry_run: If True, the changes are only reported, not applied
+    :param prune: If True, zones that aren't in the spec are deleted
+    :return: What was changed
+    """
+    start = time.perf_counter()
+    changes: List[str] = []
+
+    # Helper function that records a change, and applies it unless this is a
+    # dry run
+    def _change(description: str, apply: Callable[[], Any]) -> None:
+        changes.append(description)
+        if not dry_run:
+            apply()
+
+    # The connection of a stream can't be changed, so the stream is replaced
+    if existing is not None and _connection_changed(existing, spec.config):
+        _change("replace stream, the connection changed",
+                lambda: api.delete_stream_configuration(existing.id))
+        existing = None
+
+    existing_zones: Dict[str, bf_codecs.Zone] = {}
+    analyzing = False
+    if existing is None:
+        stream_id = None
+        changes.append("create stream")
+        if not dry_run:
+            stream_id = api.set_stream_configuration(spec.config).id
+    else:
+        stream_id = existing.id
+        if existing.runtime_options != spec.config.runtime_options:
+            _change("set runtime options",
+                    lambda: api.set_runtime_option_vals(
+                        stream_id, spec.config.runtime_options))
+        existing_zones = {zone.name: zone
+                          for zone in api.get_zones(stream_id=stream_id)}
+        analyzing = api.check_analyzing(stream_id)
+
+    for zone in spec.zones:
+        existing_zone = existing_zones.get(zone.name)
+        zone = bf_codecs.Zone(name=zone.name, stream_id=stream_id,
+                              coords=zone.coords, alarms=zone.alarms)
+
+        # Every stream comes with a full frame zone. It can't be replaced, so
+        # only its alarms are changed.
+        if zone.name == bf_codecs.Zone.FULL_FRAME_ZONE_NAME:
+            if existing_zone is not None and _comparable_alarms(
+                    existing_zone) == _comparable_alarms(zone):
+                continue
+
+            def _replace_alarms(zone=zone):
+                full_frame_zone = existing_zone or next(
+                    z for z in api.get_zones(stream_id=stream_id)
+                    if z.name == zone.name)
+                for alarm in full_frame_zone.alarms:
+                    api.delete_zone_alarm(alarm.id)
+                for alarm in zone.alarms:
+                    api.set_zone_alarm(bf_codecs.ZoneAlarm.from_dict(
+                        dict(alarm.to_dict(), zone_id=full_frame_zone.id,
+                             stream_id=stream_id)))
+
+            _change(f"set alarms of zone {zone.name}", _replace_alarms)
+            continue
+
+        if existing_zone is None:
+            _change(f"create zone {zone.name}",
+                    lambda zone=zone: api.set_zone(zone))
+        elif existing_zone.coords != zone.coords \
+                or _comparable_alarms(existing_zone) \
+                != _comparable_alarms(zone):
+            # Replacing the zone also replaces all of its alarms at once
+            def _replace_zone(zone=zone, existing_zone=existing_zone):
+                api.delete_zone(existing_zone.id)
+                api.set_zone(zone)
+
+            _change(f"replace zone {zone.name}", _replace_zone)
+
+    if prune:
+        wanted_names = {zone.name for zone in spec.zones}
+        for name, existing_zone in existing_zones.items():
+            if name not in wanted_names \
+                    and name != bf_codecs.Zone.FULL_FRAME_ZONE_NAME:
+                _change(f"delete zone {name}",
+                        lambda zone_id=existing_zone.id:
+                        api.delete_zone(zone_id))
+
+    for capsule_name, option_vals in spec.option_vals.items():
+        if stream_id is not None:
+            current = api.get_capsule_option_vals(capsule_name=capsule_name,
+                                                  stream_id=stream_id)
+            # Only the options in the manifest are compared, the others are
+            # left as they are
+            if all(current.get(name) == value
+                   for name, value in option_vals.items()):
+                continue
+
+        _change(f"set {capsule_name} options",
+                lambda capsule_name=capsule_name, option_vals=option_vals:
+                api.patch_capsule_option_vals(capsule_name=capsule_name,
+                                              stream_id=stream_id,
+                                              option_vals=option_vals))
+
+    if spec.analyze and not analyzing:
+        _change("start analyzing", lambda: api.start_analyzing(stream_id))
+    elif not spec.analyze and analyzing:
+        _change("stop analyzing", lambda: api.stop_analyzing(stream_id))
+
+    return StreamReport(name=spec.config.name,
+                        changes=changes,
+                        elapsed=time.perf_counter() - start)
+
+
+def provision(api: BrainFrameAPI, specs: List[StreamSpec],
+              num_workers: int = 16,
+              dry_run: bool = False,
+              prune: bool = False) -> List[StreamReport]:
+    """Makes the streams on the server match the specs, provisioning several
+    streams at once.
+
+    :param api: The API to provision the streams with. Use a PooledSession
+        with it, so the workers reuse connections.
+    :param specs: What the streams should look like
+    :param num_workers: The max number of streams provisioned at once
+    :param dry_run: If True, the changes are only reported, not applied
+    :param prune: If True, streams and zones that aren't in the specs are
+        deleted
+    :return: What was changed, one report per stream
+    """
+    # Streams are matched to the specs by name
+    existing_streams = {config.name: config
+                        for config in api.get_stream_configurations()}
+
+    with ThreadPoolExecutor(num_workers) as pool:
+        reports = list(pool.map(
+            lambda spec: provision_stream(
+                api, spec, existing_streams.get(spec.config.name),
+                dry_run=dry_run, prune=prune),
+            specs))
+
+    if prune:
+        wanted_names = {spec.config.name for spec in specs}
+        for name, config in existing_streams.items():
+            if name in wanted_names:
+                continue
+            if not dry_run:
+                api.delete_stream_configuration(config.id)
+            reports.append(StreamReport(name=name,
+                                        changes=["delete stream"],
+                                        elapsed=0.0))
+
+    return reports
+
+
+def main():
+    parser = ArgumentParser(
+        description="Create or update streams, zones, alarms and capsule "
+                    "options from a manifest")
+    parser.add_argument("manifest", type=Path,
+                        help="A JSON or YAML manifest of streams")
+    parser.add_argument("--server", default="http://localhost",
+                        help="The URL of the BrainFrame server")
+    parser.add_argument("--workers", type=int, default=16,
+                        help="The max number of streams provisioned at once")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only print the changes, without applying them")
+    parser.add_argument("--prune", action="store_true",
+                        help="Delete streams and zones that aren't in the "
+                             "manifest")
+    args = parser.parse_args()
+
+    specs = load_manifest(args.manifest)
+
+    # To try this out without a BrainFrame server, run stub_server.py and
+    # point --server at it
+    api = BrainFrameAPI(args.server)
+    session = PooledSession(api, pool_size=args.workers)
+
+    try:
+        start = time.perf_counter()
+        reports = provision(api, specs,
+                            num_workers=args.workers,
+                            dry_run=args.dry_run,
+                            prune=args.prune)
+        elapsed = time.perf_counter() - start
+    finally:
+        session.close()
+
+    for report in reports:
+        if len(report.changes) > 0:
+            print(f"{report.name}: {', '.join(report.changes)}")
+
+    changed = [report for report in reports if len(report.changes) > 0]
+    slowest = max(reports, key=lambda report: report.elapsed, default=None)
+    action = "Would change" if args.dry_run else "Changed"
+    print(f"{action} {len(changed)} of {len(reports)} streams in "
+          f"{elapsed:.2f} s with {session.requests_sent} requests")
+    if slowest is not None:
+        print(f"Slowest stream: {slowest.name}, {slowest.elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,30 @@ from pathlib import Path
 import itchat as wechat
 from brainframe.api import BrainFrameAPI, bf_codecs
 
+from alert_dispatch import AlertDispatcher, WeChatSink
+from metadata_cache import MetadataCache
+from metrics import REGISTRY, configure_from_env
+from storage_upload import upload_file
+
+# Set BRAINFRAME_METRICS or BRAINFRAME_PROFILE to measure where the time
+# goes
+configure_from_env()
+
 # Initialize the API and connect to the server
 api = BrainFrameAPI("http://localhost")
 
+# Cache configurations read from the server. Alarms rarely change, so they
+# don't need to be requested again for every alert.
+metadata = MetadataCache(api)
+
 # Login to your WeChat account and send a message to the filehelper
 wechat.auto_login()
 wechat.send_msg(f"Notifications from BrainFrame have been enabled",
                 toUserName="filehelper")
 
 # Upload the local file to the BrainFrame server's database and get its storage
-# ID
-storage_id = api.new_storage(
-    data=Path("../videos/shopping_cashier_gone.mp4").read_bytes(),
-    mime_type="application/octet-stream"
-)
+# ID. The file is streamed in chunks instead of being read into memory.
+storage_id = upload_file(api, Path("../videos/shopping_cashier_gone.mp4"))
 
 # Create a StreamConfiguration with the storage ID
 new_stream_config = bf_codecs.StreamConfiguration(
@@ -33,7 +43,7 @@ new_stream_config = bf_codecs.StreamConfiguration(
 )
 
 # Send the StreamConfiguration to the server to have it connect
-new_stream_config = api.set_stream_configuration(new_stream_config)
+new_stream_config = metadata.set_stream_configuration(new_stream_config)
 
 # Tell the server to start analysis on the new stream
 api.start_analyzing(new_stream_config.id)
@@ -71,37 +81,49 @@ cashier_zone = bf_codecs.Zone(
 )
 
 # Send the Zone to BrainFrame
-api.set_zone(cashier_zone)
+metadata.set_zone(cashier_zone)
+
+# Load every stream, zone and alarm in a few requests, instead of looking them
+# up one at a time when alerts come in
+metadata.prefetch()
 
 # Get the one single zone status and print out, mostly likely you will get
 # nothing here because the stream just started, no results are coming out yet.
 zone_status = api.get_latest_zone_statuses()
 print("Zone Status: ", zone_status)
 
-# Get the zone status iterator
-zone_status_iterator = api.get_zone_status_stream()
-
-keep_looping = True
-
-# Iterate through the zone status packets
-for zone_status_packet in zone_status_iterator:
-    for stream_id, zone_statuses in zone_status_packet.items():
-        for zone_name, zone_status in zone_statuses.items():
-            for alert in zone_status.alerts:
-                # Check if the alert has ended
-                if alert.end_time is None:
-                    continue
-
-                total_time = alert.end_time - alert.start_time
-                # Check if the alert lasted for more than 5 seconds
-                if total_time > 5:
-                    alarm = api.get_zone_alarm(alert.alarm_id)
-                    wechat.send_msg(
-                        f"BrainFrame Alert: {alarm.name} \n"
-                        f"Duration {total_time}", toUserName="filehelper")
-
-                    # Log out your WeChat account
-                    wechat.logout()
-
-                    # Stop here, for demo purposes
-                    exit()
+# Send notifications from background threads, so a slow WeChat message never
+# holds up reading the zone status stream. More sinks, like a WebhookSink or
+# a FileSink, can be added to the list.
+dispatcher = AlertDispatcher(
+    sinks=[WeChatSink(to_user_name="filehelper")],
+    get_alarm=metadata.get_zone_alarm,
+)
+
+# Get the zone status iterator. Time spent waiting for packets is measured
+# apart from the time spent handling them, if metrics are enabled.
+zone_status_iterator = REGISTRY.timed_iter(api.get_zone_status_stream(),
+                                           "wechat_packet_wait_seconds")
+
+try:
+    # Iterate through the zone status packets
+    for zone_status_packet in zone_status_iterator:
+        # Send a notification for every alert that lasted for more than 5
+        # seconds. Each alert is only sent once, even though it shows up in
+        # many packets.
+        with REGISTRY.timer("wechat_packet_handling_seconds"):
+            dispatcher.submit_finished_alerts(zone_status_packet,
+                                              min_duration=5)
+
+        # Stop once the first notification is sent, for demo purposes
+        metrics = dispatcher.metrics()
+        if metrics.sent > 0:
+            print("Dispatcher metrics: ", metrics)
+            print("Metadata cache stats: ", metadata.stats())
+            break
+finally:
+    # Wait for any queued notifications to be sent
+    dispatcher.close()
+
+    # Log out your WeChat account
+    wechat.logout()
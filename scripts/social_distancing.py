@@ -1,66 +1,62 @@
 # Import the dependencies
-import math
 from argparse import ArgumentParser
 from pathlib import Path
+from typing import Dict, Iterable
+
+import numpy as np
 
 from brainframe.api import BrainFrameAPI, bf_codecs
+from brainframe.api.stubs.zone_statuses import ZONE_STATUS_TYPE
+
+from distancing import ENGINES, Violations, packet_to_coords, \
+    packet_to_people
+from metrics import REGISTRY, configure_from_env
+from parallel_distancing import ParallelDistancing
+from storage_upload import upload_file
+from violation_tracker import ViolationEvent, ViolationTracker
+from zone_status_log import ZoneStatusRecorder, replay_zone_statuses
 
 
-# Help function to check if two detections are overlapped
-def is_overlapped(det1: bf_codecs.Detection,
-                  det2: bf_codecs.Detection) -> bool:
+# Helper function to print every pair of people that is too close
+def report_violations(stream_id: int, coords: np.ndarray,
+                      violations: Violations) -> None:
     """
-    :param det1: First Detection
-    :param det2: Second Detection
-    :return: If the two Detections' bboxes are overlapped
+    :param stream_id: The stream the people are in
+    :param coords: The coords of every person in the stream, (n, 4, 2)
+    :param violations: The pairs of people that are too close
     """
+    for i, j, distance in zip(*violations):
+        print(
+            f"People are violating the social distancing rules in stream "
+            f"{stream_id}, current distance: {distance}, location: "
+            f"{coords[i].astype(int).tolist()}, "
+            f"{coords[j].astype(int).tolist()}")
 
-    # Sort the x, y in ascending order
-    coords1_sorted_x = sorted([c[0] for c in det1.coords])
-    coords2_sorted_x = sorted([c[0] for c in det2.coords])
-    coords1_sorted_y = sorted([c[1] for c in det1.coords])
-    coords2_sorted_y = sorted([c[1] for c in det2.coords])
-
-    # Return False if the rects do not overlap horizontally
-    if coords1_sorted_x[0] > coords2_sorted_x[-1] \
-            or coords2_sorted_x[0] > coords1_sorted_x[-1]:
-        return False
-
-    # Return False if the rects do not overlap vertically
-    if coords1_sorted_y[0] > coords2_sorted_y[-1] \
-            or coords2_sorted_y[0] > coords1_sorted_y[-1]:
-        return False
-
-    # Otherwise, the two rects must overlap
-    return True
 
-
-# Helper function to calculate the distance between the center points of two
-# detections
-def get_distance(det1: bf_codecs.Detection,
-                 det2: bf_codecs.Detection) -> float:
-    """
-    :param det1: First Detection
-    :param det2: First Detection
-    :return: Distance between the center of the two Detections
-    """
-    return math.hypot(det1.center[0] - det2.center[0],
-                      det1.center[1] - det2.center[1])
+# Helper function to print when a pair of people starts or stops violating
+# the social distancing rules
+def report_event(event: ViolationEvent) -> None:
+    first, second = event.people
+    if event.started:
+        print(f"People {first} and {second} started violating the social "
+              f"distancing rules in stream {event.stream_id}, closest "
+              f"distance: {event.closest_distance:.1f}")
+    else:
+        print(f"People {first} and {second} stopped violating the social "
+              f"distancing rules in stream {event.stream_id} after "
+              f"{event.end_time - event.start_time:.1f} s, closest distance: "
+              f"{event.closest_distance:.1f}")
 
 
-def social_distancing(min_distance: int):
+# Helper function to upload the demo video and start analyzing it
+def start_demo_stream(api: BrainFrameAPI) -> bf_codecs.StreamConfiguration:
     """
-    :param min_distance: The minimum distance between two people
-    :return:
+    :param api: The API to create the stream with
+    :return: The new stream configuration
     """
-    # Initialize the API
-    api = BrainFrameAPI("http://localhost")
-
-    # Upload the local file to the database and get its storage ID
-    storage_id = api.new_storage(
-        data=Path("../videos/social_distancing.mp4").read_bytes(),
-        mime_type="application/octet-stream"
-    )
+    # Upload the local file to the database and get its storage ID. The file
+    # is streamed in chunks instead of being read into memory.
+    storage_id = upload_file(api, Path("../videos/social_distancing.mp4"))
 
     # Create a Stream Configuration referencing the new storage ID
     new_stream_config = bf_codecs.StreamConfiguration(
@@ -94,65 +90,194 @@ def social_distancing(min_distance: int):
     # Start analysis on the stream
     api.start_analyzing(new_stream_config.id)
 
-    print("Streaming started, scanning the social distancing rule...")
-
     # Verify that there is at least one connected stream
     assert len(api.get_stream_configurations()), \
         "There should be at least one stream already configured!"
 
-    # Get the inference stream.
-    for zone_status_packet in api.get_zone_status_stream():
-        # Organize detections results as a dictionary of
-        # {stream_id: [Detections]}.
-        detections_per_stream = {
-            stream_id: zone_status.within
-            for stream_id, zone_statuses in zone_status_packet.items()
-            for zone_name, zone_status in zone_statuses.items()
-            if zone_name == "Screen"
-        }
+    return new_stream_config
+
+
+def social_distancing(min_distance: int, engine: str = "grid",
+                      num_workers: int = 0,
+                      zone_names: Dict[int, str] = None,
+                      default_zone_name: str = "Screen",
+                      tracker: ViolationTracker = None,
+                      zone_status_packets: Iterable[ZONE_STATUS_TYPE] = None):
+    """
+    :param min_distance: The minimum distance between two people
+    :param engine: The name of the engine used to find people that are too
+        close, one of distancing.ENGINES
+    :param num_workers: The number of worker processes to split streams
+        across, or 0 to process every stream in this thread
+    :param zone_names: The zone to check in each stream, by stream ID
+    :param default_zone_name: The zone to check in streams not in zone_names
+    :param tracker: If provided, violations are tracked over time and only
+        reported when they start or end. Can't be used with workers.
+    :param zone_status_packets: The packets to check, like a replay from
+        zone_status_log.replay_zone_statuses. If not provided, the demo video
+        is streamed to a local BrainFrame server and its packets are checked.
+    :return:
+    """
+    if tracker is not None and num_workers > 0:
+        raise ValueError("Violations can't be tracked with worker processes")
+
+    find_violations = ENGINES[engine]
+    zone_names = zone_names or {}
+
+    if zone_status_packets is None:
+        # Initialize the API
+        api = BrainFrameAPI("http://localhost")
+        start_demo_stream(api)
+
+        # Get the inference stream.
+        zone_status_packets = api.get_zone_status_stream()
+
+    print("Streaming started, scanning the social distancing rule...")
+
+    # With workers, streams are processed in other processes while this
+    # thread keeps reading packets. If the workers fall behind, only the
+    # newest coords of each stream are kept for when they're free.
+    parallel = None
+    if num_workers > 0:
+        parallel = ParallelDistancing(min_distance,
+                                      on_result=report_violations,
+                                      engine=engine,
+                                      num_workers=num_workers)
+
+    # Time spent waiting for packets is measured apart from the time spent
+    # analyzing them, if metrics are enabled
+    zone_status_packets = REGISTRY.timed_iter(
+        zone_status_packets, "social_distancing_packet_wait_seconds")
+
+    try:
+        for zone_status_packet in zone_status_packets:
+            with REGISTRY.timer("social_distancing_analysis_seconds"):
+                if tracker is not None:
+                    # Tracking needs the timestamp and tracking IDs of each
+                    # person too, not just their coords
+                    stream_people = packet_to_people(
+                        zone_status_packet,
+                        zone_names=zone_names,
+                        default_zone_name=default_zone_name)
+                    for stream_id, people in stream_people.items():
+                        for event in tracker.update(stream_id, people):
+                            report_event(event)
+                    continue
+
+                # Organize the coords of people as a dictionary of
+                # {stream_id: coords}.
+                stream_coords = packet_to_coords(
+                    zone_status_packet,
+                    zone_names=zone_names,
+                    default_zone_name=default_zone_name)
+
+                if parallel is not None:
+                    parallel.submit(stream_coords)
+                    continue
+
+                # Iterate over each stream_id/coords combination
+                for stream_id, coords in stream_coords.items():
+                    # Skip stream frame if there are no person detections
+                    if len(coords) == 0:
+                        continue
+
+                    # Find every pair of people that is too close
+                    violations = find_violations(coords, min_distance)
+                    report_violations(stream_id, coords, violations)
+    finally:
+        if parallel is not None:
+            print(f"Processed {parallel.processed} packets, dropped "
+                  f"{parallel.dropped} outdated stream coords to keep up")
+            parallel.close()
+        if tracker is not None:
+            print(f"Computed violations for {tracker.frames_computed} frames, "
+                  f"reused them for {tracker.frames_reused} frames")
 
-        # Iterate over each stream_id/detections combination
-        for stream_id, detections in detections_per_stream.items():
-            # Filter out Detections that are not people
-            detections = [detection for detection in detections
-                          if detection.class_name == "person"]
-
-            # Skip stream frame if there are no person detections
-            if len(detections) == 0:
-                continue
-            # Compare the distance between each detections.
-            for i, current_detection in enumerate(detections):
-                violating = False
-                for j in range(i + 1, len(detections)):
-                    target_detection = detections[j]
-                    current_detection: bf_codecs.Detection
-                    target_detection: bf_codecs.Detection
-                    # If the bbox representing two people are overlapped, the
-                    # distance is 0, otherwise it's the distance between the
-                    # center of these two bbox.
-                    if is_overlapped(current_detection, target_detection):
-                        distance = 0
-                    else:
-                        distance = get_distance(current_detection,
-                                                target_detection)
-
-                    if distance < min_distance:
-                        print(
-                            f"People are violating the social distancing rules, "
-                            f"current distance: {distance}, location: "
-                            f"{current_detection.coords}, "
-                            f"{target_detection.coords}")
-                        violating = True
-                        break
-                if violating:
-                    break
 
 def main():
     parser = ArgumentParser()
     parser.add_argument("--min-distance", type=int, default=500,
                         help="The min distance allowed between two people")
+    parser.add_argument("--engine", choices=list(ENGINES), default="grid",
+                        help="How to find people that are too close. 'grid' "
+                             "only compares nearby people, 'matrix' compares "
+                             "all pairs at once and 'loop' is the plain "
+                             "Python reference")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="The number of worker processes to split streams "
+                             "across. 0 processes them in the main process.")
+    parser.add_argument("--zone", action="append", default=[],
+                        metavar="STREAM_ID=ZONE_NAME",
+                        help="The zone to check in a stream. Can be used many "
+                             "times.")
+    parser.add_argument("--default-zone", default="Screen",
+                        help="The zone to check in streams without --zone")
+    parser.add_argument("--track", action="store_true",
+                        help="Only report when a pair of people starts or "
+                             "stops violating the rules, instead of every "
+                             "frame")
+    parser.add_argument("--window-duration", type=float, default=5.0,
+                        help="With --track, the length of the window used to "
+                             "debounce violations, in seconds")
+    parser.add_argument("--window-threshold", type=float, default=0.5,
+                        help="With --track, the fraction of frames in the "
+                             "window a pair must be too close in")
+    parser.add_argument("--match-distance", type=float, default=50.0,
+                        help="With --track, how far in pixels a person "
+                             "without a tracking ID can move between frames "
+                             "and still be taken to be the same person")
+    parser.add_argument("--record", type=Path,
+                        help="Record the zone status packets to this log, so "
+                             "they can be replayed later with --replay")
+    parser.add_argument("--replay", type=Path,
+                        help="Check the packets in this log instead of "
+                             "streaming the demo video to a server")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="How much faster than real time to replay, or 0 "
+                             "for as fast as possible")
     args = parser.parse_args()
-    social_distancing(args.min_distance)
+
+    # Set BRAINFRAME_METRICS or BRAINFRAME_PROFILE to measure where the time
+    # goes
+    configure_from_env()
+
+    zone_names = {}
+    for zone in args.zone:
+        stream_id, zone_name = zone.split("=", 1)
+        zone_names[int(stream_id)] = zone_name
+
+    tracker = None
+    if args.track:
+        tracker = ViolationTracker(args.min_distance,
+                                   engine=args.engine,
+                                   window_duration=args.window_duration,
+                                   window_threshold=args.window_threshold,
+                                   match_distance=args.match_distance)
+
+    zone_status_packets = None
+    if args.replay is not None:
+        zone_status_packets = replay_zone_statuses(args.replay,
+                                                   speed=args.replay_speed)
+    elif args.record is not None:
+        api = BrainFrameAPI("http://localhost")
+        start_demo_stream(api)
+        zone_status_packets = api.get_zone_status_stream()
+
+    recorder = None
+    if args.record is not None:
+        recorder = ZoneStatusRecorder(args.record)
+        zone_status_packets = recorder.record(zone_status_packets)
+
+    try:
+        social_distancing(args.min_distance, args.engine,
+                          num_workers=args.workers,
+                          zone_names=zone_names,
+                          default_zone_name=args.default_zone,
+                          tracker=tracker,
+                          zone_status_packets=zone_status_packets)
+    finally:
+        if recorder is not None:
+            recorder.close()
 
 
 if __name__ == "__main__":
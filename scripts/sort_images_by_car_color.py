@@ -1,16 +1,34 @@
 # Import necessary libraries
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import shutil
+from typing import Dict, Iterator, List, Optional, Set
 
-import cv2
+from brainframe.api import BrainFrameAPI, bf_codecs
 
-from brainframe.api import BrainFrameAPI
+from archive_crawler import state_dir
+from bulk_processing import ThroughputStats, process_images, \
+    read_encoded_image
+from metadata_cache import MetadataCache
+from metrics import configure_from_env
+from phash_index import ImageSignature, IndexEntry, PerceptualHashIndex, \
+    read_image_signature
+from pooled_session import PooledSession
+
+# Set BRAINFRAME_METRICS or BRAINFRAME_PROFILE to measure where the time
+# goes
+configure_from_env()
 
 # Initialize the API and connect to the server
 api = BrainFrameAPI("http://localhost")
 
+# Cache configurations read from the server, so they're only requested once
+metadata = MetadataCache(api)
+
 # Get the names of existing capsules
-loaded_capsules = api.get_capsules()
+loaded_capsules = metadata.get_capsules()
 loaded_capsules_names = [capsule.name for capsule in loaded_capsules]
 
 # Print out the capsules names
@@ -19,37 +37,52 @@ print(f"Loaded Capsules: {loaded_capsules_names}")
 # Root directory containing the images.
 IMAGE_ARCHIVE = Path("../images/cars")
 
-# Iterate through all images in the directory
-for image_path in IMAGE_ARCHIVE.iterdir():
-    # Use only PNGs and JPGs
-    if image_path.suffix not in [".png", ".jpg"]:
-        continue
-
-    # Get the image array
-    image_array = cv2.imread(str(image_path))
-
-    # Perform inference on the image and get the results
-    detections = api.process_image(
-        # Image array
-        img_bgr=image_array,
-        # The names of capsules to enable while processing the image
-        capsule_names=["classifier_vehicle_color_openvino",
-                       "detector_person_vehicle_bike_openvino"],
-        # The capsule options you want to set. You can check the available
-        # capsule options with the client. Or in the code snippet above that
-        # printed capsule names, also print the capsule metadata.
-        option_vals={}
-    )
-
-    print()
-    print(f"Processed image {image_path.name} and got {detections}")
-
+# The max number of images being processed by BrainFrame at once. Sending
+# several images at a time lets the server batch them together.
+CONCURRENCY = 8
+
+# BrainFrame processes one image per request, so batches are made by keeping
+# CONCURRENCY requests in flight at once. They are sent over a pool of
+# connections that are kept open, instead of a new connection per image.
+session = PooledSession(api, pool_size=CONCURRENCY)
+
+# The names of capsules to enable while processing the images
+CAPSULE_NAMES = ["classifier_vehicle_color_openvino",
+                 "detector_person_vehicle_bike_openvino"]
+
+# The capsule options you want to set. You can check the available capsule
+# options with the client. Or in the code snippet above that printed capsule
+# names, also print the capsule metadata.
+OPTION_VALS = {}
+
+# Images whose perceptual hashes differ by at most this many bits (out of 64)
+# are near duplicates, like burst shots of the same car. The hash only looks
+# at brightness, so their colors must also be close, or a red car would
+# reuse the color of a blue car parked in the same spot.
+MAX_HASH_DISTANCE = 6
+MAX_COLOR_DISTANCE = 0.05
+
+# Use only PNGs and JPGs. The listing is made up front, since color folders
+# are created inside of the archive while the results come in.
+image_paths = [image_path for image_path in IMAGE_ARCHIVE.iterdir()
+               if image_path.suffix in [".png", ".jpg"]]
+
+
+# Helper function to put an image into the folder of its car's color
+def sort_image(image_path: Path, detections: List[bf_codecs.Detection],
+               link: bool) -> None:
+    """
+    :param image_path: The image to sort
+    :param detections: The detections of the image
+    :param link: If True, the image is hard linked into the folder instead
+        of being copied, which doesn't use any more disk space
+    """
     car_detections = [detection for detection in detections if
                       detection.class_name == "vehicle"]
 
     if len(car_detections) != 1:
         print("No car or more and one car detected in this image, skip.")
-        continue
+        return
 
     color = car_detections[0].attributes["color"]
     color_folder = IMAGE_ARCHIVE / color
@@ -57,9 +90,133 @@ for image_path in IMAGE_ARCHIVE.iterdir():
     if not color_folder.exists():
         color_folder.mkdir()
 
+    destination = color_folder / image_path.name
+    if link:
+        try:
+            if destination.exists():
+                destination.unlink()
+            os.link(str(image_path), str(destination))
+            return
+        except OSError:
+            # Hard links don't work across file systems, or on some file
+            # systems at all
+            pass
     shutil.copy(str(image_path), str(color_folder))
 
 
+# The signatures and detections of processed images are kept on disk, so near
+# duplicates of them reuse their detections, even in later runs. Detections
+# are only reused if they were made by the same capsules. The index is kept
+# in a state directory outside of the archive, which BRAINFRAME_STATE_DIR can
+# change.
+index = PerceptualHashIndex(state_dir(IMAGE_ARCHIVE) / "phash_index.sqlite",
+                            config={"capsules": CAPSULE_NAMES,
+                                    "options": OPTION_VALS})
+
+# The number of threads reading image signatures
+SIGNATURE_WORKERS = 2
+
+# Only one image of every group of near duplicates is sent to BrainFrame. The
+# others wait for its detections.
+near_duplicates: Dict[Path, List[Path]] = {}
+entries: Dict[Path, IndexEntry] = {}
+failed_images: Set[Path] = set()
+reused_images: List[Path] = []
+
+
+# Helper function to read an image's signature, returning None instead of
+# raising an error so one bad image doesn't stop the others
+def read_signature(image_path: Path) -> Optional[ImageSignature]:
+    try:
+        return read_image_signature(image_path)
+    except IOError as exc:
+        logging.error(str(exc))
+        return None
+
+
+# Helper function that looks up images in the index as process_images asks
+# for them. Signatures are read in a thread pool, so reading them overlaps
+# with the requests in flight.
+def images_to_process() -> Iterator[Path]:
+    """
+    :return: A generator of the images that aren't near duplicates of an
+        image that was or will be processed
+    """
+    with ThreadPoolExecutor(SIGNATURE_WORKERS) as pool:
+        signatures = pool.map(read_signature, image_paths)
+        for image_path, signature in zip(image_paths, signatures):
+            if signature is None:
+                print(f"Skipping image {image_path.name}")
+                continue
+
+            match = index.find(signature, radius=MAX_HASH_DISTANCE,
+                               max_color_distance=MAX_COLOR_DISTANCE)
+
+            if match is None:
+                entries[image_path] = index.add(image_path, signature)
+                yield image_path
+            elif match.entry.detections is not None:
+                # A near duplicate was already processed, in this run or an
+                # earlier one
+                print(f"Image {image_path.name} is a near duplicate of "
+                      f"{match.entry.image_path.name}, reusing its "
+                      f"detections")
+                sort_image(image_path, match.entry.detections, link=True)
+                reused_images.append(image_path)
+            elif match.entry.image_path in failed_images:
+                print(f"Skipping image {image_path.name}, a near duplicate "
+                      f"of {match.entry.image_path.name} which failed")
+            else:
+                near_duplicates.setdefault(match.entry.image_path,
+                                           []).append(image_path)
+
+
+# Keep track of how fast the images are processed
+stats = ThroughputStats()
+
+# Perform inference on the images and get the results
+results = process_images(
+    api,
+    images_to_process(),
+    capsule_names=CAPSULE_NAMES,
+    option_vals=OPTION_VALS,
+    concurrency=CONCURRENCY,
+    ordered=False,
+    stats=stats,
+    # Send the JPEG and PNG files as they are, instead of decoding them and
+    # encoding them again. This saves CPU time. The files can be a little
+    # larger than a new encoding of the same image, so requests may be too.
+    decode=read_encoded_image,
+)
+
+# Iterate through the results of all images in the directory
+for result in results:
+    image_path = result.image_path
+    detections = result.detections
 
+    print()
+    if result.error is not None:
+        # The error was already logged. The image's index entry is only
+        # saved once it has detections, so it's sent again in the next run.
+        print(f"Skipping image {image_path.name} and its near duplicates")
+        failed_images.add(image_path)
+        near_duplicates.pop(image_path, None)
+        continue
 
-
+    print(f"Processed image {image_path.name} and got {detections}")
+    index.set_detections(entries[image_path], detections)
+    sort_image(image_path, detections, link=False)
+
+    for duplicate_path in near_duplicates.pop(image_path, []):
+        print(f"Image {duplicate_path.name} is a near duplicate, reusing the "
+              f"detections")
+        sort_image(duplicate_path, detections, link=True)
+        reused_images.append(duplicate_path)
+
+index.close()
+session.close()
+
+print()
+print(stats.summary())
+print(f"Reused detections for {len(reused_images)} near duplicate images, "
+      f"index size: {len(index)}")
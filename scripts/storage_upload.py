@@ -0,0 +1,394 @@
+# Import the dependencies
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, NamedTuple, Optional
+
+from brainframe.api import BrainFrameAPI, bf_errors
+from brainframe.api.stubs.base_stub import DEFAULT_TIMEOUT
+
+
+class UploadResult(NamedTuple):
+    """The result of uploading one file"""
+
+    path: Path
+    """The file that was uploaded"""
+
+    storage_id: int
+    """The storage ID of the file's contents on the BrainFrame server"""
+
+    content_hash: str
+    """The SHA-256 of the file's contents"""
+
+    size: int
+    """The size of the file, in bytes"""
+
+    elapsed: float
+    """How long the upload took, in seconds"""
+
+    skipped: bool = False
+    """True if identical contents were already uploaded, so the file was not
+    sent again
+    """
+
+
+class UploadIndex:
+    """Remembers which files were already uploaded to BrainFrame, so identical
+    contents aren't uploaded again. Files are identified by the hash of their
+    contents. A file's hash is remembered along with its size and modification
+    time, so unchanged files don't need to be read again to be hashed.
+    """
+
+    def __init__(self, db_path: Path):
+        """
+        :param db_path: The SQLite file to store the index in
+        """
+        # The index is used from the upload threads
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(db_path),
+                                           check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, content_hash TEXT NOT NULL)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS storage "
+                "(content_hash TEXT PRIMARY KEY, storage_id INTEGER NOT NULL)")
+
+    def get_hash(self, path: Path, stat: os.stat_result) -> Optional[str]:
+        """
+        :param path: The file to look up
+        :param stat: The current stat of the file
+        :return: The hash of the file's contents, or None if the file isn't
+            known or has changed since it was hashed
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content_hash FROM files "
+                "WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (str(path.resolve()), stat.st_size,
+                 stat.st_mtime_ns)).fetchone()
+        return None if row is None else row[0]
+
+    def get_storage_id(self, content_hash: str) -> Optional[int]:
+        """
+        :param content_hash: The hash of the contents to look up
+        :return: The storage ID the contents were uploaded to, or None
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT storage_id FROM storage WHERE content_hash = ?",
+                (content_hash,)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, path: Path, stat: os.stat_result, content_hash: str,
+            storage_id: Optional[int] = None) -> None:
+        """
+        :param path: The file that was hashed
+        :param stat: The stat of the file when it was hashed
+        :param content_hash: The hash of the file's contents
+        :param storage_id: The storage ID the contents were uploaded to, if
+            they were uploaded
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files "
+                "(path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+                (str(path.resolve()), stat.st_size, stat.st_mtime_ns,
+                 content_hash))
+            if storage_id is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO storage "
+                    "(content_hash, storage_id) VALUES (?, ?)",
+                    (content_hash, storage_id))
+
+    def forget_storage(self, storage_id: int) -> None:
+        """Forgets an upload, like when its storage was deleted from the
+        server, so the contents are uploaded again next time.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM storage WHERE storage_id = ?", (storage_id,))
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class _HashingReader:
+    """Wraps a file so it can be streamed to the server one chunk at a time,
+    hashing the chunks as they're sent. Only one chunk is in memory at once.
+    """
+
+    def __init__(self, file: BinaryIO, size: int, chunk_size: int):
+        self._file = file
+        self._size = size
+        self._chunk_size = chunk_size
+        self.hash = hashlib.sha256()
+        self.bytes_read = 0
+
+    def __len__(self) -> int:
+        # Lets requests send a Content-Length header instead of using chunked
+        # transfer encoding
+        return self._size
+
+    def read(self, size: int = -1) -> bytes:
+        # Like any file, a size of -1 reads the rest of it
+        if size is None or size < 0:
+            chunk = self._file.read()
+        else:
+            chunk = self._file.read(size)
+        self.hash.update(chunk)
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self.read(self._chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+# Helper function to check that a storage object still exists on the server
+def storage_exists(api: BrainFrameAPI, storage_id: int,
+                   timeout: float = DEFAULT_TIMEOUT) -> bool:
+    """
+    :param api: The API to check with
+    :param storage_id: The storage ID to look for
+    :param timeout: The timeout to use for this request
+    :return: True if the storage object exists
+    """
+    try:
+        response = api._get(f"/api/storage/{storage_id}", timeout)
+    except bf_errors.StorageNotFoundError:
+        return False
+    # The response is streamed, so closing it without reading the contents
+    # only costs the request itself
+    response.close()
+    return True
+
+
+# Helper function to hash a file without reading all of it into memory
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """
+    :param path: The file to hash
+    :param chunk_size: How many bytes to read at a time
+    :return: The SHA-256 of the file's contents
+    """
+    content_hash = hashlib.sha256()
+    with open(str(path), "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+class StorageUploader:
+    """Uploads files to BrainFrame's storage by streaming them from disk,
+    instead of reading them into memory with Path.read_bytes() first. Several
+    files can be uploaded at once, and files that were already uploaded are
+    skipped when an UploadIndex is provided.
+    """
+
+    def __init__(self, api: BrainFrameAPI,
+                 index: Optional[UploadIndex] = None,
+                 num_workers: int = 4,
+                 chunk_size: int = 1024 * 1024,
+                 hash_first: bool = False,
+                 verify: bool = True):
+        """
+        :param api: The API to upload files with
+        :param index: If provided, it's used to skip files that were already
+            uploaded, and new uploads are added to it
+        :param num_workers: The max number of uploads in progress at once, by
+            upload_many
+        :param chunk_size: How many bytes of a file are read at a time
+        :param hash_first: If True, files the index doesn't know yet are read
+            once to be hashed before they're uploaded, so copies of
+            already uploaded contents under a new path are skipped too.
+            Otherwise, they're hashed while they're uploaded.
+        :param verify: If True, a file is only skipped once the server
+            confirms its earlier upload still exists. The storage may have
+            been deleted, or the server reset, since the index was written.
+        """
+        self.api = api
+        self.index = index
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.hash_first = hash_first
+        self.verify = verify
+
+        self._lock = threading.Lock()
+        self.files_uploaded = 0
+        self.files_skipped = 0
+        self.bytes_uploaded = 0
+        self.bytes_skipped = 0
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+    def upload(self, path: Path,
+               mime_type: str = "application/octet-stream") -> UploadResult:
+        """
+        :param path: The file to upload
+        :param mime_type: The MIME type of the file
+        :return: The result of the upload
+        """
+        path = Path(path)
+        start = time.perf_counter()
+        with self._lock:
+            if self.start_time is None:
+                self.start_time = start
+
+        stat = path.stat()
+        content_hash = None
+        if self.index is not None:
+            content_hash = self.index.get_hash(path, stat)
+            if content_hash is None and self.hash_first:
+                content_hash = hash_file(path, self.chunk_size)
+                self.index.put(path, stat, content_hash)
+
+            if content_hash is not None:
+                storage_id = self.index.get_storage_id(content_hash)
+                if storage_id is not None and self.verify \
+                        and not storage_exists(self.api, storage_id):
+                    # The upload is gone from the server, so the file is
+                    # uploaded again
+                    self.index.forget_storage(storage_id)
+                    storage_id = None
+                if storage_id is not None:
+                    return self._finish(UploadResult(
+                        path=path,
+                        storage_id=storage_id,
+                        content_hash=content_hash,
+                        size=stat.st_size,
+                        elapsed=time.perf_counter() - start,
+                        skipped=True))
+
+        with open(str(path), "rb") as file:
+            reader = _HashingReader(file, stat.st_size, self.chunk_size)
+            storage_id = self.api.new_storage(data=reader,
+                                              mime_type=mime_type)
+
+        # The hash is only complete if the whole file was sent exactly once
+        if content_hash is None and reader.bytes_read == stat.st_size:
+            content_hash = reader.hash.hexdigest()
+        if self.index is not None and content_hash is not None:
+            self.index.put(path, stat, content_hash, storage_id)
+
+        return self._finish(UploadResult(
+            path=path,
+            storage_id=storage_id,
+            content_hash=content_hash or "",
+            size=stat.st_size,
+            elapsed=time.perf_counter() - start))
+
+    def upload_many(self, paths: Iterable[Path],
+                    mime_type: str = "application/octet-stream") \
+            -> Iterator[UploadResult]:
+        """Uploads several files at once. Each upload only holds one chunk of
+        its file in memory, so memory use is bounded by num_workers, no matter
+        how big the files are.
+
+        :param paths: The files to upload
+        :param mime_type: The MIME type of the files
+        :return: A generator of results, in the same order as paths
+        """
+        with ThreadPoolExecutor(self.num_workers) as pool:
+            yield from pool.map(lambda path: self.upload(path, mime_type),
+                                paths)
+
+    @property
+    def megabytes_per_second(self) -> float:
+        """The upload speed, counting only bytes that were actually sent"""
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        elapsed = self.end_time - self.start_time
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes_uploaded / (1024 * 1024) / elapsed
+
+    def summary(self) -> str:
+        return (f"Uploaded {self.files_uploaded} files "
+                f"({self.bytes_uploaded / (1024 * 1024):.1f} MB) at "
+                f"{self.megabytes_per_second:.1f} MB/s, skipped "
+                f"{self.files_skipped} files "
+                f"({self.bytes_skipped / (1024 * 1024):.1f} MB) that were "
+                f"already uploaded")
+
+    def _finish(self, result: UploadResult) -> UploadResult:
+        with self._lock:
+            if result.skipped:
+                self.files_skipped += 1
+                self.bytes_skipped += result.size
+            else:
+                self.files_uploaded += 1
+                self.bytes_uploaded += result.size
+            self.end_time = time.perf_counter()
+        return result
+
+
+# Helper function to upload one file without reading it into memory
+def upload_file(api: BrainFrameAPI, path: Path,
+                mime_type: str = "application/octet-stream",
+                index_path: Optional[Path] = None) -> int:
+    """
+    :param api: The API to upload the file with
+    :param path: The file to upload
+    :param mime_type: The MIME type of the file
+    :param index_path: If provided, the SQLite file that remembers uploaded
+        files, so the file is skipped if it was uploaded before and its
+        storage still exists
+    :return: The storage ID of the file
+    """
+    if index_path is None:
+        return StorageUploader(api).upload(path, mime_type).storage_id
+
+    index = UploadIndex(index_path)
+    try:
+        uploader = StorageUploader(api, index=index)
+        return uploader.upload(path, mime_type).storage_id
+    finally:
+        index.close()
+
+
+def main():
+    parser = ArgumentParser(
+        description="Upload files to BrainFrame's storage without reading "
+                    "them into memory")
+    parser.add_argument("files", type=Path, nargs="+",
+                        help="The files to upload")
+    parser.add_argument("--server", default="http://localhost",
+                        help="The URL of the BrainFrame server")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="The max number of files uploaded at once")
+    parser.add_argument("--index", type=Path, default=Path("uploads.sqlite"),
+                        help="Where to remember uploaded files, so they're "
+                             "skipped next time")
+    parser.add_argument("--hash-first", action="store_true",
+                        help="Hash new files before uploading them, so copies "
+                             "of already uploaded files are skipped too")
+    args = parser.parse_args()
+
+    api = BrainFrameAPI(args.server)
+    index = UploadIndex(args.index)
+    uploader = StorageUploader(api, index=index,
+                               num_workers=args.workers,
+                               hash_first=args.hash_first)
+    try:
+        for result in uploader.upload_many(args.files):
+            action = "Skipped" if result.skipped else "Uploaded"
+            print(f"{action} {result.path} as storage {result.storage_id} "
+                  f"in {result.elapsed:.2f} s")
+    finally:
+        index.close()
+
+    print(uploader.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+# Import the dependencies
+import json
+import re
+import threading
+import time
+import zlib
+from argparse import ArgumentParser
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+class StubBrainFrameServer:
+    """A small in-memory stand-in for the BrainFrame REST API, so scripts can
+    be tested and benchmarked without a real server. Only the streams, zones,
+    alarms, capsule options, analysis, storage and process_image endpoints
+    are supported, and nothing is actually analyzed.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0):
+        """
+        :param host: The address to listen on
+        :param port: The port to listen on, or 0 to pick a free one
+        :param latency: How long every request takes, in seconds, to simulate
+            a server that's far away or busy
+        """
+        self.latency = latency
+
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.streams: Dict[int, dict] = {}
+        self.zones: Dict[int, dict] = {}
+        self.alarms: Dict[int, dict] = {}
+        self.option_vals: Dict[Tuple[int, str], dict] = {}
+        self.analyzing: Dict[int, bool] = {}
+        self.storage: Dict[int, int] = {}
+        """The size of every stored object, by storage ID"""
+
+        self.requests_handled = 0
+        self.bytes_received = 0
+        self.images_processed = 0
+        self.image_bytes_received = 0
+        """The size of the images sent to process_image, without the rest of
+        the multipart body
+        """
+
+        # Requests are routed by method and path. Path groups are passed to
+        # the handler as arguments.
+        self._routes: List[Tuple[str, re.Pattern, Callable]] = [
+            ("GET", r"/api/streams", self._get_streams),
+            ("POST", r"/api/streams", self._post_stream),
+            ("GET", r"/api/streams/(\d+)", self._get_stream),
+            ("DELETE", r"/api/streams/(\d+)", self._delete_stream),
+            ("PUT", r"/api/streams/(\d+)/runtime_options",
+             self._put_runtime_options),
+            ("GET", r"/api/streams/(\d+)/analyze", self._get_analyze),
+            ("PUT", r"/api/streams/(\d+)/analyze", self._put_analyze),
+            ("GET", r"/api/streams/(\d+)/plugins/([^/]+)/options",
+             self._get_option_vals),
+            ("PUT", r"/api/streams/(\d+)/plugins/([^/]+)/options",
+             self._put_option_vals),
+            ("PATCH", r"/api/streams/(\d+)/plugins/([^/]+)/options",
+             self._patch_option_vals),
+            ("GET", r"/api/zones", self._get_zones),
+            ("POST", r"/api/zones", self._post_zone),
+            ("GET", r"/api/zones/(\d+)", self._get_zone),
+            ("DELETE", r"/api/zones/(\d+)", self._delete_zone),
+            ("POST", r"/api/zone_alarms", self._post_alarm),
+            ("GET", r"/api/zone_alarms/(\d+)", self._get_alarm),
+            ("DELETE", r"/api/zone_alarms/(\d+)", self._delete_alarm),
+            ("POST", r"/api/storage", self._post_storage),
+            ("GET", r"/api/storage/(\d+)", self._get_storage),
+            ("DELETE", r"/api/storage/(\d+)", self._delete_storage),
+            ("POST", r"/api/process_image", self._post_process_image),
+        ]
+        self._routes = [(method, re.compile(pattern + "$"), handler)
+                        for method, pattern, handler in self._routes]
+
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubBrainFrameServer":
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="StubBrainFrameServerThread",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _new_id(self) -> int:
+        new_id = self._next_id
+        self._next_id += 1
+        return new_id
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections open between requests, like a real server
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PUT(self):
+                self._handle("PUT")
+
+            def do_PATCH(self):
+                self._handle("PATCH")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+            def _handle(self, method: str):
+                url = urlparse(self.path)
+                params = {key: values[0]
+                          for key, values in parse_qs(url.query).items()}
+
+                # Read the body in chunks, so big uploads aren't held in
+                # memory
+                body = b""
+                remaining = int(self.headers.get("Content-Length", 0))
+                is_storage = url.path == "/api/storage"
+                size = remaining
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    if not is_storage:
+                        body += chunk
+
+                if stub.latency > 0:
+                    time.sleep(stub.latency)
+
+                status, response = 404, {"title": "Not found"}
+                for route_method, pattern, handler in stub._routes:
+                    match = pattern.match(url.path)
+                    if route_method == method and match:
+                        if is_storage:
+                            data = size
+                        elif url.path == "/api/process_image":
+                            data = _parse_multipart(
+                                self.headers.get("Content-Type", ""), body)
+                        else:
+                            data = json.loads(body) if body else None
+                        with stub._lock:
+                            stub.requests_handled += 1
+                            stub.bytes_received += size
+                            status, response = handler(
+                                *match.groups(), data=data, params=params)
+                        break
+
+                content = b"" if response is None \
+                    else json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    # Every handler is called with the lock held, and returns
+    # (status code, JSON response)
+
+    def _get_streams(self, data, params) -> Tuple[int, Any]:
+        return 200, list(self.streams.values())
+
+    def _post_stream(self, data, params) -> Tuple[int, Any]:
+        stream = dict(data, id=self._new_id())
+        stream.setdefault("metadata", {})
+        self.streams[stream["id"]] = stream
+        self.analyzing[stream["id"]] = False
+
+        # Every stream has a full frame zone
+        zone_id = self._new_id()
+        self.zones[zone_id] = {"name": "Screen", "id": zone_id,
+                               "stream_id": stream["id"],
+                               "coords": [[0, 0], [1920, 0], [1920, 1080],
+                                          [0, 1080]],
+                               "alarms": []}
+        return 200, stream
+
+    def _get_stream(self, stream_id, data, params) -> Tuple[int, Any]:
+        stream = self.streams.get(int(stream_id))
+        return (200, stream) if stream else (404, None)
+
+    def _delete_stream(self, stream_id, data, params) -> Tuple[int, Any]:
+        stream_id = int(stream_id)
+        self.streams.pop(stream_id, None)
+        self.analyzing.pop(stream_id, None)
+        for zone_id in [zone_id for zone_id, zone in self.zones.items()
+                        if zone["stream_id"] == stream_id]:
+            self._delete_zone(zone_id, None, None)
+        return 200, None
+
+    def _put_runtime_options(self, stream_id, data, params) \
+            -> Tuple[int, Any]:
+        self.streams[int(stream_id)]["runtime_options"] = data
+        return 200, None
+
+    def _get_analyze(self, stream_id, data, params) -> Tuple[int, Any]:
+        return 200, self.analyzing.get(int(stream_id), False)
+
+    def _put_analyze(self, stream_id, data, params) -> Tuple[int, Any]:
+        self.analyzing[int(stream_id)] = bool(data)
+        return 200, None
+
+    def _get_option_vals(self, stream_id, capsule_name, data, params) \
+            -> Tuple[int, Any]:
+        return 200, self.option_vals.get((int(stream_id), capsule_name), {})
+
+    def _put_option_vals(self, stream_id, capsule_name, data, params) \
+            -> Tuple[int, Any]:
+        self.option_vals[(int(stream_id), capsule_name)] = data
+        return 200, None
+
+    def _patch_option_vals(self, stream_id, capsule_name, data, params) \
+            -> Tuple[int, Any]:
+        key = (int(stream_id), capsule_name)
+        self.option_vals[key] = dict(self.option_vals.get(key, {}), **data)
+        return 200, None
+
+    def _zone_with_alarms(self, zone: dict) -> dict:
+        return dict(zone, alarms=[alarm for alarm in self.alarms.values()
+                                  if alarm["zone_id"] == zone["id"]])
+
+    def _get_zones(self, data, params) -> Tuple[int, Any]:
+        stream_id = params.get("stream_id")
+        return 200, [self._zone_with_alarms(zone)
+                     for zone in self.zones.values()
+                     if stream_id is None
+                     or zone["stream_id"] == int(stream_id)]
+
+    def _post_zone(self, data, params) -> Tuple[int, Any]:
+        zone = dict(data, id=data.get("id") or self._new_id(), alarms=[])
+        self.zones[zone["id"]] = zone
+        for alarm in data.get("alarms", []):
+            self._post_alarm(dict(alarm, zone_id=zone["id"]), params)
+        return 200, self._zone_with_alarms(zone)
+
+    def _get_zone(self, zone_id, data, params) -> Tuple[int, Any]:
+        zone = self.zones.get(int(zone_id))
+        return (200, self._zone_with_alarms(zone)) if zone else (404, None)
+
+    def _delete_zone(self, zone_id, data, params) -> Tuple[int, Any]:
+        zone_id = int(zone_id)
+        self.zones.pop(zone_id, None)
+        for alarm_id in [alarm_id for alarm_id, alarm in self.alarms.items()
+                         if alarm["zone_id"] == zone_id]:
+            del self.alarms[alarm_id]
+        return 200, None
+
+    def _post_alarm(self, data, params) -> Tuple[int, Any]:
+        zone = self.zones[data["zone_id"]]
+        alarm = dict(data, id=data.get("id") or self._new_id(),
+                     stream_id=zone["stream_id"])
+        for condition in alarm["count_conditions"] \
+                + alarm["rate_conditions"]:
+            condition["id"] = condition.get("id") or self._new_id()
+        self.alarms[alarm["id"]] = alarm
+        return 200, alarm
+
+    def _get_alarm(self, alarm_id, data, params) -> Tuple[int, Any]:
+        alarm = self.alarms.get(int(alarm_id))
+        return (200, alarm) if alarm else (404, None)
+
+    def _delete_alarm(self, alarm_id, data, params) -> Tuple[int, Any]:
+        self.alarms.pop(int(alarm_id), None)
+        return 200, None
+
+    def _post_storage(self, data, params) -> Tuple[int, Any]:
+        storage_id = self._new_id()
+        self.storage[storage_id] = data
+        return 200, storage_id
+
+    def _get_storage(self, storage_id, data, params) -> Tuple[int, Any]:
+        # Only the size of stored objects is kept, so the contents can't be
+        # returned
+        if int(storage_id) not in self.storage:
+            return 404, {"title": "StorageNotFoundError",
+                         "description": f"No storage with ID {storage_id}"}
+        return 200, None
+
+    def _delete_storage(self, storage_id, data, params) -> Tuple[int, Any]:
+        self.storage.pop(int(storage_id), None)
+        return 200, None
+
+    def _post_process_image(self, data, params) -> Tuple[int, Any]:
+        image = data.get("image")
+        if image is None:
+            return 400, {"title": "No image was sent"}
+        self.images_processed += 1
+        self.image_bytes_received += len(image)
+
+        # Every image has one vehicle, with a color that's the same every
+        # time the same image is sent
+        colors = ["black", "blue", "gray", "red", "white", "yellow"]
+        color = colors[zlib.crc32(image) % len(colors)]
+        return 200, [{
+            "class_name": "vehicle",
+            "coords": [[10, 10], [100, 10], [100, 100], [10, 100]],
+            "children": [],
+            "attributes": {"color": color},
+            "with_identity": None,
+            "extra_data": {"detection_confidence": 0.9},
+            "track_id": None,
+        }]
+
+
+# Helper function to split a multipart/form-data body into its parts
+def _parse_multipart(content_type: str, body: bytes) -> Dict[str, bytes]:
+    """
+    :param content_type: The Content-Type header of the request, with the
+        boundary
+    :param body: The body of the request
+    :return: The content of every part, by name
+    """
+    message = BytesParser().parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+    return {part.get_param("name", header="Content-Disposition"):
+            part.get_payload(decode=True)
+            for part in message.get_payload()}
+
+
+def main():
+    parser = ArgumentParser(
+        description="Run an in-memory stand-in for the BrainFrame REST API")
+    parser.add_argument("--port", type=int, default=8000,
+                        help="The port to listen on")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="How long every request takes, in seconds")
+    args = parser.parse_args()
+
+    server = StubBrainFrameServer(port=args.port, latency=args.latency)
+    server.start()
+    print(f"Stub server listening on {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
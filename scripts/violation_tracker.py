@@ -0,0 +1,258 @@
+# Import the dependencies
+from collections import deque
+from typing import Dict, FrozenSet, Hashable, List, NamedTuple, Optional, \
+    Tuple
+
+import numpy as np
+
+from distancing import ENGINES, StreamPeople, Violations
+
+
+class ViolationEvent(NamedTuple):
+    """Sent when two people start or stop violating the social distancing
+    rules
+    """
+
+    stream_id: int
+    """The stream the people are in"""
+
+    people: Tuple[Hashable, Hashable]
+    """The two people, by tracking ID. People that aren't tracked get a
+    number instead, which follows them from frame to frame while they move
+    less than the tracker's match_distance.
+    """
+
+    start_time: float
+    """When the violation started, in Unix Time (seconds)"""
+
+    end_time: Optional[float]
+    """When the violation ended, or None if it just started"""
+
+    closest_distance: float
+    """The closest the two people have been during the violation"""
+
+    @property
+    def started(self) -> bool:
+        return self.end_time is None
+
+
+class _PairState:
+    """The violation history of two people"""
+
+    __slots__ = ["people", "violation_times", "active", "start_time",
+                 "closest_distance"]
+
+    def __init__(self, people: Tuple[Hashable, Hashable]):
+        self.people = people
+        # The timestamps of the frames in the window where the pair was
+        # violating the rules
+        self.violation_times = deque()
+        self.active = False
+        self.start_time = 0.0
+        self.closest_distance = float("inf")
+
+
+class _StreamState:
+    """Everything the tracker remembers about one stream"""
+
+    __slots__ = ["frame_times", "pairs", "last_coords", "last_ids",
+                 "last_violations", "untracked_centers", "untracked_ids",
+                 "next_untracked_id"]
+
+    def __init__(self):
+        # The timestamps of the frames in the window
+        self.frame_times = deque()
+        self.pairs: Dict[FrozenSet[Hashable], _PairState] = {}
+
+        # The centers and numbers of the last frame's untracked people, to
+        # match them with the next frame's
+        self.untracked_centers = np.empty((0, 2), dtype=np.float64)
+        self.untracked_ids: List[int] = []
+        self.next_untracked_id = 0
+
+        # The last frame's people and results, to reuse while nobody moves
+        self.last_coords: Optional[np.ndarray] = None
+        self.last_ids: List[Hashable] = []
+        self.last_violations: Optional[Violations] = None
+
+
+class ViolationTracker:
+    """Tracks social distancing violations across frames, and only reports
+    when a pair of people starts or stops violating the rules.
+
+    Like the window_duration and window_threshold of a BrainFrame alarm, a
+    pair is violating the rules once they've been too close in at least
+    window_threshold of the frames in the last window_duration seconds, and
+    stop once they drop below it.
+    """
+
+    def __init__(self, min_distance: float,
+                 engine: str = "grid",
+                 window_duration: float = 5.0,
+                 window_threshold: float = 0.5,
+                 reuse_tolerance: float = 2.0,
+                 match_distance: float = 50.0):
+        """
+        :param min_distance: The minimum distance between two people
+        :param engine: The name of the engine used to find violations, one of
+            distancing.ENGINES
+        :param window_duration: The length of the window, in seconds
+        :param window_threshold: The fraction of frames in the window a pair
+            must be violating in, from 0 to 1
+        :param reuse_tolerance: If the same people moved by at most this many
+            pixels since the last frame, the last frame's results are reused
+        :param match_distance: People without a tracking ID are taken to be
+            the closest untracked person of the last frame whose center was at
+            most this many pixels away. Tracking people in BrainFrame is more
+            reliable, if it's enabled for the stream.
+        """
+        self.min_distance = min_distance
+        self.find_violations = ENGINES[engine]
+        self.window_duration = window_duration
+        self.window_threshold = window_threshold
+        self.reuse_tolerance = reuse_tolerance
+        self.match_distance = match_distance
+
+        self._streams: Dict[int, _StreamState] = {}
+
+        self.frames_computed = 0
+        self.frames_reused = 0
+
+    def update(self, stream_id: int,
+               people: StreamPeople) -> List[ViolationEvent]:
+        """
+        :param stream_id: The stream the frame is from
+        :param people: The people in the frame
+        :return: The violations that started or ended with this frame
+        """
+        state = self._streams.setdefault(stream_id, _StreamState())
+        tstamp = people.tstamp
+
+        # Identify people by their tracking ID, so pairs can be followed
+        # across frames
+        ids = self._identify(state, people)
+        violations = self._find_violations(state, people.coords, ids)
+
+        # Add this frame to the window, and forget frames that left it
+        window_start = tstamp - self.window_duration
+        state.frame_times.append(tstamp)
+        while state.frame_times[0] < window_start:
+            state.frame_times.popleft()
+
+        for i, j, distance in zip(*violations):
+            key = frozenset((ids[i], ids[j]))
+            pair = state.pairs.get(key)
+            if pair is None:
+                pair = state.pairs[key] = _PairState((ids[i], ids[j]))
+            pair.violation_times.append(tstamp)
+            pair.closest_distance = min(pair.closest_distance,
+                                        float(distance))
+
+        events = []
+        for key, pair in list(state.pairs.items()):
+            while pair.violation_times \
+                    and pair.violation_times[0] < window_start:
+                pair.violation_times.popleft()
+
+            fraction = len(pair.violation_times) / len(state.frame_times)
+            violating = fraction >= self.window_threshold
+
+            if violating and not pair.active:
+                pair.active = True
+                pair.start_time = pair.violation_times[0]
+                events.append(ViolationEvent(
+                    stream_id=stream_id,
+                    people=pair.people,
+                    start_time=pair.start_time,
+                    end_time=None,
+                    closest_distance=pair.closest_distance))
+
+            elif not violating and pair.active:
+                pair.active = False
+                events.append(ViolationEvent(
+                    stream_id=stream_id,
+                    people=pair.people,
+                    start_time=pair.start_time,
+                    end_time=tstamp,
+                    closest_distance=pair.closest_distance))
+                # A new violation of the same pair starts from scratch
+                pair.closest_distance = float("inf")
+
+            # Forget pairs that haven't been too close for a whole window
+            if not pair.active and len(pair.violation_times) == 0:
+                del state.pairs[key]
+
+        return events
+
+    def forget_stream(self, stream_id: int) -> None:
+        """Drops everything remembered about a stream, like when it's
+        deleted.
+        """
+        self._streams.pop(stream_id, None)
+
+    def _identify(self, state: _StreamState,
+                  people: StreamPeople) -> List[Hashable]:
+        """
+        :return: The tracking ID of each person, or the number of the
+            matching untracked person of the last frame
+        """
+        ids: List[Hashable] = list(people.track_ids)
+        untracked = [index for index, track_id in enumerate(ids)
+                     if track_id is None]
+        if len(untracked) == 0:
+            state.untracked_centers = np.empty((0, 2), dtype=np.float64)
+            state.untracked_ids = []
+            return ids
+
+        coords = people.coords[untracked]
+        centers = (coords.min(axis=1) + coords.max(axis=1)) / 2
+
+        # Match the closest pairs of centers first, so each person of the
+        # last frame is matched at most once
+        distances = np.linalg.norm(
+            centers[:, None, :] - state.untracked_centers[None, :, :],
+            axis=-1)
+        current, last = np.nonzero(distances <= self.match_distance)
+        closest_first = np.argsort(distances[current, last], kind="stable")
+        matched_current, matched_last = set(), set()
+        for i, j in zip(current[closest_first].tolist(),
+                        last[closest_first].tolist()):
+            if i in matched_current or j in matched_last:
+                continue
+            matched_current.add(i)
+            matched_last.add(j)
+            ids[untracked[i]] = state.untracked_ids[j]
+
+        # Everyone else is someone new
+        for i, index in enumerate(untracked):
+            if i not in matched_current:
+                ids[index] = state.next_untracked_id
+                state.next_untracked_id += 1
+
+        state.untracked_centers = centers
+        state.untracked_ids = [ids[index] for index in untracked]
+        return ids
+
+    def _find_violations(self, state: _StreamState,
+                         coords: np.ndarray,
+                         ids: List[Hashable]) -> Violations:
+        # If the same people are in the frame and have barely moved, the
+        # violations can't have changed much either
+        if state.last_violations is not None \
+                and ids == state.last_ids \
+                and coords.shape == state.last_coords.shape \
+                and (len(coords) == 0
+                     or np.abs(coords - state.last_coords).max()
+                     <= self.reuse_tolerance):
+            self.frames_reused += 1
+            return state.last_violations
+
+        violations = self.find_violations(coords, self.min_distance)
+        self.frames_computed += 1
+
+        # The last computed frame is kept, so slow movement adds up and
+        # eventually causes a recomputation
+        state.last_coords = coords
+        state.last_ids = ids
+        state.last_violations = violations
+        return violations
@@ -0,0 +1,391 @@
+# Import the dependencies
+import json
+import os
+import struct
+import time
+import uuid
+import zlib
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from brainframe.api import BrainFrameAPI, bf_codecs
+from brainframe.api.stubs.zone_statuses import ZONE_STATUS_TYPE
+
+# msgpack is optional. It's more compact and faster than JSON, which is used
+# when it isn't installed.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_MAGIC = b"BFZS"
+_VERSION = 1
+_HEADER = struct.Struct("<4sBc")
+"""The file header: magic bytes, version, and the serialization format, b"m"
+for msgpack or b"j" for JSON
+"""
+_RECORD_LENGTH = struct.Struct("<I")
+"""Every record is prefixed by the length of its compressed body"""
+
+_DETECTION_COLUMNS = ["within", "entering", "exiting"]
+"""The detection lists of a ZoneStatus, stored as columns"""
+
+
+def _dumps(record: dict, serialization: bytes) -> bytes:
+    if serialization == b"m":
+        return msgpack.packb(record, use_bin_type=True)
+    return json.dumps(record, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(data: bytes, serialization: bytes) -> dict:
+    if serialization == b"m":
+        if msgpack is None:
+            raise RuntimeError("This recording was written with msgpack, "
+                               "which must be installed to read it")
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    return json.loads(data)
+
+
+# Helper function to store a list of detections as columns, instead of one
+# dict per detection that repeats every key
+def _detections_to_columns(detections: List[bf_codecs.Detection]) -> dict:
+    columns = {"class_name": [], "coords": [], "num_points": [],
+               "track_id": [], "other": []}
+    for index, detection in enumerate(detections):
+        columns["class_name"].append(detection.class_name)
+        columns["num_points"].append(len(detection.coords))
+        columns["coords"].extend(value for point in detection.coords
+                                 for value in point)
+        columns["track_id"].append(
+            None if detection.track_id is None else str(detection.track_id))
+
+        # Most detections only have the fields above, so the rest are only
+        # stored for the detections that have them
+        if detection.children or detection.attributes \
+                or detection.with_identity or detection.extra_data:
+            detection_dict = detection.to_dict()
+            columns["other"].append([index, {
+                key: detection_dict[key]
+                for key in ["children", "attributes", "with_identity",
+                            "extra_data"]}])
+    return columns
+
+
+def _columns_to_detections(columns: dict,
+                           track_ids: Dict[str, uuid.UUID]) \
+        -> List[bf_codecs.Detection]:
+    """
+    :param columns: Detections stored by _detections_to_columns
+    :param track_ids: Parsed tracking IDs by string. The same people show up
+        in many packets, so their IDs only need to be parsed once.
+    :return: The detections
+    """
+    others = {index: other for index, other in columns["other"]}
+    coords = iter(columns["coords"])
+    detections = []
+    for index, (class_name, num_points, track_id) in enumerate(zip(
+            columns["class_name"], columns["num_points"],
+            columns["track_id"])):
+        if index in others:
+            # This detection has more than the usual fields, so it's parsed
+            # the slow way
+            detection_dict = dict(others[index],
+                                  class_name=class_name,
+                                  coords=[[next(coords), next(coords)]
+                                          for _ in range(num_points)],
+                                  track_id=track_id)
+            detections.append(bf_codecs.Detection.from_dict(detection_dict))
+            continue
+
+        if track_id is not None:
+            parsed_track_id = track_ids.get(track_id)
+            if parsed_track_id is None:
+                parsed_track_id = track_ids[track_id] = uuid.UUID(track_id)
+            track_id = parsed_track_id
+
+        detections.append(bf_codecs.Detection(
+            class_name=class_name,
+            coords=[[next(coords), next(coords)] for _ in range(num_points)],
+            children=[],
+            attributes={},
+            with_identity=None,
+            extra_data={},
+            track_id=track_id))
+    return detections
+
+
+class ZoneStatusRecorder:
+    """Appends zone status packets to a compact binary log, so they can be
+    replayed later without a BrainFrame server.
+
+    Every packet is one zlib compressed record. Zones are only stored the
+    first time they're seen, or when they change, and detections are stored
+    as columns. If the recorder is stopped in the middle of a record, that
+    record is dropped the next time the log is appended to.
+    """
+
+    def __init__(self, log_path: Path, compression_level: int = 6):
+        """
+        :param log_path: The log file. If it already exists, packets are
+            appended to it.
+        :param compression_level: The zlib compression level, from 0 to 9
+        """
+        self.compression_level = compression_level
+        self.packets_written = 0
+        self.bytes_written = 0
+
+        # Zones are stored in a table, by reference
+        self._zone_refs: Dict[str, int] = {}
+
+        log_path = Path(log_path)
+        if log_path.exists() and log_path.stat().st_size > 0:
+            self._serialization, self._zone_refs, end = _scan_log(log_path)
+            self._file: BinaryIO = open(str(log_path), "r+b")
+            # Drop a record left half written by a recorder that was stopped
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._serialization = b"m" if msgpack is not None else b"j"
+            self._file = open(str(log_path), "wb")
+            self._file.write(_HEADER.pack(_MAGIC, _VERSION,
+                                          self._serialization))
+
+    def write(self, zone_status_packet: ZONE_STATUS_TYPE,
+              received_time: Optional[float] = None) -> None:
+        """
+        :param zone_status_packet: A packet from
+            BrainFrameAPI.get_zone_status_stream
+        :param received_time: When the packet was received, in Unix Time
+            (seconds). Replays are paced by this time. Defaults to now.
+        """
+        new_zones = {}
+        statuses = []
+        for stream_id, zone_statuses in zone_status_packet.items():
+            for zone_name, zone_status in zone_statuses.items():
+                zone_json = zone_status.zone.to_json()
+                zone_ref = self._zone_refs.get(zone_json)
+                if zone_ref is None:
+                    zone_ref = self._zone_refs[zone_json] = len(
+                        self._zone_refs)
+                    new_zones[zone_ref] = zone_status.zone.to_dict()
+
+                status = {
+                    "stream_id": stream_id,
+                    "zone": zone_ref,
+                    "tstamp": zone_status.tstamp,
+                    "total_entered": zone_status.total_entered,
+                    "total_exited": zone_status.total_exited,
+                    "alerts": [alert.to_dict()
+                               for alert in zone_status.alerts],
+                }
+                for column in _DETECTION_COLUMNS:
+                    status[column] = _detections_to_columns(
+                        getattr(zone_status, column))
+                statuses.append(status)
+
+        record = {
+            "time": time.time() if received_time is None else received_time,
+            # Keys are strings in JSON, so zones are stored as pairs
+            "zones": list(new_zones.items()),
+            "statuses": statuses,
+        }
+        body = zlib.compress(_dumps(record, self._serialization),
+                             self.compression_level)
+        self._file.write(_RECORD_LENGTH.pack(len(body)) + body)
+
+        self.packets_written += 1
+        self.bytes_written += _RECORD_LENGTH.size + len(body)
+
+    def record(self, zone_status_packets: Iterable[ZONE_STATUS_TYPE]) \
+            -> Iterator[ZONE_STATUS_TYPE]:
+        """Writes every packet that passes through, so the log can be
+        recorded while the packets are being used.
+
+        :param zone_status_packets: Packets, like from
+            BrainFrameAPI.get_zone_status_stream
+        :return: The same packets
+        """
+        for zone_status_packet in zone_status_packets:
+            self.write(zone_status_packet)
+            yield zone_status_packet
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "ZoneStatusRecorder":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+# Helper function that yields the records of a log, with the file offset
+# after each one
+def _iter_records(log_path: Path) -> Iterator[Tuple[bytes, dict, int]]:
+    with open(str(log_path), "rb") as log_file:
+        header = log_file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise IOError(f"{log_path} is not a zone status log")
+        magic, version, serialization = _HEADER.unpack(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise IOError(f"{log_path} is not a zone status log")
+
+        offset = _HEADER.size
+        while True:
+            length_bytes = log_file.read(_RECORD_LENGTH.size)
+            if len(length_bytes) < _RECORD_LENGTH.size:
+                break
+            length, = _RECORD_LENGTH.unpack(length_bytes)
+            body = log_file.read(length)
+            # A record that was cut short is ignored
+            if len(body) < length:
+                break
+            offset += _RECORD_LENGTH.size + length
+            yield serialization, \
+                _loads(zlib.decompress(body), serialization), offset
+
+
+# Helper function to find what a recorder needs to append to a log
+def _scan_log(log_path: Path) -> Tuple[bytes, Dict[str, int], int]:
+    """
+    :return: The serialization format, the zone table, and the offset of the
+        end of the last complete record
+    """
+    zone_refs = {}
+    end = _HEADER.size
+    with open(str(log_path), "rb") as log_file:
+        _, _, serialization = _HEADER.unpack(log_file.read(_HEADER.size))
+    for serialization, record, end in _iter_records(log_path):
+        for zone_ref, zone_dict in record["zones"]:
+            zone_json = bf_codecs.Zone.from_dict(zone_dict).to_json()
+            zone_refs[zone_json] = zone_ref
+    return serialization, zone_refs, end
+
+
+def read_zone_status_log(log_path: Path) \
+        -> Iterator[Tuple[float, ZONE_STATUS_TYPE]]:
+    """
+    :param log_path: A log written by ZoneStatusRecorder
+    :return: A generator of (received time, packet), in the order they were
+        recorded
+    """
+    zones: Dict[int, bf_codecs.Zone] = {}
+    track_ids: Dict[str, uuid.UUID] = {}
+    for _, record, _ in _iter_records(log_path):
+        # Forget old tracking IDs once in a while, so long logs don't use up
+        # memory
+        if len(track_ids) > 100000:
+            track_ids.clear()
+
+        for zone_ref, zone_dict in record["zones"]:
+            zones[zone_ref] = bf_codecs.Zone.from_dict(zone_dict)
+
+        zone_status_packet = {}
+        for status in record["statuses"]:
+            zone = zones[status["zone"]]
+            zone_status = bf_codecs.ZoneStatus(
+                zone=zone,
+                tstamp=status["tstamp"],
+                total_entered=status["total_entered"],
+                total_exited=status["total_exited"],
+                within=_columns_to_detections(status["within"], track_ids),
+                entering=_columns_to_detections(status["entering"], track_ids),
+                exiting=_columns_to_detections(status["exiting"], track_ids),
+                alerts=[bf_codecs.Alert.from_dict(alert)
+                        for alert in status["alerts"]])
+            zone_status_packet.setdefault(status["stream_id"], {})[
+                zone.name] = zone_status
+
+        yield record["time"], zone_status_packet
+
+
+def replay_zone_statuses(log_path: Path, speed: float = 1.0,
+                         loop: bool = False) -> Iterator[ZONE_STATUS_TYPE]:
+    """Plays back a recorded log, as a drop-in replacement for
+    BrainFrameAPI.get_zone_status_stream.
+
+    :param log_path: A log written by ZoneStatusRecorder
+    :param speed: How much faster than real time to play the packets back,
+        like 1 for the original speed or 100 for 100x. 0 plays them back as
+        fast as they can be read.
+    :param loop: If True, the log is played back again from the start when
+        it ends
+    :return: A generator of zone status packets
+    """
+    while True:
+        replay_start = time.perf_counter()
+        first_time = None
+        for received_time, zone_status_packet in \
+                read_zone_status_log(log_path):
+            if speed > 0:
+                if first_time is None:
+                    first_time = received_time
+                # Wait until the packet is due, relative to the first one
+                due = replay_start + (received_time - first_time) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            yield zone_status_packet
+
+        if not loop:
+            break
+
+
+def main():
+    parser = ArgumentParser(
+        description="Record zone status packets from BrainFrame to a log, or "
+                    "print information about a log")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser(
+        "record", help="Record zone status packets from a server")
+    record_parser.add_argument("log", type=Path,
+                               help="The log file to append to")
+    record_parser.add_argument("--server", default="http://localhost",
+                               help="The URL of the BrainFrame server")
+    record_parser.add_argument("--duration", type=float, default=60,
+                               help="How long to record for, in seconds")
+
+    info_parser = subparsers.add_parser(
+        "info", help="Print information about a log")
+    info_parser.add_argument("log", type=Path, help="The log file to read")
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        api = BrainFrameAPI(args.server)
+        end_time = time.perf_counter() + args.duration
+        with ZoneStatusRecorder(args.log) as recorder:
+            for _ in recorder.record(api.get_zone_status_stream()):
+                if time.perf_counter() >= end_time:
+                    break
+        print(f"Recorded {recorder.packets_written} packets, "
+              f"{recorder.bytes_written / 1024:.1f} KB")
+
+    elif args.command == "info":
+        num_packets = 0
+        num_detections = 0
+        first_time = last_time = None
+        for received_time, zone_status_packet in \
+                read_zone_status_log(args.log):
+            num_packets += 1
+            num_detections += sum(len(zone_status.within)
+                                  for zone_statuses
+                                  in zone_status_packet.values()
+                                  for zone_status in zone_statuses.values())
+            first_time = first_time or received_time
+            last_time = received_time
+
+        duration = 0 if num_packets == 0 else last_time - first_time
+        size = os.path.getsize(str(args.log))
+        print(f"{num_packets} packets over {duration:.1f} s, "
+              f"{num_detections} detections within zones, "
+              f"{size / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()